@@ -1,9 +1,5 @@
 import numpy as np
-from collections import deque
 import random
-import torch
-import torch.nn as nn
-import torch.optim as optim
 
 boardtypes = [
     [
@@ -41,144 +37,111 @@ boardtypes = [
     ]
 ]
 
-class DQN(nn.Module):
-    def __init__(self, input_size, output_size):
-        super(DQN, self).__init__()
-        self.network = nn.Sequential(
-            nn.Linear(input_size, 128),
-            nn.ReLU(),
-            nn.Linear(128, 64),
-            nn.ReLU(),
-            nn.Linear(64, output_size)
-        )
-        
-    def forward(self, x):
-        return self.network(x)
-
-class PacmanAI:
-    def __init__(self):
-        self.state_size = 31 * 28
-        self.action_size = 4
-        self.memory = deque(maxlen=2000)
-        self.gamma = 0.95
-        self.epsilon = 1.0
-        self.epsilon_min = 0.01
-        self.epsilon_decay = 0.995
-        self.learning_rate = 0.001
-        
-        self.model = DQN(self.state_size, self.action_size)
-        self.optimizer = optim.Adam(self.model.parameters(), lr=self.learning_rate)
-        self.criterion = nn.MSELoss()
-        
-        try:
-            self.model.load_state_dict(torch.load('pacman_model.pth'))
-            self.model.eval()
-        except:
-            print("Starting with new model")
-
-    def get_state(self, board):
-        state = []
-        for row in board:
-            for cell in row:
-                if cell == '#':
-                    state.append(1)
-                elif cell == '.':
-                    state.append(0.5)
-                elif cell in ['a', 'b', 'c', 'd']:
-                    state.append(-1)
-                elif cell == 'p':
-                    state.append(0.75)
-                else:
-                    state.append(0)
-        return torch.FloatTensor(state)
+EMPTY, WALL, PELLET, POWER, PACMAN = 0, 1, 2, 3, 4
+GHOST_CODES = {'a': 5, 'b': 6, 'c': 7, 'd': 8}
+ENTITY_IDS = "pabcd"
+ENTITY_CODES = np.array([PACMAN, 5, 6, 7, 8], dtype=np.uint8)
+CELL_CHARS = np.frombuffer(b" #.opabcd", dtype=np.uint8)
+
+CHAR_TO_CODE = np.zeros(256, dtype=np.uint8)
+for code, char in enumerate(CELL_CHARS):
+    CHAR_TO_CODE[char] = code
+
+MOVES = ["up", "down", "left", "right"]
+DIRECTIONS = {"up": (-1, 0), "down": (1, 0), "left": (0, -1), "right": (0, 1)}
+
+MODEL_PATH = 'pacman_model.pth'
+
+# what Player.request_ai_move asks for a move: the DQN inference service, or
+# the lookahead search in planner.py once configure_planner() has run
+AI_AGENTS = ("dqn", "planner")
+ai_agent = "dqn"
+
+# torch is only imported once a DQN is actually needed: DQN and PacmanAI live
+# in model.py and are loaded on first access (PEP 562)
+def __getattr__(name):
+    if name in ("DQN", "PacmanAI"):
+        import model
+        return getattr(model, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class GhostAI:
     def __init__(self):
         self.directions = [(0, -1), (0, 1), (-1, 0), (1, 0)]
     
     def get_pacman_position(self, board):
-        for i in range(len(board)):
-            for j in range(len(board[i])):
-                if board[i][j] == 'p':
-                    return (i, j)
-        return None
+        return board.player_position()
     
     def get_ghost_positions(self, board):
-        ghosts = {}
-        for i in range(len(board)):
-            for j in range(len(board[i])):
-                if board[i][j] in ['a', 'b', 'c', 'd']:
-                    ghosts[board[i][j]] = (i, j)
-        return ghosts
+        return board.ghost_positions()
     
     def manhattan_distance(self, pos1, pos2):
         return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1])
     
     def is_valid_move(self, board, ghost_pos, direction):
-        new_pos = (ghost_pos[0] + direction[0], ghost_pos[1] + direction[1])
-        if (0 <= new_pos[0] < len(board) and 
-            0 <= new_pos[1] < len(board[0]) and 
-            board[new_pos[0]][new_pos[1]] != '#'):
-            return True
-        return False
+        x, y = board.wrap(ghost_pos[0] + direction[0], ghost_pos[1] + direction[1])
+        return 0 <= x < board.row and board.grid[x, y] != WALL
+
+    def maze_distance(self, board, pos1, pos2):
+        from mazegraph import get_maze_graph
+        return get_maze_graph(board.rand).distance(pos1, pos2)
+
+    def get_ai_moves(self, board):
+        from mazegraph import get_maze_graph
+        graph = get_maze_graph(board.rand)
+        directions = graph.next_moves(board.entities[1:], board.entities[0])
+        return [MOVES[direction] if direction >= 0 else None for direction in directions]
 
 class Player:
     def __init__(self, player_pos):
         self.points = 0
         self.x = player_pos[0]
         self.y = player_pos[1]
-        self.player_pos = [self.x, self.y]
-        self.ai = PacmanAI()
+
+    @property
+    def player_pos(self):
+        return [self.x, self.y]
 
     def __getitem__(self, index):
         return self.player_pos[index]
     
+    def clone(self):
+        player = Player((self.x, self.y))
+        player.points = self.points
+        return player
+
+    def request_ai_move(self, board):
+        if ai_agent == "planner":
+            from planner import get_planner
+            return get_planner().submit(board, self.points)
+        from inference import get_inference_service
+        from encoding import to_codes
+        return get_inference_service().submit(to_codes(board).reshape(-1))
+
     def get_ai_move(self, board):
-        state = self.ai.get_state(board)
-        return self.ai.act(state)
+        return self.request_ai_move(board).result()
     
+    def target(self, board, move):
+        if move not in DIRECTIONS:
+            return self.x, self.y
+        dx, dy = DIRECTIONS[move]
+        x, y = board.wrap(self.x + dx, self.y + dy)
+        if board.grid[x, y] == WALL:
+            return self.x, self.y
+        return x, y
+
+    def advance(self, board, x, y):
+        if board.grid[x, y] == PELLET:
+            self.points += 1
+        board.grid[x, y] = EMPTY
+        self.x, self.y = x, y
+        board.place(0, x, y)
+
     def move(self, board, move):
-        if move == "up":
-            if board[self.x-1,self.y] in "abcd":
-                return 'death'
-            if board[self.x-1,self.y] != '#':
-                if board[self.x-1,self.y] == '.':
-                    self.points += 1
-                board[self.x,self.y] = ' '
-                self.x -= 1
-                board[self.x,self.y] = 'p'
-                if board[self.x,self.y] == '.':
-                    self.points += 1
-               
-        if move == "down":
-            if board[self.x+1,self.y] in "abcd":
-                return 'death'
-            elif board[self.x+1,self.y] != '#':
-                if board[self.x+1,self.y] == '.':
-                    self.points += 1
-                board[self.x,self.y] = ' '
-                self.x += 1
-                board[self.x,self.y] = 'p'
-                
-        if move == "left":
-            if board[self.x,self.y-1] in "abcd":
-                return 'death'
-            elif board[self.x,self.y-1] != '#':
-                if board[self.x,self.y-1] == '.':
-                    self.points += 1
-                board[self.x,self.y] = ' '
-                self.y -= 1
-                board[self.x,self.y] = 'p'
-                
-        if move == "right":
-            if board[self.x,self.y+1] in "abcd":
-                return 'death'
-            elif board[self.x,self.y+1] != '#':
-                if board[self.x,self.y+1] == '.':
-                    self.points += 1 
-                board[self.x,self.y] = ' '
-                self.y += 1
-                board[self.x,self.y] = 'p'
+        x, y = self.target(board, move)
+        if board.ghost_at(x, y) is not None:
+            return 'death'
+        self.advance(board, x, y)
 
 
 class Ghost:
@@ -186,27 +149,47 @@ class Ghost:
         self.x = ghost_pos[0]
         self.y = ghost_pos[1]
         self.id = id
-        self.position = [self.x, self.y]
-        self.last_block = ' '
+        self.index = ENTITY_IDS.index(id)
+
+    @property
+    def position(self):
+        return [self.x, self.y]
+
+    def clone(self):
+        return Ghost((self.x, self.y), self.id)
+
+    def target(self, board, move):
+        if move not in DIRECTIONS:
+            return self.x, self.y
+        dx, dy = DIRECTIONS[move]
+        x, y = board.wrap(self.x + dx, self.y + dy)
+        if board.grid[x, y] == WALL or board.ghost_at(x, y) is not None:
+            return self.x, self.y
+        return x, y
+
+    def advance(self, board, x, y):
+        self.x, self.y = x, y
+        board.place(self.index, x, y)
 
     def move(self, board, move):
-        if move == "up":
-            if board[self.x - 1, self.y] == 'p':
-                return 'death'
-            elif board[self.x - 1, self.y] not in "abcd#":
-                board[self.x, self.y] = self.last_block
-                self.last_block = board[self.x - 1, self.y]
-                self.x -= 1
-                board[self.x, self.y] = self.id
-           
-        if move == "down":
-            if board[self.x + 1, self.y] == 'p':
-                return 'death'
-            elif board[self.x + 1, self.y] not in "abcd#":
-                board[self.x, self.y] = self.last_block
-                self.last_block = board[self.x + 1, self.y]
-                self.x += 1
-                board[self.x, self.y] = self.id
+        x, y = self.target(board, move)
+        if board.player_position() == (x, y):
+            return 'death'
+        self.advance(board, x, y)
+
+
+def resolve_moves(board, player, ghosts, player_move=None, ghost_moves=None):
+    # both sides move at once: pacman dies if it ends on a ghost or swaps places with one
+    ghost_moves = ghost_moves or [None] * len(ghosts)
+    start = (player.x, player.y)
+    target = player.target(board, player_move)
+    for ghost, move in zip(ghosts, ghost_moves):
+        before = (ghost.x, ghost.y)
+        x, y = ghost.target(board, move)
+        ghost.advance(board, x, y)
+        if (x, y) == target or ((x, y) == start and before == target):
+            return 'death'
+    player.advance(board, *target)
 
 class Board:
     def __init__(self):
@@ -214,19 +197,67 @@ class Board:
         rand = random.randint(0, len(boardtypes)-1)
         arr = boardtypes[rand]
         self.rand = rand
-        np_board = np.array([list(row) for row in arr])
-        self.board = np_board
-        self.row, self.col = self.board.shape
+        chars = np.frombuffer(''.join(arr).encode(), dtype=np.uint8).reshape(len(arr), -1)
+        codes = CHAR_TO_CODE[chars]
+        self.row, self.col = codes.shape
+        # entities live in their own table so the grid only holds terrain and pellets
+        self.entities = np.zeros((len(ENTITY_IDS), 2), dtype=np.intp)
+        for index, code in enumerate(ENTITY_CODES):
+            self.entities[index] = np.argwhere(codes == code)[0]
+        codes[codes >= PACMAN] = EMPTY
+        self.grid = codes
         self.positions = self.get_positions()
         rows, cols = self.row, self.col
 
+    # grid and entities are the only state a move changes; used by the planner
+    # to search on copies
+    def clone(self):
+        board = Board.__new__(Board)
+        board.__dict__.update(self.__dict__)
+        board.grid = self.grid.copy()
+        board.entities = self.entities.copy()
+        return board
+
+    def wrap(self, x, y):
+        return x, y % self.col
+
+    def place(self, index, x, y):
+        self.entities[index, 0] = x
+        self.entities[index, 1] = y
+
+    def player_position(self):
+        return (int(self.entities[0, 0]), int(self.entities[0, 1]))
+
+    def ghost_positions(self):
+        return {
+            ENTITY_IDS[index]: (int(self.entities[index, 0]), int(self.entities[index, 1]))
+            for index in range(1, len(ENTITY_IDS))
+        }
+
+    def ghost_at(self, x, y):
+        for index in range(1, len(ENTITY_IDS)):
+            if self.entities[index, 0] == x and self.entities[index, 1] == y:
+                return ENTITY_IDS[index]
+        return None
+
     def get_positions(self):
-        positions = {'player': None, 'ghosts': []}
-        for i in range(len(self.board)):
-            for j in range(len(self.board[i])):
-                if self.board[i][j] == 'p':
-                    positions['player'] = (i, j)
-                elif self.board[i][j] in ['a', 'b', 'c', 'd']:
-                    positions['ghosts'].append((i, j))
-        return positions
- 
+        ghosts = self.ghost_positions()
+        return {'player': self.player_position(), 'ghosts': [ghosts[id] for id in "abcd"]}
+
+    def pellets_remaining(self):
+        return int(np.count_nonzero(self.grid == PELLET))
+
+    def occupancy(self):
+        mask = np.zeros(self.grid.shape, dtype=bool)
+        mask[self.entities[:, 0], self.entities[:, 1]] = True
+        return mask
+
+    def codes(self):
+        codes = self.grid.copy()
+        codes[self.entities[1:, 0], self.entities[1:, 1]] = ENTITY_CODES[1:]
+        codes[self.entities[0, 0], self.entities[0, 1]] = PACMAN
+        return codes
+
+    def get_board(self):
+        chars = CELL_CHARS[self.codes()].tobytes().decode()
+        return [chars[i:i + self.col] for i in range(0, len(chars), self.col)]
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from urllib.parse import parse_qs
+import socketio
+from socketio.exceptions import ConnectionRefusedError
+from broadcast import get_mode
+from matches import move_status, requested_side
+from tokens import get_entry, set_notifier, token_room
+from ticks import TickScheduler, DEFAULT_TICK_RATE
+
+logger = logging.getLogger(__name__)
+
+# asyncio server mode: python-socketio's AsyncServer holds the sockets on one
+# event loop and the Flask routes run through asgiref's WsgiToAsgi, which
+# calls them on a thread pool. Anything that can block (match and queue
+# locks, waiting on the DQN) goes to a worker thread via to_thread.
+
+
+class LoopEmitter:
+    # a plain emit(event, data, to=...) callable for the game code, usable
+    # from the loop itself or from tick, timer and mail threads
+    def __init__(self, sio, loop):
+        self.sio = sio
+        self.loop = loop
+
+    def __call__(self, event, data=None, to=None, **kwargs):
+        coroutine = self.sio.emit(event, data, to=to, **kwargs)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self.loop.create_task(coroutine)
+        else:
+            asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+def bearer_token(environ):
+    auth = environ.get('HTTP_AUTHORIZATION')
+    if not auth or ' ' not in auth:
+        return None
+    return auth.split(' ')[1]
+
+
+def create_app(flask_app, registry, sessions, tick_rate=DEFAULT_TICK_RATE):
+    from asgiref.wsgi import WsgiToAsgi
+
+    sio = socketio.AsyncServer(async_mode='asgi')
+    # no tick_rate when the registry is sharded, the workers tick their matches
+    scheduler = TickScheduler(registry, tick_rate) if tick_rate else None
+
+    def request_match(environ):
+        match_id = parse_qs(environ.get('QUERY_STRING', '')).get('match', [None])[0]
+        if match_id:
+            return registry.get(match_id)
+        return registry.get_default()
+
+    @sio.event
+    async def connect(sid, environ, auth=None):
+        token = bearer_token(environ)
+        match, side = registry.find_by_token(token)
+        authorized = match is not None
+        if match is None and token:
+            await sio.enter_room(sid, token_room(token))
+            entry = await asyncio.to_thread(get_entry, token)
+            if entry is not None:
+                await sio.emit('queue-position', entry, to=sid)
+        if match is None:
+            match = await asyncio.to_thread(request_match, environ)
+            if match is None:
+                raise ConnectionRefusedError('Unknown match')
+            side = await asyncio.to_thread(match.take_seat, requested_side(auth))
+        mode = get_mode(auth)
+        await sio.enter_room(sid, match.room)
+        await sio.enter_room(sid, match.stream_room(mode))
+        await asyncio.to_thread(match.add_viewer, mode)
+        session = sessions[sid] = {"match": match.id, "side": side, "mode": mode, "authorized": authorized}
+        if side is not None:
+            connected = await asyncio.to_thread(match.connect, side, environ.get('HTTP_NAME'))
+            session["seat"] = connected[f"{side}_id"]
+            await sio.emit('connected', connected, to=match.room)
+        await sio.emit(*await asyncio.to_thread(match.snapshot, mode), to=sid)
+
+    def get_session_match(sid):
+        session = sessions.get(sid)
+        if session is None:
+            return None, None
+        return registry.get(session["match"]), session
+
+    @sio.event
+    async def move(sid, data):
+        match, session = get_session_match(sid)
+        if match is None or not session["authorized"]:
+            return {"error": "Unauthorized"}
+        status = await asyncio.to_thread(match.submit, session["side"], data)
+        body, code = move_status(match, session["side"], status)
+        return body
+
+    @sio.event
+    async def resync(sid, *args):
+        match, session = get_session_match(sid)
+        if match is not None:
+            await sio.emit(*await asyncio.to_thread(match.snapshot, session["mode"]), to=sid)
+
+    @sio.event
+    async def disconnect(sid, *args):
+        match, session = get_session_match(sid)
+        sessions.pop(sid, None)
+        if match is not None:
+            await asyncio.to_thread(match.remove_viewer, session["mode"])
+            if "seat" in session:
+                await asyncio.to_thread(match.disconnect, session["side"], session["seat"])
+
+    async def startup():
+        emit = LoopEmitter(sio, asyncio.get_running_loop())
+        registry.set_emit(emit)
+        set_notifier(emit)
+        if scheduler is not None:
+            sio.start_background_task(scheduler.run_async)
+
+    async def shutdown():
+        if scheduler is not None:
+            scheduler.stop()
+
+    app = socketio.ASGIApp(sio, WsgiToAsgi(flask_app), on_startup=startup, on_shutdown=shutdown)
+    app.sio = sio
+    app.scheduler = scheduler
+    return app
+
+
+def serve(flask_app, registry, sessions, port=5000, tick_rate=DEFAULT_TICK_RATE, host='0.0.0.0'):
+    import uvicorn
+    app = create_app(flask_app, registry, sessions, tick_rate)
+    uvicorn.run(app, host=host, port=port, log_level="info")
@@ -0,0 +1,148 @@
+import struct
+import numpy as np
+from Game import CELL_CHARS, ENTITY_IDS, ENTITY_CODES
+
+FULL = "full"
+DELTA = "delta"
+BINARY = "binary"
+MODES = (FULL, DELTA, BINARY)
+
+# binary frames: a little endian header (version, flags, rows, cols, seq,
+# points), the five entity positions as (x, y) bytes in ENTITY_IDS order,
+# then for a keyframe every terrain cell at 4 bits, high nibble first, or
+# for a delta one u16 per changed terrain cell, code << 12 | row * cols + col.
+# Cells never hold entities, decoders draw them from the positions.
+BINARY_VERSION = 1
+KEYFRAME = 1
+HEADER = struct.Struct("<BBBBII")
+ENTITY_BYTES = 2 * len(ENTITY_IDS)
+
+
+def get_mode(auth):
+    capabilities = (auth or {}).get('capabilities') or []
+    for mode in (BINARY, DELTA):
+        if mode in capabilities:
+            return mode
+    return FULL
+
+
+def pack_cells(grid):
+    flat = grid.reshape(-1)
+    if len(flat) % 2:
+        flat = np.append(flat, 0)
+    return ((flat[0::2] << 4) | flat[1::2]).astype(np.uint8).tobytes()
+
+
+def unpack_cells(data, rows, cols):
+    packed = np.frombuffer(data, dtype=np.uint8)
+    cells = np.empty(len(packed) * 2, dtype=np.uint8)
+    cells[0::2] = packed >> 4
+    cells[1::2] = packed & 15
+    return cells[:rows * cols].reshape(rows, cols)
+
+
+def encode_binary(flags, rows, cols, seq, points, positions, body):
+    return HEADER.pack(BINARY_VERSION, flags, rows, cols, seq, points) + positions.tobytes() + body
+
+
+# the server side inverse of encode_binary, for tools and benchmarks; the
+# clients have their own in clients/board_sync.py and static/index.js
+def decode_binary(data):
+    version, flags, rows, cols, seq, points = HEADER.unpack_from(data)
+    if version != BINARY_VERSION:
+        raise ValueError(f"unsupported binary frame version {version}")
+    positions = np.frombuffer(data, dtype=np.uint8, count=ENTITY_BYTES, offset=HEADER.size).reshape(-1, 2)
+    body = data[HEADER.size + ENTITY_BYTES:]
+    frame = {"seq": seq, "points": points, "keyframe": bool(flags & KEYFRAME), "entities": positions}
+    if flags & KEYFRAME:
+        frame["grid"] = unpack_cells(body, rows, cols)
+    else:
+        changes = np.frombuffer(body, dtype="<u2")
+        frame["cells"] = [(int(index) // cols, int(index) % cols, int(code))
+                          for index, code in zip(changes & 0xFFF, changes >> 12)]
+    return frame
+
+
+# terrain from a keyframe or an applied delta plus the positions, drawn like
+# Board.codes(): ghosts first, pacman on top
+def binary_codes(grid, positions):
+    codes = grid.copy()
+    codes[positions[1:, 0], positions[1:, 1]] = ENTITY_CODES[1:]
+    codes[positions[0, 0], positions[0, 1]] = ENTITY_CODES[0]
+    return codes
+
+
+class BoardStream:
+    def __init__(self, board, points=0):
+        self.seq = 0
+        self.rebase(board, points)
+
+    def rebase(self, board, points):
+        self.grid = board.grid.copy()
+        self.positions = board.entities.astype(np.uint8)
+        self.codes = board.codes()
+        self.codes_seq = self.seq + 1
+        self.changed = np.empty(0, dtype=np.intp)
+        self.terrain_changed = np.empty(0, dtype=np.intp)
+        self.points = points
+        self.seq += 1
+
+    def get_entities(self):
+        return dict(zip(ENTITY_IDS, self.positions.tolist()))
+
+    # the cell codes with entities are only kept up to date while someone
+    # needs json deltas; otherwise they are redrawn on the next keyframe
+    def current_codes(self):
+        if self.codes_seq != self.seq:
+            self.codes = binary_codes(self.grid, self.positions)
+            self.codes_seq = self.seq
+        return self.codes
+
+    # advance() only tracks what changed; delta() and binary_delta() build
+    # the frames for it, so a mode nobody watches costs nothing. delta() is
+    # only valid after an advance() with codes=True.
+    def advance(self, board, points, codes=True):
+        before = self.current_codes() if codes else None
+        self.terrain_changed = np.flatnonzero(board.grid != self.grid)
+        self.grid[...] = board.grid
+        self.positions = board.entities.astype(np.uint8)
+        self.points = points
+        self.seq += 1
+        if codes:
+            self.codes = board.codes()
+            self.codes_seq = self.seq
+            self.changed = np.flatnonzero(self.codes != before)
+
+    def update(self, board, points):
+        self.advance(board, points)
+        return self.delta()
+
+    def delta(self):
+        xs, ys = np.unravel_index(self.changed, self.codes.shape)
+        chars = CELL_CHARS[self.codes.reshape(-1)[self.changed]].tobytes().decode()
+        return {
+            "seq": self.seq,
+            "cells": [[int(x), int(y), char] for x, y, char in zip(xs, ys, chars)],
+            "entities": self.get_entities(),
+            "points": self.points
+        }
+
+    def keyframe(self):
+        codes = self.current_codes()
+        chars = CELL_CHARS[codes].tobytes().decode()
+        cols = codes.shape[1]
+        return {
+            "seq": self.seq,
+            "board": [chars[i:i + cols] for i in range(0, len(chars), cols)],
+            "entities": self.get_entities(),
+            "points": self.points
+        }
+
+    def binary_keyframe(self):
+        rows, cols = self.grid.shape
+        return encode_binary(KEYFRAME, rows, cols, self.seq, self.points, self.positions, pack_cells(self.grid))
+
+    def binary_delta(self):
+        rows, cols = self.grid.shape
+        changes = (self.grid.reshape(-1)[self.terrain_changed].astype("<u2") << 12) | self.terrain_changed.astype("<u2")
+        return encode_binary(0, rows, cols, self.seq, self.points, self.positions, changes.tobytes())
@@ -0,0 +1,222 @@
+import base64
+import itertools
+import json
+import logging
+import multiprocessing
+import threading
+
+logger = logging.getLogger(__name__)
+
+# publish/subscribe between the front process and the match workers.
+# Every bus has publish(channel, message), subscribe(channel, handler) and
+# close(); endpoint() returns a picklable handle a worker process calls
+# open() on to get its own connection to the same bus.
+
+
+def dispatch(handlers, channel, message):
+    for handler in handlers.get(channel, ()):
+        try:
+            handler(message)
+        except Exception:
+            logger.exception("bus handler for %s failed", channel)
+
+
+class LocalBus:
+    # one process; workers run as threads and endpoint() is the bus itself
+    def __init__(self):
+        self.handlers = {}
+        self.lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self.lock:
+            handlers = {channel: list(self.handlers.get(channel, ()))}
+        dispatch(handlers, channel, message)
+
+    def subscribe(self, channel, handler):
+        with self.lock:
+            self.handlers.setdefault(channel, []).append(handler)
+
+    def endpoint(self):
+        return self
+
+    def open(self):
+        return self
+
+    def close(self):
+        pass
+
+
+class ProcessBusEndpoint:
+    def __init__(self, hub, inbox, client_id):
+        self.hub = hub
+        self.inbox = inbox
+        self.client_id = client_id
+
+    def open(self):
+        return ProcessBusClient(self.hub, self.inbox, self.client_id)
+
+
+class ProcessBusClient:
+    # a worker's side of a ProcessBus: publishes and subscriptions go to the
+    # hub, deliveries arrive on this client's own inbox queue
+    def __init__(self, hub, inbox, client_id):
+        self.hub = hub
+        self.inbox = inbox
+        self.client_id = client_id
+        self.handlers = {}
+        self.thread = threading.Thread(target=self.run, name=f"bus-{client_id}", daemon=True)
+        self.thread.start()
+
+    def publish(self, channel, message):
+        self.hub.put(("publish", channel, message))
+
+    def subscribe(self, channel, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+        self.hub.put(("subscribe", channel, self.client_id))
+
+    def run(self):
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                break
+            dispatch(self.handlers, *item)
+
+    def close(self):
+        self.inbox.put(None)
+
+
+class ProcessBus:
+    # multiprocessing queues with the front process as broker: a hub thread
+    # reads every publish and forwards it to the inbox of each subscriber
+    def __init__(self, context=None):
+        self.context = context or multiprocessing.get_context("spawn")
+        self.hub = self.context.Queue()
+        self.inboxes = {}
+        self.subscribers = {}
+        self.handlers = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="bus-hub", daemon=True)
+        self.thread.start()
+
+    def endpoint(self):
+        client_id = next(self.ids)
+        inbox = self.context.Queue()
+        with self.lock:
+            self.inboxes[client_id] = inbox
+        return ProcessBusEndpoint(self.hub, inbox, client_id)
+
+    def publish(self, channel, message):
+        self.hub.put(("publish", channel, message))
+
+    def subscribe(self, channel, handler):
+        with self.lock:
+            self.handlers.setdefault(channel, []).append(handler)
+
+    def route(self, channel, message):
+        with self.lock:
+            inboxes = [self.inboxes[client_id] for client_id in self.subscribers.get(channel, ())]
+            handlers = {channel: list(self.handlers.get(channel, ()))}
+        for inbox in inboxes:
+            inbox.put((channel, message))
+        dispatch(handlers, channel, message)
+
+    def run(self):
+        while True:
+            item = self.hub.get()
+            if item is None:
+                break
+            kind, channel, payload = item
+            if kind == "subscribe":
+                with self.lock:
+                    self.subscribers.setdefault(channel, set()).add(payload)
+            else:
+                self.route(channel, payload)
+
+    def close(self):
+        self.hub.put(None)
+        with self.lock:
+            for inbox in self.inboxes.values():
+                inbox.put(None)
+
+
+# binary board frames travel through JSON as base64
+def encode_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode()}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def decode_bytes(value):
+    if "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    return value
+
+
+class RedisEndpoint:
+    def __init__(self, url):
+        self.url = url
+
+    def open(self):
+        return RedisBus.from_url(self.url)
+
+
+class RedisBus:
+    # Redis pub/sub with JSON messages; client only needs publish() and
+    # pubsub(), so any Redis-protocol compatible server or stand-in works
+    def __init__(self, client, url=None):
+        self.client = client
+        self.url = url
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self.handlers = {}
+        self.lock = threading.Lock()
+        self.running = True
+        self.thread = None
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url), url)
+
+    def publish(self, channel, message):
+        self.client.publish(channel, json.dumps(message, default=encode_bytes))
+
+    def subscribe(self, channel, handler):
+        with self.lock:
+            self.handlers.setdefault(channel, []).append(handler)
+            self.pubsub.subscribe(channel)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="bus-redis", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while self.running:
+            item = self.pubsub.get_message(timeout=1.0)
+            if item is None or item.get("type") != "message":
+                continue
+            channel = item["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            with self.lock:
+                handlers = {channel: list(self.handlers.get(channel, ()))}
+            dispatch(handlers, channel, json.loads(item["data"], object_hook=decode_bytes))
+
+    def endpoint(self):
+        if self.url is None:
+            raise ValueError("a RedisBus built from a client object cannot be shared with worker processes")
+        return RedisEndpoint(self.url)
+
+    def open(self):
+        return self
+
+    def close(self):
+        self.running = False
+        self.pubsub.close()
+
+
+def create_bus(url=None):
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBus.from_url(url)
+    if url == "local":
+        return LocalBus()
+    return ProcessBus()
@@ -0,0 +1,45 @@
+import json
+import os
+
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoints')
+LATEST_FILE = 'latest.json'
+KEEP_CHECKPOINTS = 5
+
+
+def checkpoint_path(directory, version):
+    return os.path.join(directory, f"pacman-{version:06d}.pth")
+
+
+def write_atomic(path, write):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+# the weights file is complete before latest.json names it, so a reader never
+# sees a half written checkpoint
+def save_checkpoint(model, version, directory=CHECKPOINT_DIR, keep=KEEP_CHECKPOINTS):
+    import torch
+    os.makedirs(directory, exist_ok=True)
+    path = checkpoint_path(directory, version)
+    write_atomic(path, lambda tmp: torch.save(model.state_dict(), tmp))
+
+    def write_latest(tmp):
+        with open(tmp, "w") as f:
+            json.dump({"version": version, "path": os.path.basename(path)}, f)
+    write_atomic(os.path.join(directory, LATEST_FILE), write_latest)
+
+    if keep:
+        old = checkpoint_path(directory, version - keep)
+        if os.path.exists(old):
+            os.remove(old)
+    return path
+
+
+def latest_checkpoint(directory=CHECKPOINT_DIR):
+    try:
+        with open(os.path.join(directory, LATEST_FILE)) as f:
+            latest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return 0, None
+    return latest["version"], os.path.join(directory, latest["path"])
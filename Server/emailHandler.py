@@ -1,31 +1,40 @@
+import os
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = "587"
-SMTP_USERNAME  = ""
-SMTP_PASSWORD = ""
-EMAIL_FROM = ""
+SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = os.environ.get("SMTP_PORT", "587")
+SMTP_USERNAME  = os.environ.get("SMTP_USERNAME", "")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") == "1"
+EMAIL_FROM = os.environ.get("EMAIL_FROM", "")
 
 
-def sendEmail(token,email):
-    try:
-        server = smtplib.SMTP(SMTP_SERVER,SMTP_PORT,)
+def connect():
+    server = smtplib.SMTP(SMTP_SERVER,SMTP_PORT)
+    if SMTP_STARTTLS:
         server.starttls()
+    if SMTP_USERNAME:
         server.login(SMTP_USERNAME,SMTP_PASSWORD)
+    return server
+
 
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_FROM
-        msg['To'] = email
-        msg['Subject'] = "EXML token"
+def build_message(token,email):
+    msg = MIMEMultipart()
+    msg['From'] = EMAIL_FROM
+    msg['To'] = email
+    msg['Subject'] = "EXML token"
 
-        body = f'Your token is: {token}, Input your token in site to check your position in queue'
-        msg.attach(MIMEText(body,'plain'))
+    body = f'Your token is: {token}, Input your token in site to check your position in queue'
+    msg.attach(MIMEText(body,'plain'))
+    return msg.as_string()
 
-        text = msg.as_string()
-    
-        server.sendmail(EMAIL_FROM,email,text)
+
+def sendEmail(token,email):
+    try:
+        server = connect()
+        server.sendmail(EMAIL_FROM,email,build_message(token,email))
         server.quit()
     except smtplib.SMTPException as e:
 
@@ -0,0 +1,74 @@
+import numpy as np
+from Game import CHAR_TO_CODE, ENTITY_CODES, WALL, PELLET, POWER, PACMAN, GHOST_CODES
+
+ROWS, COLS = 31, 28
+STATE_SIZE = ROWS * COLS
+
+# feature value per cell code, same values the old if/elif chain produced
+STATE_VALUES = np.zeros(int(ENTITY_CODES.max()) + 1, dtype=np.float32)
+STATE_VALUES[WALL] = 1
+STATE_VALUES[PELLET] = 0.5
+STATE_VALUES[PACMAN] = 0.75
+STATE_VALUES[list(GHOST_CODES.values())] = -1
+
+PLANES = ("walls", "pellets", "power", "ghosts", "pacman")
+PLANE_VALUES = np.zeros((len(PLANES), len(STATE_VALUES)), dtype=np.float32)
+PLANE_VALUES[0, WALL] = 1
+PLANE_VALUES[1, PELLET] = 1
+PLANE_VALUES[2, POWER] = 1
+PLANE_VALUES[3, list(GHOST_CODES.values())] = 1
+PLANE_VALUES[4, PACMAN] = 1
+
+
+def to_codes(board):
+    if hasattr(board, 'codes'):
+        return board.codes()
+    if isinstance(board, np.ndarray):
+        return board
+    return CHAR_TO_CODE[np.frombuffer(''.join(board).encode(), dtype=np.uint8)]
+
+
+class StateEncoder:
+    # encode() and encode_batch() return views of one reused buffer, so the
+    # result is only valid until the next call
+    def __init__(self, batch_size=1, planes=False, rows=ROWS, cols=COLS):
+        self.planes = planes
+        self.rows = rows
+        self.cols = cols
+        self.state_size = rows * cols
+        self.allocate(batch_size)
+
+    def allocate(self, batch_size):
+        if self.planes:
+            shape = (batch_size, len(PLANES), self.state_size)
+        else:
+            shape = (batch_size, self.state_size)
+        self.buffer = np.zeros(shape, dtype=np.float32)
+        import torch
+        self.tensor = torch.from_numpy(self.buffer)
+
+    def fill(self, codes):
+        count = len(codes)
+        if count > len(self.buffer):
+            self.allocate(count)
+        if self.planes:
+            for plane in range(len(PLANES)):
+                np.take(PLANE_VALUES[plane], codes, out=self.buffer[:count, plane])
+            return self.tensor[:count].view(count, len(PLANES), self.rows, self.cols)
+        np.take(STATE_VALUES, codes, out=self.buffer[:count])
+        return self.tensor[:count]
+
+    def encode(self, board):
+        return self.fill(to_codes(board).reshape(1, -1))[0]
+
+    def encode_batch(self, boards):
+        if isinstance(boards, np.ndarray):
+            codes = boards.reshape(len(boards), -1)
+        else:
+            codes = np.stack([to_codes(board).reshape(-1) for board in boards])
+        return self.fill(codes)
+
+
+def encode_state(board):
+    import torch
+    return torch.from_numpy(STATE_VALUES[to_codes(board).reshape(-1)])
@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import numpy as np
+from encoding import STATE_SIZE
+
+DEFAULT_CAPACITY = 100000
+ALPHA = 0.6
+BETA = 0.4
+PRIORITY_EPSILON = 1e-3
+
+FIELDS = ("states", "next_states", "actions", "rewards", "dones")
+META_FILE = "meta.json"
+
+
+# board codes are 0..8, so two cells share one byte
+def pack(codes):
+    codes = np.asarray(codes, dtype=np.uint8)
+    if codes.shape[-1] % 2:
+        codes = np.concatenate([codes, np.zeros(codes.shape[:-1] + (1,), dtype=np.uint8)], axis=-1)
+    return (codes[..., 0::2] << 4) | codes[..., 1::2]
+
+
+def unpack(packed, state_size=STATE_SIZE):
+    codes = np.empty(packed.shape[:-1] + (packed.shape[-1] * 2,), dtype=np.uint8)
+    np.right_shift(packed, 4, out=codes[..., 0::2])
+    np.bitwise_and(packed, 0x0f, out=codes[..., 1::2])
+    return codes[..., :state_size]
+
+
+class SumTree:
+    # complete binary tree over the leaves in one flat array: node i has
+    # children 2i and 2i+1 and the leaves start at self.leaves
+    def __init__(self, capacity):
+        self.leaves = 1 << max(0, int(capacity - 1).bit_length())
+        self.tree = np.zeros(2 * self.leaves, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices):
+        return self.tree[self.leaves + indices]
+
+    def update(self, indices, values):
+        nodes = self.leaves + np.asarray(indices)
+        self.tree[nodes] = values
+        nodes = np.unique(nodes >> 1)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes >> 1)
+
+    # one descent per level for the whole batch
+    def find(self, values):
+        nodes = np.ones(len(values), dtype=np.intp)
+        values = np.array(values, dtype=np.float64)
+        while nodes[0] < self.leaves:
+            left = 2 * nodes
+            left_sum = self.tree[left]
+            right = values > left_sum
+            values -= np.where(right, left_sum, 0)
+            nodes = left + right
+        return nodes - self.leaves
+
+
+class ReplayBuffer:
+    # fixed capacity ring of transitions stored as packed uint8 board codes;
+    # with a path the arrays are .npy memmaps that survive restarts
+    def __init__(self, capacity=DEFAULT_CAPACITY, state_size=STATE_SIZE, path=None,
+                 alpha=ALPHA, seed=None):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.path = path
+        self.alpha = alpha
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.size = 0
+        self.index = 0
+        self.max_priority = 1.0
+
+        packed_size = (state_size + 1) // 2
+        shapes = {
+            "states": ((capacity, packed_size), np.uint8),
+            "next_states": ((capacity, packed_size), np.uint8),
+            "actions": ((capacity,), np.int8),
+            "rewards": ((capacity,), np.float32),
+            "dones": ((capacity,), np.bool_),
+        }
+        if path:
+            os.makedirs(path, exist_ok=True)
+            meta = self.read_meta()
+            if meta and (meta["capacity"], meta["state_size"]) != (capacity, state_size):
+                raise ValueError(f"{path} holds a buffer of {meta['capacity']} x {meta['state_size']}")
+            mode = "r+" if meta else "w+"
+            for name, (shape, dtype) in shapes.items():
+                file = os.path.join(path, f"{name}.npy")
+                if mode == "r+":
+                    setattr(self, name, np.load(file, mmap_mode="r+"))
+                else:
+                    setattr(self, name, np.lib.format.open_memmap(file, mode="w+", dtype=dtype, shape=shape))
+            if meta:
+                self.size = meta["size"]
+                self.index = meta["index"]
+                self.max_priority = meta["max_priority"]
+        else:
+            for name, (shape, dtype) in shapes.items():
+                setattr(self, name, np.zeros(shape, dtype=dtype))
+
+        self.priorities = SumTree(capacity)
+        if self.size:
+            # priorities are not persisted; reloaded transitions start equal
+            self.priorities.update(np.arange(self.size), self.max_priority ** self.alpha)
+
+    def __len__(self):
+        return self.size
+
+    def read_meta(self):
+        try:
+            with open(os.path.join(self.path, META_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def flush(self):
+        if not self.path:
+            return
+        with self.lock:
+            for name in FIELDS:
+                getattr(self, name).flush()
+            meta = {"capacity": self.capacity, "state_size": self.state_size, "size": self.size,
+                    "index": self.index, "max_priority": self.max_priority}
+        tmp = os.path.join(self.path, f"{META_FILE}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, META_FILE))
+
+    def push(self, state, action, reward, next_state, done):
+        return self.push_batch(np.asarray(state).reshape(1, -1), [action], [reward],
+                               np.asarray(next_state).reshape(1, -1), [done])
+
+    # states are (n, state_size) cell codes, as produced by VecPacmanEnv.codes()
+    # or ReplayReader.transitions(); returns the slots written
+    def push_batch(self, states, actions, rewards, next_states, dones):
+        count = len(actions)
+        if count > self.capacity:
+            states, actions, rewards = states[-self.capacity:], actions[-self.capacity:], rewards[-self.capacity:]
+            next_states, dones = next_states[-self.capacity:], dones[-self.capacity:]
+            count = self.capacity
+        states = pack(np.asarray(states).reshape(count, -1))
+        next_states = pack(np.asarray(next_states).reshape(count, -1))
+        with self.lock:
+            slots = (self.index + np.arange(count)) % self.capacity
+            self.states[slots] = states
+            self.next_states[slots] = next_states
+            self.actions[slots] = actions
+            self.rewards[slots] = rewards
+            self.dones[slots] = dones
+            self.priorities.update(slots, self.max_priority ** self.alpha)
+            self.index = (self.index + count) % self.capacity
+            self.size = min(self.size + count, self.capacity)
+        return slots
+
+    def extend(self, transitions):
+        for state, action, reward, next_state, done in transitions:
+            self.push(state, action, reward, next_state, done)
+
+    def gather(self, indices):
+        return (
+            unpack(self.states[indices], self.state_size),
+            self.actions[indices].astype(np.int64),
+            self.rewards[indices],
+            unpack(self.next_states[indices], self.state_size),
+            self.dones[indices],
+        )
+
+    def sample(self, batch_size):
+        with self.lock:
+            if self.size == 0:
+                raise ValueError("cannot sample from an empty replay buffer")
+            indices = self.rng.integers(0, self.size, batch_size)
+            return self.gather(indices) + (indices, np.ones(batch_size, dtype=np.float32))
+
+    # proportional prioritized replay: slot i is drawn with probability
+    # p_i^alpha / sum(p^alpha), weights correct the bias by (N * P(i))^-beta
+    def sample_prioritized(self, batch_size, beta=BETA):
+        with self.lock:
+            if self.size == 0:
+                raise ValueError("cannot sample from an empty replay buffer")
+            total = self.priorities.total()
+            segment = total / batch_size
+            values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+            indices = np.minimum(self.priorities.find(values), self.size - 1)
+            probabilities = self.priorities.get(indices) / total
+            weights = (self.size * probabilities) ** -beta
+            weights = (weights / weights.max()).astype(np.float32)
+            return self.gather(indices) + (indices, weights)
+
+    def update_priorities(self, indices, errors):
+        priorities = np.abs(np.asarray(errors, dtype=np.float64)) + PRIORITY_EPSILON
+        with self.lock:
+            self.max_priority = max(self.max_priority, float(priorities.max()))
+            self.priorities.update(indices, priorities ** self.alpha)
@@ -0,0 +1,126 @@
+import argparse
+import glob
+import io
+import json
+import sys
+import time
+import warnings
+import numpy as np
+import torch
+from Game import MODEL_PATH
+from model import BACKENDS, compile_model, load_model, exported_path
+from encoding import StateEncoder
+from checkpoints import write_atomic
+
+DEFAULT_STATES = 5000
+MIN_AGREEMENT = 0.99
+LATENCY_CALLS = 2000
+
+
+def save_scripted(model, path):
+    with warnings.catch_warnings():
+        # TorchScript serialization is deprecated in favour of torch.export
+        warnings.simplefilter("ignore")
+        write_atomic(path, lambda tmp: torch.jit.save(model, tmp))
+
+
+# compiles the fp32 model already loaded from path, so a fresh model (no
+# checkpoint yet) is compared against its own export
+def export(reference, path=MODEL_PATH, backend="quantized", output=None):
+    model = compile_model(reference, backend)
+    output = output or exported_path(path, backend)
+    save_scripted(model, output)
+    return model, output
+
+
+# flat cell codes of every tick in the recorded matches
+def recorded_states(pattern, limit=DEFAULT_STATES):
+    from replay import ReplayReader, overlay
+    states = []
+    for path in sorted(glob.glob(pattern)):
+        for tick, grid, entities, points, record in ReplayReader(path).replay_from(0):
+            states.append(overlay(grid, entities).reshape(-1))
+            if len(states) >= limit:
+                return np.stack(states)
+    return np.stack(states) if states else np.empty((0, 0), dtype=np.uint8)
+
+
+# random play in the vectorized simulator when there are no recordings
+def simulated_states(count=DEFAULT_STATES, num_envs=64, seed=0):
+    from simulation import VecPacmanEnv
+    env = VecPacmanEnv(num_envs, seed=seed)
+    states = []
+    while len(states) * num_envs < count:
+        states.append(env.codes().reshape(num_envs, -1))
+        env.step(env.rng.integers(0, env.action_size, num_envs))
+    return np.concatenate(states)[:count]
+
+
+def q_values(model, states, batch_size=1024):
+    encoder = StateEncoder(batch_size)
+    chunks = []
+    with torch.inference_mode():
+        for start in range(0, len(states), batch_size):
+            chunks.append(model(encoder.encode_batch(states[start:start + batch_size])).numpy().copy())
+    return np.concatenate(chunks)
+
+
+def check_accuracy(reference, candidate, states):
+    expected = q_values(reference, states)
+    actual = q_values(candidate, states)
+    error = np.abs(expected - actual)
+    return {
+        "states": len(states),
+        "agreement": float(np.mean(expected.argmax(axis=1) == actual.argmax(axis=1))),
+        "max_q_error": float(error.max()),
+        "mean_q_error": float(error.mean()),
+    }
+
+
+def latency_us(model, states, calls=LATENCY_CALLS):
+    encoder = StateEncoder(1)
+    state = encoder.encode_batch(states[:1])
+    with torch.inference_mode():
+        for _ in range(50):
+            model(state)
+        start = time.perf_counter()
+        for _ in range(calls):
+            model(state)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def model_bytes(model):
+    buffer = io.BytesIO()
+    if isinstance(model, torch.jit.ScriptModule):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            torch.jit.save(model, buffer)
+    else:
+        torch.save(model.state_dict(), buffer)
+    return len(buffer.getvalue())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the DQN for CPU serving and check it against fp32.')
+    parser.add_argument('--source', default=MODEL_PATH, help='fp32 checkpoint to export')
+    parser.add_argument('--backend', default='quantized', choices=[b for b in BACKENDS if b != "eager"] + ['all'])
+    parser.add_argument('--replays', default=None, help='Glob of recorded .pacr matches to check accuracy on')
+    parser.add_argument('--states', type=int, default=DEFAULT_STATES, help='States used for the accuracy check')
+    parser.add_argument('--min-agreement', type=float, default=MIN_AGREEMENT, help='Fail below this action agreement')
+    args = parser.parse_args()
+
+    reference = load_model(args.source)
+    states = recorded_states(args.replays, args.states) if args.replays else None
+    if states is None or not len(states):
+        states = simulated_states(args.states)
+    backends = [b for b in BACKENDS if b != "eager"] if args.backend == 'all' else [args.backend]
+    report = {"source": args.source, "eager": {"latency_us": latency_us(reference, states), "bytes": model_bytes(reference)}}
+    failed = False
+    for backend in backends:
+        model, output = export(reference, args.source, backend)
+        result = check_accuracy(reference, model, states)
+        result.update(output=output, latency_us=latency_us(model, states), bytes=model_bytes(model))
+        report[backend] = result
+        failed |= result["agreement"] < args.min_agreement
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,137 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+import metrics
+from encoding import StateEncoder, STATE_SIZE
+from checkpoints import latest_checkpoint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_WAIT = 0.002
+RELOAD_INTERVAL = 5.0
+
+service = None
+service_lock = threading.Lock()
+service_config = {}
+
+
+class InferenceService:
+    def __init__(self, model=None, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT, num_threads=None,
+                 checkpoint_dir=None, reload_interval=RELOAD_INTERVAL, backend="eager"):
+        import torch
+        from model import get_model, load_backend
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.backend = backend
+        self.version = 0
+        self.checkpoint_dir = checkpoint_dir
+        self.reload_interval = reload_interval
+        if model is None and checkpoint_dir:
+            self.version, path = latest_checkpoint(checkpoint_dir)
+            model = load_backend(path, backend) if path else None
+        self.model = model if model is not None else get_model(backend=backend)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.encoder = StateEncoder(max_batch)
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.served = 0
+        self.thread = threading.Thread(target=self.run, name="inference", daemon=True)
+        self.thread.start()
+        if checkpoint_dir:
+            self.watcher = threading.Thread(target=self.watch, name="checkpoint-watcher", daemon=True)
+            self.watcher.start()
+
+    # codes is the flat uint8 cell-code array of a board, see encoding.to_codes
+    def submit(self, codes):
+        future = Future()
+        self.requests.put((codes, future))
+        return future
+
+    def predict(self, codes, timeout=None):
+        return self.submit(codes).result(timeout)
+
+    def collect(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    # batches already running finish on the old weights, the next batch
+    # picks the new model up; nothing on the move path waits for the load
+    def swap_model(self, model, version):
+        model.eval()
+        self.model = model
+        self.version = version
+        logger.info("inference now serving checkpoint %d", version)
+
+    def reload(self):
+        version, path = latest_checkpoint(self.checkpoint_dir)
+        if version <= self.version:
+            return False
+        from model import load_backend
+        try:
+            model = load_backend(path, self.backend)
+        except Exception:
+            logger.exception("could not load checkpoint %d from %s", version, path)
+            return False
+        self.swap_model(model, version)
+        return True
+
+    def watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            self.reload()
+
+    def run(self):
+        import torch
+        while True:
+            batch = self.collect()
+            codes, futures = zip(*batch)
+            try:
+                model = self.model
+                started = metrics.start()
+                states = self.encoder.encode_batch(np.stack(codes))
+                with torch.inference_mode():
+                    actions = model(states).argmax(dim=1).tolist()
+                metrics.INFERENCE_SECONDS.observe_since(started)
+                metrics.INFERENCE_BATCH.observe(len(batch))
+            except Exception as e:
+                logger.exception("inference batch of %d failed", len(batch))
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, action in zip(futures, actions):
+                future.set_result(action)
+            self.batches += 1
+            self.served += len(batch)
+
+
+def configure_inference(**kwargs):
+    service_config.update(kwargs)
+
+
+def get_inference_service():
+    global service
+    if service is None:
+        with service_lock:
+            if service is None:
+                service = InferenceService(**service_config)
+    return service
+
+
+# builds the service with the configured checkpoint and backend, the model
+# matches will be served from, and runs one batch through it
+def warm_inference():
+    service = get_inference_service()
+    service.predict(np.zeros(STATE_SIZE, dtype=np.uint8))
+    return service
@@ -0,0 +1,127 @@
+import logging
+import queue
+import smtplib
+import threading
+import time
+import emailHandler
+from timers import timers
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_BATCH_SIZE = 20
+MAX_ATTEMPTS = 5
+BACKOFF = 2.0
+IDLE_TIMEOUT = 60
+
+
+class Mail:
+    def __init__(self, token, email, on_status=None):
+        self.token = token
+        self.email = email
+        self.on_status = on_status
+        self.attempts = 0
+
+
+# a 4xx refusal (greylisting, a full mailbox) is worth another attempt
+def is_permanent(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, message in error.recipients.values())
+    code = getattr(error, 'smtp_code', None)
+    return code is not None and 500 <= code < 600
+
+
+class MailQueue:
+    # worker threads each keep one authenticated SMTP connection and send
+    # whatever is queued in batches over it; failures retry with backoff
+    def __init__(self, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE,
+                 max_attempts=MAX_ATTEMPTS, backoff=BACKOFF, connect=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.connect = connect or emailHandler.connect
+        self.queue = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.run, name=f"mailer-{len(self.threads)}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def send(self, token, email, on_status=None):
+        self.start()
+        mail = Mail(token, email, on_status)
+        self.report(mail, "queued")
+        self.queue.put(mail)
+        return mail
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def report(self, mail, status):
+        if status == "sent":
+            self.sent += 1
+        elif status == "failed":
+            self.failed += 1
+        if mail.on_status:
+            try:
+                mail.on_status(status)
+            except Exception:
+                logger.exception("mail status callback failed for %s", mail.email)
+
+    def retry(self, mail, error):
+        mail.attempts += 1
+        if is_permanent(error) or mail.attempts >= self.max_attempts:
+            logger.warning("giving up on mail to %s after %d attempts: %s", mail.email, mail.attempts, error)
+            self.report(mail, "failed")
+            return
+        self.report(mail, "retrying")
+        timers.schedule(self.backoff * 2 ** (mail.attempts - 1), self.queue.put, mail)
+
+    def collect(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def close(self, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    def run(self):
+        server = None
+        last_used = 0
+        while True:
+            batch = self.collect()
+            if server is not None and time.monotonic() - last_used > IDLE_TIMEOUT:
+                self.close(server)
+                server = None
+            for mail in batch:
+                try:
+                    if server is None:
+                        server = self.connect()
+                    server.sendmail(emailHandler.EMAIL_FROM, mail.email, emailHandler.build_message(mail.token, mail.email))
+                except smtplib.SMTPRecipientsRefused as e:
+                    self.retry(mail, e)
+                except (smtplib.SMTPException, OSError) as e:
+                    if server is not None:
+                        self.close(server)
+                        server = None
+                    self.retry(mail, e)
+                else:
+                    self.report(mail, "sent")
+            last_used = time.monotonic()
+
+
+mailer = MailQueue()
@@ -1,34 +1,32 @@
+import time
+startup_began = time.perf_counter()
 import flask
-from Game import Player, Board, Ghost, PacmanAI, GhostAI
 import flask_socketio
-from flask_socketio import ConnectionRefusedError, disconnect
+from flask_socketio import ConnectionRefusedError, join_room
 from flask import request
 import os
-import random
-import string
-import time
+import sys
+import threading
+import logging
 import argparse
-from tokens import get_entry, remove_entry
+from tokens import get_entry, set_notifier, token_room, token_queue, pending_timers
+from mailer import mailer
+from matches import MatchRegistry, move_status, parse_ai_sides, requested_side
+from broadcast import get_mode
+from ticks import TickScheduler, DEFAULT_TICK_RATE
+from inference import configure_inference, warm_inference, DEFAULT_MAX_BATCH, DEFAULT_MAX_WAIT
+from checkpoints import CHECKPOINT_DIR
+import metrics
+
+imports_done = time.perf_counter()
 
 player_timestamp = None
 ghost_timestamp = None
-player_time = 0
-ghost_time = 0
-moves = 0
 participant_token = None
 participant_id = None
 
-pacman_ai = PacmanAI()
-ghost_ai = GhostAI()
-
-def generate_random_string(length=8):
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choices(characters, k=length))
-
 connected_clients = []
 displayconnected = False
-player_token = generate_random_string()
-ghost_token = generate_random_string()
 
 app = flask.Flask(__name__)
 socketio = flask_socketio.SocketIO(app)
@@ -37,130 +35,235 @@ from tokenHandler import token_handler
 app.register_blueprint(token_handler, url_prefix='/token')
 
 displayids = []
-player_move_docked = False
-ghost_move_docked = False
-player_connected = False
-ghost_connected = False
-player_id = None
-ghost_id = None
-player_name = None
-ghost_name = None
-
-def initialize():
-    global board, player, ghost1, ghost2, ghost3, ghost4, ghosts
-    board = Board()
-    positions = board.get_positions()
-    player = Player(positions[0])
-    ghost1 = Ghost(positions[1], "a")
-    ghost2 = Ghost(positions[2], "b")
-    ghost3 = Ghost(positions[3], "c")
-    ghost4 = Ghost(positions[4], "d")
-    ghosts = [ghost1, ghost2, ghost3, ghost4]
-    socketio.emit('board', [board.get_board(), player.points])
-
-def process_ai_move():
-    player_move = player.get_ai_move(board.get_board())
-    ghost_moves = ghost1.get_ai_moves(board.get_board())
-    handlemove("player", [1 if i == player_move else 0 for i in range(4)])
-    handlemove("ghost", ghost_moves)
+registry = MatchRegistry(socketio.emit)
+set_notifier(socketio.emit)
+sessions = {}
+
+metrics.Gauge("pacman_connected_clients", "Connected Socket.IO clients", lambda: len(sessions))
+metrics.Gauge("pacman_matches", "Matches in the registry", lambda: len(registry))
+metrics.Gauge("pacman_token_queue_length", "Tokens waiting in the queue", lambda: len(token_queue))
+metrics.Gauge("pacman_mail_pending", "Token emails waiting to be sent", lambda: mailer.pending())
+metrics.Gauge("pacman_pending_timers", "Token expiry, queue head and mail retry timers waiting to fire", pending_timers)
+
+# torch stays unimported until a match first asks the DQN for a move
+def startup_report():
+    now = time.perf_counter()
+    return {
+        "imports_ms": round((imports_done - startup_began) * 1000, 1),
+        "ready_ms": round((now - startup_began) * 1000, 1),
+        "torch_loaded": "torch" in sys.modules,
+    }
+
+def get_bearer_token():
+    auth = request.headers.get('Authorization')
+    if not auth or ' ' not in auth:
+        return None
+    return auth.split(' ')[1]
+
+def get_request_match():
+    match_id = request.args.get('match')
+    if match_id:
+        return registry.get(match_id)
+    return registry.get_default()
 
 @app.route('/')
 def index():
     return flask.render_template('index.html')
 
+@app.route('/metrics')
+def metrics_route():
+    if not metrics.enabled:
+        return flask.jsonify({"error": "Metrics disabled"}), 404
+    return flask.Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/match', methods=['POST'])
+def create_match():
+    ai_sides = parse_ai_sides(flask.request.get_json(silent=True) or {})
+    if ai_sides is None:
+        return flask.jsonify({"error": 'Expected {"pacman": "ai" or "human", "ghost": "ai" or "human"}'}), 400
+    match = registry.create(ai_sides=ai_sides)
+    return flask.jsonify({
+        "match_id": match.id,
+        "player_token": match.player_token,
+        "ghost_token": match.ghost_token
+    })
+
+@app.route('/match', methods=['GET'])
+def list_matches():
+    return flask.jsonify({"matches": [
+        {"match_id": match.id, "moves": match.moves, "finished": match.finished, "winner": match.winner}
+        for match in registry
+    ]})
+
 @app.route('/move/player', methods=['POST'])
 def player_move():
-    move = flask.request.get_json()
-    auth = request.headers.get('Authorization')
-    if auth:
-        token = auth.split(' ')[1]
-    else:
-        return flask.jsonify({"error":"Missing Token"}), 401
-    if token != player_token:
-        return flask.jsonify({"error": "Unauthorized"}), 403
-    if not player_connected:
-        return flask.jsonify({"error": "Player not connected"}), 400
-    if hasattr(player, 'ai_mode') and player.ai_mode:
-        move = player.get_ai_move(board.get_board())
-    handlemove("player", move)
-    return flask.jsonify({"status": "success"})
+    return submit_move("player")
 
 @app.route('/move/ghost', methods=['POST'])
 def ghost_move():
+    return submit_move("ghost")
+
+def submit_move(side):
+    started = metrics.start()
     move = flask.request.get_json()
-    auth = request.headers.get('Authorization')
-    if auth:
-        token = auth.split(' ')[1]
-    else:
+    token = get_bearer_token()
+    if not token:
         return flask.jsonify({"error":"Missing Token"}), 401
-    if token != ghost_token:
+    match, token_side = registry.find_by_token(token)
+    if match is None or token_side != side:
         return flask.jsonify({"error": "Unauthorized"}), 403
-    if not ghost_connected:
-        return flask.jsonify({"error": "Ghost not connected"}), 400
-    if hasattr(ghost1, 'ai_mode') and ghost1.ai_mode:
-        move = ghost1.get_ai_moves(board.get_board())
-    handlemove("ghost", move)
-    return flask.jsonify({"status": "success"})
-
-def handlemove(character_type, move):
-    global player_move_docked, ghost_move_docked, player, ghosts, player_connected, ghost_connected, moves
-    if character_type == "player":
-        if not player_connected:
-            return
-        player_move_docked = True
-        player.move(move)
-        moves += 1
-        if ghost_connected:
-            process_ai_move()
-    elif character_type == "ghost":
-        if not ghost_connected:
-            return
-        ghost_move_docked = True
-        for i, ghost_move in enumerate(move):
-            ghosts[i].move(ghost_move)
-        moves += 1
-        if player_connected:
-            process_ai_move()
+    body, code = move_status(match, side, match.submit(side, move))
+    response = flask.jsonify(body), code
+    metrics.STAGE_SECONDS.observe_since(started, f"move_{side}")
+    return response
 
 @socketio.on('connect')
-def on_connect():
-    global player_connected, ghost_connected, player_id, ghost_id, player_name, ghost_name
-    if player_connected and ghost_connected:
-        return
-    if not player_connected:
-        player_connected = True
-        player_id = generate_random_string()
-        player_name = 'Player'
-        socketio.emit('connected', {"player_id": player_id})
-    elif not ghost_connected:
-        ghost_connected = True
-        ghost_id = generate_random_string()
-        ghost_name = 'Ghost'
-        socketio.emit('connected', {"ghost_id": ghost_id})
+def on_connect(auth=None):
+    token = get_bearer_token()
+    match, side = registry.find_by_token(token)
+    authorized = match is not None
+    if match is None and token:
+        join_room(token_room(token))
+        entry = get_entry(token)
+        if entry is not None:
+            socketio.emit('queue-position', entry, to=request.sid)
+    if match is None:
+        match = get_request_match()
+        if match is None:
+            raise ConnectionRefusedError('Unknown match')
+        side = match.take_seat(requested_side(auth))
+    mode = get_mode(auth)
+    join_room(match.room)
+    join_room(match.stream_room(mode))
+    match.add_viewer(mode)
+    session = sessions[request.sid] = {"match": match.id, "side": side, "mode": mode, "authorized": authorized}
+    if side is not None:
+        connected = match.connect(side, request.headers.get('Name'))
+        session["seat"] = connected[f"{side}_id"]
+        socketio.emit('connected', connected, to=match.room)
+    socketio.emit(*match.snapshot(mode), to=request.sid)
+
+def get_session_match():
+    session = sessions.get(request.sid)
+    if session is None:
+        return None, None
+    return registry.get(session["match"]), session
+
+@socketio.on('move')
+def on_move(move):
+    match, session = get_session_match()
+    if match is None or not session["authorized"]:
+        return {"error": "Unauthorized"}
+    started = metrics.start()
+    body, code = move_status(match, session["side"], match.submit(session["side"], move))
+    metrics.STAGE_SECONDS.observe_since(started, "socket_move")
+    return body
+
+@socketio.on('resync')
+def on_resync(*args):
+    match, session = get_session_match()
+    if match is not None:
+        socketio.emit(*match.snapshot(session["mode"]), to=request.sid)
+
+@socketio.on('disconnect')
+def on_disconnect(*args):
+    match, session = get_session_match()
+    sessions.pop(request.sid, None)
+    if match is not None:
+        match.remove_viewer(session["mode"])
+        if "seat" in session:
+            match.disconnect(session["side"], session["seat"])
+
+def get_disconnect_match(side):
+    match, token_side = registry.find_by_token(get_bearer_token())
+    if match is not None and token_side == side:
+        return match
+    return get_request_match()
 
 @app.route('/disconnect/player', methods=['POST'])
 def player_disconnect():
-    global player_connected, player_id
-    player_connected = False
-    player_id = None
+    match = get_disconnect_match("player")
+    if match is not None:
+        match.disconnect("player")
     return flask.jsonify({"status": "Player disconnected"})
 
 @app.route('/disconnect/ghost', methods=['POST'])
 def ghost_disconnect():
-    global ghost_connected, ghost_id
-    ghost_connected = False
-    ghost_id = None
+    match = get_disconnect_match("ghost")
+    if match is not None:
+        match.disconnect("ghost")
     return flask.jsonify({"status": "Ghost disconnected"})
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run the Flask-SocketIO server.')
     parser.add_argument('--port', type=int, default=5000, help='Port to run the server on')
+    parser.add_argument('--tick-rate', type=float, default=DEFAULT_TICK_RATE, help='Move resolution ticks per second')
+    parser.add_argument('--inference-batch', type=int, default=DEFAULT_MAX_BATCH, help='Largest DQN inference micro-batch')
+    parser.add_argument('--inference-wait', type=float, default=DEFAULT_MAX_WAIT, help='Seconds to wait for an inference batch to fill')
+    parser.add_argument('--inference-threads', type=int, default=None, help='torch threads used for inference')
+    parser.add_argument('--inference-backend', default='eager', choices=['eager', 'scripted', 'quantized'],
+                        help='DQN variant to serve, see export.py')
+    parser.add_argument('--pacman-agent', default='dqn', choices=['dqn', 'planner'],
+                        help='What plays an AI pacman: the DQN or the lookahead search in planner.py')
+    parser.add_argument('--plan-budget', type=float, default=None, help='Seconds of planner search per move')
+    parser.add_argument('--plan-depth', type=int, default=None, help='Deepest planner search in ticks')
+    parser.add_argument('--replay-dir', default=None, help='Record every match to a replay file in this directory')
+    parser.add_argument('--checkpoints', default=None, help='Hot reload the DQN from checkpoints published here')
+    parser.add_argument('--metrics', action='store_true', help='Collect timings and serve them at /metrics')
+    parser.add_argument('--train', action='store_true', help='Train on live matches in a background trainer process')
+    parser.add_argument('--asgi', action='store_true', help='Serve from an asyncio event loop (needs asgiref and uvicorn)')
+    parser.add_argument('--workers', type=int, default=0, help='Run matches in this many worker processes')
+    parser.add_argument('--bus', default=None, help='Message bus between workers: redis://host:port, local, or multiprocessing queues by default')
+    parser.add_argument('--preload-model', action='store_true', help='Load and warm the DQN in the background at startup')
+    parser.add_argument('--train-memory', default=None, help='Directory for the trainer\'s persistent replay buffer')
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO)
+    if args.metrics:
+        metrics.enable()
+    checkpoint_dir = args.checkpoints or (CHECKPOINT_DIR if args.train else None)
+    inference = {"max_batch": args.inference_batch, "max_wait": args.inference_wait,
+                 "num_threads": args.inference_threads, "checkpoint_dir": checkpoint_dir,
+                 "backend": args.inference_backend}
+    configure_inference(**inference)
+    planner = None
+    if args.pacman_agent == 'planner':
+        from planner import configure_planner
+        planner = {key: value for key, value in (("budget", args.plan_budget), ("max_depth", args.plan_depth))
+                   if value is not None}
+        configure_planner(**planner)
+    if args.workers:
+        # matches, ticks and inference move to the workers; sockets and the
+        # token queue stay in this process
+        from bus import create_bus
+        from shards import ShardedRegistry
+        registry = ShardedRegistry(create_bus(args.bus), args.workers, socketio.emit, args.tick_rate,
+                                   args.replay_dir, inference, planner=planner)
+    if args.train and not args.workers:
+        from trainer import start_trainer
+        trainer, feed = start_trainer(directory=checkpoint_dir, memory_path=args.train_memory)
+        registry.set_feed(feed)
+    if args.replay_dir and not args.workers:
+        registry.set_replay_dir(args.replay_dir)
+    if args.preload_model and not args.workers:
+        threading.Thread(target=warm_inference, name="preload-model", daemon=True).start()
+    logging.info("startup: imports %(imports_ms)sms, ready in %(ready_ms)sms, torch loaded: %(torch_loaded)s",
+                 startup_report())
+    if args.asgi:
+        from asgi import serve
+        serve(app, registry, sessions, args.port, None if args.workers else args.tick_rate)
+        raise SystemExit
+    if not args.workers:
+        scheduler = TickScheduler(registry, args.tick_rate, socketio.start_background_task, socketio.sleep)
+        scheduler.start()
+
     extra_files = [
         os.path.join(os.getcwd(), 'static', 'index.js'),
         os.path.join(os.getcwd(), 'templates', 'index.html')
     ]
     
-    socketio.run(app, port=5000, debug=True, extra_files=extra_files, host='0.0.0.0')
+    # the reloader reruns this script in a child process, which would start a
+    # second set of shard workers and a second trainer
+    socketio.run(app, port=args.port, debug=True, use_reloader=not (args.workers or args.train),
+                 extra_files=extra_files, host='0.0.0.0')
 
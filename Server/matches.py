@@ -0,0 +1,391 @@
+import os
+import threading
+import random
+import string
+import time
+import logging
+import metrics
+from collections import deque
+from Game import Player, Board, Ghost, GhostAI, MOVES, resolve_moves
+from broadcast import BoardStream, FULL, DELTA, BINARY, MODES
+from replay import ReplayWriter, REWARD_DEATH, REWARD_CLEAR
+
+DEFAULT_MATCH = "default"
+FINISHED_GRACE = 30
+MAX_QUEUED_MOVES = 32
+# POST /match names the sides the way the game does, pacman and ghost
+SIDES = {"pacman": "player", "ghost": "ghost"}
+
+logger = logging.getLogger(__name__)
+
+
+def generate_random_string(length=8):
+    characters = string.ascii_letters + string.digits
+    return ''.join(random.choices(characters, k=length))
+
+
+# a move name, or one score per direction for the player, as clients send it
+def is_move(move):
+    if isinstance(move, str):
+        return move in MOVES
+    return (isinstance(move, list) and len(move) == len(MOVES)
+            and all(isinstance(score, (int, float)) for score in move))
+
+
+# a tokenless socket sits down only when its auth asks for a side,
+# {"side": "player"}; spectators leave it out
+def requested_side(auth):
+    side = (auth or {}).get('side')
+    return side if side in SIDES.values() else None
+
+
+def is_valid_move(side, move):
+    if side == "player":
+        return is_move(move)
+    return isinstance(move, list) and len(move) == 4 and all(is_move(ghost_move) for ghost_move in move)
+
+
+def decode_move(move):
+    if isinstance(move, str):
+        return move
+    if not move:
+        return None
+    return MOVES[max(range(len(move)), key=lambda i: move[i])]
+
+
+# {"pacman": "ai", "ghost": "human"} -> the sides the server plays, None if
+# the body names an unknown side or controller
+def parse_ai_sides(body):
+    if not isinstance(body, dict) or not set(body) <= set(SIDES):
+        return None
+    if not all(body[name] in ("ai", "human") for name in body):
+        return None
+    return {SIDES[name] for name in body if body[name] == "ai"}
+
+
+# (body, http status) for the result of Match.submit
+def move_status(match, side, status):
+    if status == "finished":
+        return {"error": "Match finished", "winner": match.winner}, 409
+    if status == "queue full":
+        return {"error": "Too many queued moves"}, 429
+    if status == "not connected":
+        return {"error": f"{side.capitalize()} not connected"}, 400
+    if status == "invalid move":
+        if side == "player":
+            return {"error": f"Invalid move, expected one of {MOVES} or a list of {len(MOVES)} scores"}, 400
+        return {"error": "Invalid move, expected a list of 4 ghost moves"}, 400
+    return {"status": "accepted", "tick": status, "match_id": match.id}, 200
+
+
+class Match:
+    def __init__(self, match_id, emit, replay_dir=None, feed=None, ai_sides=()):
+        self.id = match_id
+        self.room = match_id
+        self.emit = emit
+        self.replay_dir = replay_dir
+        self.feed = feed
+        self.recorder = None
+        self.lock = threading.RLock()
+        self.player_token = generate_random_string()
+        self.ghost_token = generate_random_string()
+        self.player_connected = False
+        self.ghost_connected = False
+        self.player_id = None
+        self.ghost_id = None
+        self.player_name = None
+        self.ghost_name = None
+        self.player_move_docked = False
+        self.ghost_move_docked = False
+        self.player_time = 0
+        self.ghost_time = 0
+        self.moves = 0
+        self.finished = False
+        self.finished_at = None
+        self.winner = None
+        self.stream = None
+        self.ghost_ai = GhostAI()
+        # sides the server moves for, kept across resets
+        self.ai_sides = set(ai_sides)
+        self.viewers = {mode: 0 for mode in MODES}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.board = Board()
+            self.start_recording()
+            positions = self.board.get_positions()
+            self.player = Player(positions['player'])
+            self.ghosts = [Ghost(pos, id) for pos, id in zip(positions['ghosts'], "abcd")]
+            self.moves = 0
+            self.tick = 0
+            self.queues = {"player": deque(), "ghost": deque()}
+            self.ai_pending = None
+            self.finished = False
+            self.finished_at = None
+            self.winner = None
+            if self.stream is None:
+                self.stream = BoardStream(self.board)
+            else:
+                self.stream.rebase(self.board, 0)
+        self.broadcast(keyframe=True)
+
+    def stream_room(self, mode):
+        return f"{self.room}:{mode}"
+
+    def add_viewer(self, mode):
+        with self.lock:
+            self.viewers[mode] += 1
+
+    def remove_viewer(self, mode):
+        with self.lock:
+            self.viewers[mode] = max(0, self.viewers[mode] - 1)
+
+    def snapshot(self, mode):
+        with self.lock:
+            if mode == DELTA:
+                return 'board-keyframe', self.stream.keyframe()
+            if mode == BINARY:
+                return 'board-binary', self.stream.binary_keyframe()
+            return 'board', [self.board.get_board(), self.player.points]
+
+    def broadcast(self, keyframe=False):
+        started = metrics.start()
+        self.send_frames(keyframe)
+        metrics.STAGE_SECONDS.observe_since(started, "broadcast")
+
+    def send_frames(self, keyframe):
+        if self.viewers[FULL]:
+            self.emit('board', [self.board.get_board(), self.player.points], to=self.stream_room(FULL))
+        if keyframe:
+            if self.viewers[DELTA]:
+                self.emit('board-keyframe', self.stream.keyframe(), to=self.stream_room(DELTA))
+            if self.viewers[BINARY]:
+                self.emit('board-binary', self.stream.binary_keyframe(), to=self.stream_room(BINARY))
+            return
+        self.stream.advance(self.board, self.player.points, codes=self.viewers[DELTA] > 0)
+        if self.viewers[DELTA]:
+            self.emit('board-delta', self.stream.delta(), to=self.stream_room(DELTA))
+        if self.viewers[BINARY]:
+            self.emit('board-binary', self.stream.binary_delta(), to=self.stream_room(BINARY))
+
+    def connect(self, side, name=None):
+        with self.lock:
+            if side == "player":
+                self.player_connected = True
+                self.player_id = generate_random_string()
+                self.player_name = name or 'Player'
+                return {"player_id": self.player_id}
+            self.ghost_connected = True
+            self.ghost_id = generate_random_string()
+            self.ghost_name = name or 'Ghost'
+            return {"ghost_id": self.ghost_id}
+
+    def take_seat(self, side):
+        with self.lock:
+            if side is None or side in self.ai_sides or self.is_connected(side):
+                return None
+            return side
+
+    # a socket leaving passes the id it was connected with, so it does not
+    # free a seat someone has taken since
+    def disconnect(self, side, id=None):
+        with self.lock:
+            if id is not None and id != (self.player_id if side == "player" else self.ghost_id):
+                return
+            if side == "player":
+                self.player_connected = False
+                self.player_id = None
+            else:
+                self.ghost_connected = False
+                self.ghost_id = None
+
+    def is_connected(self, side):
+        return self.player_connected if side == "player" else self.ghost_connected
+
+    def process_ai_move(self):
+        started = metrics.start()
+        with self.lock:
+            if self.finished:
+                return
+            if "player" in self.ai_sides and not self.queues["player"] and self.ai_pending is None:
+                self.ai_pending = self.player.request_ai_move(self.board)
+            if "ghost" in self.ai_sides and not self.queues["ghost"]:
+                self.queues["ghost"].append(self.ghost_ai.get_ai_moves(self.board))
+        metrics.STAGE_SECONDS.observe_since(started, "process_ai_move")
+
+    def collect_ai_move(self):
+        if self.ai_pending is not None:
+            self.queues["player"].append(MOVES[self.ai_pending.result()])
+            self.ai_pending = None
+
+    def submit(self, character_type, move):
+        with self.lock:
+            if self.finished:
+                return "finished"
+            if not self.is_connected(character_type):
+                return "not connected"
+            if not is_valid_move(character_type, move):
+                return "invalid move"
+            queue = self.queues[character_type]
+            if len(queue) >= MAX_QUEUED_MOVES:
+                return "queue full"
+            queue.append(move)
+            metrics.MOVES_ACCEPTED.inc(label=character_type)
+            if character_type == "player":
+                self.player_move_docked = True
+            else:
+                self.ghost_move_docked = True
+            return self.tick + len(queue)
+
+    def resolve_tick(self):
+        with self.lock:
+            if self.finished:
+                return False
+            self.process_ai_move()
+            self.collect_ai_move()
+            player_queue, ghost_queue = self.queues["player"], self.queues["ghost"]
+            if not player_queue and not ghost_queue:
+                return False
+            start = time.perf_counter()
+            player_move = decode_move(player_queue.popleft()) if player_queue else None
+            ghost_moves = [decode_move(move) for move in ghost_queue.popleft()] if ghost_queue else None
+            if self.feed is not None and player_move in MOVES:
+                state = self.board.codes().reshape(-1)
+                points = self.player.points
+            result = resolve_moves(self.board, self.player, self.ghosts, player_move, ghost_moves)
+            self.tick += 1
+            self.moves += 1
+            if result != 'death' and self.board.pellets_remaining() == 0:
+                result = 'cleared'
+            if self.recorder is not None:
+                self.recorder.record_tick(self.tick, self.board, self.player.points, player_move, ghost_moves, result)
+            if self.feed is not None and player_move in MOVES:
+                self.feed_transition(state, player_move, points, result)
+            # after recording, finish() closes the recorder
+            if result == 'death':
+                self.finish("ghost")
+            elif result == 'cleared':
+                self.finish("player")
+            self.broadcast()
+            metrics.TICKS.inc()
+            metrics.STAGE_SECONDS.observe_since(start, "resolve_tick")
+            logger.debug("match %s tick %d: player=%s ghosts=%s resolved in %.3fms",
+                         self.id, self.tick, player_move, ghost_moves, (time.perf_counter() - start) * 1000)
+            return True
+
+    # same rewards as simulation.VecPacmanEnv
+    def feed_transition(self, state, move, points, result):
+        reward = float(self.player.points - points)
+        if result == 'death':
+            reward += REWARD_DEATH
+        elif result == 'cleared':
+            reward += REWARD_CLEAR
+        next_state = self.board.codes().reshape(-1)
+        self.feed.put(state, MOVES.index(move), reward, next_state, result is not None)
+
+    def start_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.replay_dir:
+            path = os.path.join(self.replay_dir, f"{self.id}-{int(time.time() * 1000)}.pacr")
+            self.recorder = ReplayWriter(path, self.board, self.id)
+
+    def finish(self, winner):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        self.finished = True
+        self.finished_at = time.monotonic()
+        self.winner = winner
+        self.emit('game-over', {"winner": winner, "timestamps": [self.player_time, self.ghost_time]}, to=self.room)
+
+
+class MatchRegistry:
+    def __init__(self, emit, replay_dir=None, feed=None):
+        self.emit = emit
+        self.replay_dir = replay_dir
+        self.feed = feed
+        self.on_remove = None
+        self.lock = threading.Lock()
+        self.matches = {}
+        self.by_token = {}
+
+    # matches created before this (the default one) start recording right away
+    def set_replay_dir(self, replay_dir):
+        with self.lock:
+            self.replay_dir = replay_dir
+            matches = list(self.matches.values())
+        for match in matches:
+            with match.lock:
+                match.replay_dir = replay_dir
+                if not match.finished:
+                    match.start_recording()
+
+    # lets another server front end (asgi.py) take over the emits
+    def set_emit(self, emit):
+        with self.lock:
+            self.emit = emit
+            matches = list(self.matches.values())
+        for match in matches:
+            match.emit = emit
+
+    def set_feed(self, feed):
+        with self.lock:
+            self.feed = feed
+            matches = list(self.matches.values())
+        for match in matches:
+            with match.lock:
+                match.feed = feed
+
+    def create(self, match_id=None, ai_sides=()):
+        self.cleanup()
+        with self.lock:
+            match_id = match_id or generate_random_string()
+            if match_id in self.matches:
+                return self.matches[match_id]
+            match = Match(match_id, self.emit, self.replay_dir, self.feed, ai_sides)
+            self.matches[match_id] = match
+            self.by_token[match.player_token] = (match, "player")
+            self.by_token[match.ghost_token] = (match, "ghost")
+            return match
+
+    def get(self, match_id):
+        return self.matches.get(match_id)
+
+    def get_default(self):
+        match = self.matches.get(DEFAULT_MATCH)
+        if match is None:
+            match = self.create(DEFAULT_MATCH)
+        return match
+
+    def find_by_token(self, token):
+        return self.by_token.get(token, (None, None))
+
+    def remove(self, match_id):
+        with self.lock:
+            match = self.matches.pop(match_id, None)
+            if match is None:
+                return None
+            self.by_token.pop(match.player_token, None)
+            self.by_token.pop(match.ghost_token, None)
+        if self.on_remove is not None:
+            self.on_remove(match)
+        return match
+
+    def cleanup(self, grace=FINISHED_GRACE):
+        now = time.monotonic()
+        expired = [
+            match_id for match_id, match in list(self.matches.items())
+            if match.finished and now - match.finished_at >= grace
+        ]
+        for match_id in expired:
+            self.remove(match_id)
+        return expired
+
+    def __len__(self):
+        return len(self.matches)
+
+    def __iter__(self):
+        return iter(list(self.matches.values()))
@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import os
+import threading
+import numpy as np
+from Game import boardtypes, CHAR_TO_CODE, WALL, DIRECTIONS, MOVES
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+CACHE_VERSION = 1
+DELTAS = [DIRECTIONS[name] for name in MOVES]
+
+graphs = {}
+graphs_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def maze_hash(maze):
+    text = f"{CACHE_VERSION}\n" + "\n".join(maze)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def maze_terrain(maze):
+    chars = np.frombuffer(''.join(maze).encode(), dtype=np.uint8).reshape(len(maze), -1)
+    return CHAR_TO_CODE[chars]
+
+
+class MazeGraph:
+    def __init__(self, walkable, neighbors, distances, next_hop):
+        self.walkable = walkable
+        self.rows, self.cols = walkable.shape
+        self.node_index = np.full(walkable.shape, -1, dtype=np.int32)
+        self.cells = np.argwhere(walkable)
+        self.node_index[self.cells[:, 0], self.cells[:, 1]] = np.arange(len(self.cells))
+        self.neighbors = neighbors
+        self.distances = distances
+        self.next_hop = next_hop
+
+    @classmethod
+    def build(cls, terrain):
+        walkable = terrain != WALL
+        rows, cols = walkable.shape
+        cells = np.argwhere(walkable)
+        node_index = np.full(walkable.shape, -1, dtype=np.int32)
+        node_index[cells[:, 0], cells[:, 1]] = np.arange(len(cells))
+
+        # the column wraps around so the row-14 tunnel is an edge like any other
+        neighbors = np.full((len(cells), len(DELTAS)), -1, dtype=np.int32)
+        for direction, (dx, dy) in enumerate(DELTAS):
+            xs = cells[:, 0] + dx
+            ys = (cells[:, 1] + dy) % cols
+            inside = (xs >= 0) & (xs < rows)
+            neighbors[inside, direction] = node_index[xs[inside], ys[inside]]
+
+        # breadth-first search from every node at once, one level per iteration
+        count = len(cells)
+        distances = np.full((count, count), -1, dtype=np.int16)
+        np.fill_diagonal(distances, 0)
+        frontier = np.eye(count, dtype=bool)
+        reached = frontier.copy()
+        padded = np.zeros((count, count + 1), dtype=bool)
+        level = 0
+        while frontier.any():
+            level += 1
+            padded[:, :count] = frontier
+            spread = padded[:, neighbors].any(axis=2)
+            frontier = spread & ~reached
+            reached |= frontier
+            distances[frontier] = level
+
+        next_hop = np.full((count, count), -1, dtype=np.int8)
+        for direction in range(len(DELTAS) - 1, -1, -1):
+            neighbor = neighbors[:, direction]
+            valid = neighbor >= 0
+            closer = np.zeros((count, count), dtype=bool)
+            closer[valid] = distances[neighbor[valid]] == distances[valid] - 1
+            closer &= distances > 0
+            next_hop[closer] = direction
+        return cls(walkable, neighbors, distances, next_hop)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, walkable=self.walkable, neighbors=self.neighbors,
+                 distances=self.distances, next_hop=self.next_hop)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['walkable'], data['neighbors'], data['distances'], data['next_hop'])
+
+    def node(self, pos):
+        return self.node_index[pos[0], pos[1]]
+
+    def distance(self, source, target):
+        return int(self.distances[self.node(source), self.node(target)])
+
+    def next_move(self, source, target):
+        direction = self.next_hop[self.node(source), self.node(target)]
+        return MOVES[direction] if direction >= 0 else None
+
+    # sources and targets are (..., 2) position arrays; returns direction indexes, -1 to stay
+    def next_moves(self, sources, targets):
+        sources = np.asarray(sources)
+        targets = np.asarray(targets)
+        return self.next_hop[
+            self.node_index[sources[..., 0], sources[..., 1]],
+            self.node_index[targets[..., 0], targets[..., 1]]
+        ]
+
+
+def get_maze_graph(maze=0, cache_dir=CACHE_DIR):
+    if isinstance(maze, int):
+        maze = boardtypes[maze]
+    key = maze_hash(maze)
+    graph = graphs.get(key)
+    if graph is not None:
+        return graph
+    with graphs_lock:
+        if key in graphs:
+            return graphs[key]
+        path = os.path.join(cache_dir, f"maze-{key}.npz") if cache_dir else None
+        if path and os.path.exists(path):
+            graph = MazeGraph.load(path)
+        else:
+            graph = MazeGraph.build(maze_terrain(maze))
+            if path:
+                try:
+                    graph.save(path)
+                except OSError as e:
+                    logger.warning("could not cache maze graph in %s: %s", path, e)
+        graphs[key] = graph
+        return graph
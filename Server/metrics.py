@@ -0,0 +1,138 @@
+import bisect
+import os
+import threading
+import time
+
+# off unless PACMAN_METRICS=1 or main.py --metrics; while off every hook is
+# one global lookup and a branch
+enabled = os.environ.get("PACMAN_METRICS", "0") == "1"
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+metrics = []
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+# start() / observe_since(start) bracket a stage; start() returns None while
+# disabled so the observe side is a no-op too
+def start():
+    return time.perf_counter() if enabled else None
+
+
+def format_labels(name, value):
+    if value is None:
+        return ""
+    return f'{{{name}="{value}"}}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.lock = threading.Lock()
+        metrics.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, label=None):
+        super().__init__(name, help, label)
+        self.values = {}
+
+    def inc(self, amount=1, label=None):
+        if not enabled:
+            return
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda item: str(item[0]))
+        return self.header() + [
+            f"{self.name}{format_labels(self.label, label)} {value}" for label, value in values
+        ]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    # the value is read from function when scraped, nothing runs on the hot path
+    def __init__(self, name, help, function):
+        super().__init__(name, help)
+        self.function = function
+
+    def render(self):
+        return self.header() + [f"{self.name} {self.function()}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, label)
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, value, label=None):
+        if not enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                # per bucket counts, the last slot is +Inf, then sum
+                series = self.series[label] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def observe_since(self, started, label=None):
+        if started is not None:
+            self.observe(time.perf_counter() - started, label)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            series = sorted(((label, list(values)) for label, values in self.series.items()), key=lambda item: str(item[0]))
+        for label, values in series:
+            prefix = f'{self.label}="{label}",' if label is not None else ""
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                total += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {total}')
+            lines.append(f"{self.name}_sum{format_labels(self.label, label)} {values[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.label, label)} {total}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram("pacman_stage_seconds", "Time spent per server stage", "stage")
+LOCK_WAIT_SECONDS = Histogram("pacman_lock_wait_seconds", "Time spent waiting to acquire a lock", "lock")
+INFERENCE_SECONDS = Histogram("pacman_inference_seconds", "DQN forward pass time per batch")
+INFERENCE_BATCH = Histogram("pacman_inference_batch_size", "States per DQN inference batch", buckets=SIZE_BUCKETS)
+MOVES_ACCEPTED = Counter("pacman_moves_total", "Moves accepted", "side")
+TICKS = Counter("pacman_ticks_total", "Match ticks resolved")
+PLAN_SECONDS = Histogram("pacman_plan_seconds", "Planner search time per move")
+PLAN_NODES = Counter("pacman_plan_nodes_total", "Positions expanded by the planner")
@@ -0,0 +1,151 @@
+import logging
+import os
+import pickle
+import random
+import threading
+import time
+import warnings
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from Game import MODEL_PATH
+
+logger = logging.getLogger(__name__)
+
+STATE_SIZE = 31 * 28
+ACTION_SIZE = 4
+
+# eager is the plain fp32 module; scripted is a frozen TorchScript copy of
+# it; quantized has int8 dynamically quantized Linear layers, then frozen
+BACKENDS = ("eager", "scripted", "quantized")
+DEFAULT_BACKEND = "eager"
+
+models = {}
+models_lock = threading.Lock()
+
+
+class DQN(nn.Module):
+    def __init__(self, input_size, output_size):
+        super(DQN, self).__init__()
+        self.network = nn.Sequential(
+            nn.Linear(input_size, 128),
+            nn.ReLU(),
+            nn.Linear(128, 64),
+            nn.ReLU(),
+            nn.Linear(64, output_size)
+        )
+
+    def forward(self, x):
+        return self.network(x)
+
+
+# a missing checkpoint starts a fresh model; so does an unreadable one
+# (truncated, empty, not a state dict) rather than failing the first AI move
+def load_model(path=MODEL_PATH):
+    model = DQN(STATE_SIZE, ACTION_SIZE)
+    try:
+        model.load_state_dict(torch.load(path))
+    except FileNotFoundError:
+        logger.info("no model at %s, starting with a new one", path)
+    except (RuntimeError, EOFError, pickle.UnpicklingError) as e:
+        logger.error("could not load model %s, starting with a new one: %r", path, e)
+    model.eval()
+    return model
+
+
+def compile_model(model, backend):
+    if backend == "eager":
+        return model
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown inference backend {backend}, expected one of {BACKENDS}")
+    with warnings.catch_warnings():
+        # quantize_dynamic warns that it is moving to torchao
+        warnings.simplefilter("ignore")
+        if backend == "quantized":
+            model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        return torch.jit.freeze(torch.jit.script(model).eval())
+
+
+def exported_path(path, backend):
+    return f"{os.path.splitext(path)[0]}.{backend}.pt"
+
+
+# an export older than the checkpoint was made from weights since replaced
+def export_is_current(path, backend):
+    exported = exported_path(path, backend)
+    if not os.path.exists(exported):
+        return False
+    if os.path.exists(path) and os.path.getmtime(exported) < os.path.getmtime(path):
+        logger.warning("%s is older than %s, compiling the checkpoint instead; rerun export.py", exported, path)
+        return False
+    return True
+
+
+# a model written by export.py next to the checkpoint is used as is, otherwise
+# the checkpoint is compiled at load time
+def load_backend(path=MODEL_PATH, backend=DEFAULT_BACKEND):
+    if backend != "eager" and export_is_current(path, backend):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return torch.jit.load(exported_path(path, backend))
+    return compile_model(load_model(path), backend)
+
+
+# one eval model per checkpoint path and backend for the whole process;
+# callers that train must load_model() their own copy instead
+def get_model(path=MODEL_PATH, backend=DEFAULT_BACKEND):
+    key = (path, backend)
+    model = models.get(key)
+    if model is not None:
+        return model
+    with models_lock:
+        if key not in models:
+            start = time.perf_counter()
+            models[key] = load_backend(path, backend)
+            logger.info("loaded %s model %s in %.0fms", backend, path, (time.perf_counter() - start) * 1000)
+        return models[key]
+
+
+class PacmanAI:
+    def __init__(self, memory_capacity=None, memory_path=None, backend=DEFAULT_BACKEND):
+        from experience import ReplayBuffer, DEFAULT_CAPACITY
+        self.state_size = STATE_SIZE
+        self.action_size = ACTION_SIZE
+        self.memory = ReplayBuffer(memory_capacity or DEFAULT_CAPACITY, self.state_size, memory_path)
+        self.gamma = 0.95
+        self.epsilon = 1.0
+        self.epsilon_min = 0.01
+        self.epsilon_decay = 0.995
+        self.learning_rate = 0.001
+
+        self.backend = backend
+        # its own copy: the optimizer must not step the model get_model() serves
+        self.model = load_backend(backend=backend)
+        self.criterion = nn.MSELoss()
+        self._optimizer = None
+
+        from encoding import StateEncoder
+        self.encoder = StateEncoder()
+
+    # built on first use, serving never needs one; only the eager model trains
+    @property
+    def optimizer(self):
+        if self.backend != "eager":
+            raise ValueError(f"the {self.backend} backend is inference only")
+        if self._optimizer is None:
+            self._optimizer = optim.Adam(self.model.parameters(), lr=self.learning_rate)
+        return self._optimizer
+
+    def get_state(self, board):
+        return self.encoder.encode(board)
+
+    # states are the board cell codes, not the float encoding
+    def remember(self, state, action, reward, next_state, done):
+        self.memory.push(state, action, reward, next_state, done)
+
+    def act(self, state):
+        if random.random() <= self.epsilon:
+            return random.randrange(self.action_size)
+        with torch.no_grad():
+            # quantized Linear layers need a batch dimension
+            return int(self.model(state.reshape(1, -1)).argmax())
@@ -0,0 +1,369 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import metrics
+import Game
+from Game import Board, Player, Ghost, GhostAI, resolve_moves, MOVES, ENTITY_IDS, PELLET
+from mazegraph import get_maze_graph
+from ticks import DEFAULT_TICK_RATE
+
+DEFAULT_BUDGET = 0.02
+DEFAULT_MAX_DEPTH = 10
+DEFAULT_TABLE_SIZE = 100000
+
+# ghosts are modelled as chasing the way GhostAI does with CHASE_WEIGHT, the
+# rest is spread over GHOST_SAMPLES random joint moves
+CHASE_WEIGHT = 0.5
+GHOST_SAMPLES = 2
+
+SCORE_PELLET = 10.0
+SCORE_DISTANCE = -1.0
+SCORE_DANGER = -25.0
+SCORE_DEATH = -1000.0
+SCORE_CLEAR = 1000.0
+DANGER_RADIUS = 3
+# ghost distance alone walks pacman into corridors the ghosts close from
+# both ends, a few moves past the search depth; the cells pacman reaches
+# before any ghost shrink as that happens, so fewer than SAFE_CELLS of them
+# costs SCORE_TRAPPED each
+SCORE_TRAPPED = -50.0
+SAFE_CELLS = 8
+
+planner = None
+planner_lock = threading.Lock()
+planner_config = {}
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Zobrist:
+    # one random 64 bit key per entity per cell and one per pellet cell; a
+    # position hashes to the xor of the keys of everything on the board
+    def __init__(self, rows, cols, seed=0):
+        rng = random.Random(seed)
+        self.cols = cols
+        self.entity = [[rng.getrandbits(64) for _ in range(rows * cols)] for _ in ENTITY_IDS]
+        self.pellet = [rng.getrandbits(64) for _ in range(rows * cols)]
+
+    def hash(self, board):
+        key = 0
+        for index, (x, y) in enumerate(board.entities.tolist()):
+            key ^= self.entity[index][x * self.cols + y]
+        for cell in np.flatnonzero(board.grid.reshape(-1) == PELLET).tolist():
+            key ^= self.pellet[cell]
+        return key
+
+    # only the entities that moved and a pellet eaten on pacman's new cell
+    # change the key
+    def update(self, key, before, after, eaten):
+        for index, (old, new) in enumerate(zip(before, after)):
+            if old != new:
+                key ^= self.entity[index][old[0] * self.cols + old[1]] ^ self.entity[index][new[0] * self.cols + new[1]]
+        if eaten:
+            x, y = after[0]
+            key ^= self.pellet[x * self.cols + y]
+        return key
+
+
+class Maze:
+    # per maze lookups the search needs: distances, moves legal from each
+    # cell and the hash keys
+    def __init__(self, index):
+        self.graph = get_maze_graph(index)
+        rows, cols = self.graph.rows, self.graph.cols
+        self.cols = cols
+        self.nodes = self.graph.node_index.reshape(-1)
+        self.zobrist = Zobrist(rows, cols, seed=index)
+        self.legal = [[] for _ in range(rows * cols)]
+        for node, (x, y) in enumerate(self.graph.cells.tolist()):
+            self.legal[x * cols + y] = [MOVES[d] for d in range(len(MOVES)) if self.graph.neighbors[node, d] >= 0]
+
+
+class State:
+    __slots__ = ("board", "player", "ghosts", "key", "pellets")
+
+    def __init__(self, board, player, ghosts, key, pellets):
+        self.board = board
+        self.player = player
+        self.ghosts = ghosts
+        self.key = key
+        self.pellets = pellets
+
+
+class Planner:
+    # depth limited expectimax: pacman picks the best move, ghost moves are a
+    # chance node. Iterative deepening stops at the time budget and keeps the
+    # last finished depth; the first depth always finishes so there is a move.
+    def __init__(self, budget=DEFAULT_BUDGET, max_depth=DEFAULT_MAX_DEPTH, table_size=DEFAULT_TABLE_SIZE,
+                 chase=CHASE_WEIGHT, samples=GHOST_SAMPLES):
+        self.budget = budget
+        self.max_depth = max_depth
+        self.table_size = table_size
+        self.chase = chase if samples else 1.0
+        self.samples = samples
+        self.mazes = {}
+        # key -> (depth, value, move), least recently used first
+        self.table = OrderedDict()
+        self.lock = threading.Lock()
+        self.timed = False
+        self.started = 0.0
+        self.shared = False
+        self.nodes = 0
+        self.hits = 0
+        self.searches = 0
+        self.total_nodes = 0
+        self.total_seconds = 0.0
+        self.last = {}
+        # searches take turns on the table under self.lock and hold the GIL
+        # while they run, so more threads would not search more; searches
+        # queued together split the budget instead, see deadline()
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="planner")
+        self.pending_lock = threading.Lock()
+        self.pending = 0
+        self.window = None
+
+    def maze(self, index):
+        maze = self.mazes.get(index)
+        if maze is None:
+            maze = self.mazes[index] = Maze(index)
+        return maze
+
+    def root(self, maze, board, points=0):
+        board = board.clone()
+        player = Player(board.player_position())
+        player.points = points
+        ghosts = [Ghost(pos, id) for id, pos in board.ghost_positions().items()]
+        return State(board, player, ghosts, maze.zobrist.hash(board), board.pellets_remaining())
+
+    def step(self, maze, state, move, ghost_moves):
+        board = state.board.clone()
+        player = state.player.clone()
+        ghosts = [ghost.clone() for ghost in state.ghosts]
+        if resolve_moves(board, player, ghosts, move, list(ghost_moves)) == 'death':
+            return None
+        before = state.board.entities.tolist()
+        after = board.entities.tolist()
+        x, y = after[0]
+        eaten = bool(state.board.grid[x, y] == PELLET)
+        key = maze.zobrist.update(state.key, before, after, eaten)
+        return State(board, player, ghosts, key, state.pellets - eaten)
+
+    def ghost_outcomes(self, maze, state):
+        entities = state.board.entities.tolist()
+        pacman = maze.nodes[entities[0][0] * maze.cols + entities[0][1]]
+        chase = []
+        options = []
+        for x, y in entities[1:]:
+            hop = maze.graph.next_hop[maze.nodes[x * maze.cols + y], pacman]
+            chase.append(MOVES[hop] if hop >= 0 else None)
+            options.append(maze.legal[x * maze.cols + y] or [None])
+        outcomes = {tuple(chase): self.chase}
+        # samples come from the position's own key so a position always gets
+        # the same chance node and cached values stay consistent
+        bits = state.key
+        weight = (1.0 - self.chase) / self.samples if self.samples else 0.0
+        for _ in range(self.samples):
+            moves = []
+            for legal in options:
+                moves.append(legal[bits % len(legal)])
+                bits //= len(legal)
+            outcome = tuple(moves)
+            outcomes[outcome] = outcomes.get(outcome, 0.0) + weight
+        return list(outcomes.items())
+
+    def evaluate(self, maze, state):
+        if state.pellets == 0:
+            return SCORE_CLEAR + state.player.points * SCORE_PELLET
+        entities = state.board.entities
+        graph = maze.graph
+        pacman = maze.nodes[entities[0, 0] * maze.cols + entities[0, 1]]
+        score = state.player.points * SCORE_PELLET
+        pellets = maze.nodes[np.flatnonzero(state.board.grid.reshape(-1) == PELLET)]
+        score += SCORE_DISTANCE * int(graph.distances[pacman, pellets].min())
+        ghosts = maze.nodes[entities[1:, 0] * maze.cols + entities[1:, 1]]
+        distances = graph.distances[pacman, ghosts]
+        close = distances[(distances >= 0) & (distances < DANGER_RADIUS)]
+        score += SCORE_DANGER * int((DANGER_RADIUS - close).sum())
+        safe = np.count_nonzero(graph.distances[pacman] < graph.distances[ghosts].min(axis=0))
+        score += SCORE_TRAPPED * max(0, SAFE_CELLS - safe)
+        return score
+
+    def lookup(self, key, depth):
+        entry = self.table.get(key)
+        if entry is None or entry[0] < depth:
+            return None
+        self.table.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def store(self, key, depth, value, move):
+        self.table[key] = (depth, value, move)
+        self.table.move_to_end(key)
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+
+    def value(self, maze, state, depth):
+        self.nodes += 1
+        if self.timed and not self.nodes & 15 and time.perf_counter() > self.deadline():
+            raise SearchTimeout()
+        if depth == 0 or state.pellets == 0:
+            return self.evaluate(maze, state)
+        entry = self.lookup(state.key, depth)
+        if entry is not None:
+            return entry[1]
+        return self.expand(maze, state, depth)[0]
+
+    def expand(self, maze, state, depth):
+        outcomes = self.ghost_outcomes(maze, state)
+        x, y = state.player.x, state.player.y
+        best_value, best_move = None, None
+        for move in maze.legal[x * maze.cols + y] or [None]:
+            total = 0.0
+            for ghost_moves, weight in outcomes:
+                child = self.step(maze, state, move, ghost_moves)
+                total += weight * (SCORE_DEATH if child is None else self.value(maze, child, depth - 1))
+            if best_value is None or total > best_value:
+                best_value, best_move = total, move
+        self.store(state.key, depth, best_value, best_move)
+        return best_value, best_move
+
+    # N planner matches submit N searches a tick. Searches from submit()
+    # share one budget window: each gets an even share of what is left of it
+    # with the searches queued behind it, counting ones queued while it runs,
+    # so the tick still costs about one budget instead of N
+    def deadline(self):
+        if not self.shared:
+            return self.started + self.budget
+        return self.started + (self.window - self.started) / max(self.pending, 1)
+
+    def search(self, board, points=0, shared=False):
+        with self.lock:
+            started = self.started = time.perf_counter()
+            if shared:
+                with self.pending_lock:
+                    if self.window is None or started >= self.window:
+                        self.window = started + self.budget
+            self.shared = shared
+            maze = self.maze(board.rand)
+            root = self.root(maze, board, points)
+            self.nodes = 0
+            self.hits = 0
+            move, depth = None, 0
+            try:
+                for limit in range(1, self.max_depth + 1):
+                    entry = self.lookup(root.key, limit)
+                    move = entry[2] if entry is not None else self.expand(maze, root, limit)[1]
+                    depth = limit
+                    self.timed = True
+                    if time.perf_counter() > self.deadline():
+                        break
+            except SearchTimeout:
+                pass
+            finally:
+                self.timed = False
+            budget = self.deadline() - started
+            elapsed = time.perf_counter() - started
+            self.searches += 1
+            self.total_nodes += self.nodes
+            self.total_seconds += elapsed
+            self.last = {
+                "depth": depth,
+                "nodes": self.nodes,
+                "seconds": elapsed,
+                "budget": budget,
+                "nodes_per_sec": self.nodes / elapsed if elapsed else 0.0,
+                "table_hits": self.hits,
+                "table_size": len(self.table),
+            }
+        metrics.PLAN_SECONDS.observe(elapsed)
+        metrics.PLAN_NODES.inc(self.last["nodes"])
+        return move
+
+    def plan(self, board, points=0):
+        try:
+            move = self.search(board, points, shared=True)
+        finally:
+            with self.pending_lock:
+                self.pending -= 1
+                if not self.pending:
+                    self.window = None
+        return MOVES.index(move) if move is not None else 0
+
+    # same contract as InferenceService.submit: a future of the MOVES index,
+    # collected by Match.collect_ai_move. The match keeps moving its board,
+    # so the search gets a copy.
+    def submit(self, board, points=0):
+        with self.pending_lock:
+            self.pending += 1
+        return self.executor.submit(self.plan, board.clone(), points)
+
+    def stats(self):
+        return {
+            "searches": self.searches,
+            "nodes": self.total_nodes,
+            "seconds": self.total_seconds,
+            "nodes_per_sec": self.total_nodes / self.total_seconds if self.total_seconds else 0.0,
+            "budget": self.budget,
+            "last": dict(self.last),
+        }
+
+
+# switches Player.request_ai_move from the DQN to the planner
+def configure_planner(**kwargs):
+    planner_config.update(kwargs)
+    Game.ai_agent = "planner"
+
+
+def get_planner():
+    global planner
+    if planner is None:
+        with planner_lock:
+            if planner is None:
+                planner = Planner(**planner_config)
+    return planner
+
+
+# plays one game against the chasing GhostAI and reports the search rate
+def play(planner, max_ticks=500):
+    board = Board()
+    positions = board.get_positions()
+    player = Player(positions['player'])
+    ghosts = [Ghost(pos, id) for pos, id in zip(positions['ghosts'], "abcd")]
+    ghost_ai = GhostAI()
+    depths = []
+    result = "timeout"
+    for tick in range(max_ticks):
+        move = planner.search(board, player.points)
+        depths.append(planner.last["depth"])
+        if resolve_moves(board, player, ghosts, move, ghost_ai.get_ai_moves(board)) == 'death':
+            result = "death"
+            break
+        if board.pellets_remaining() == 0:
+            result = "clear"
+            break
+    return {"result": result, "ticks": tick + 1, "points": player.points,
+            "mean_depth": sum(depths) / len(depths)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play the lookahead planner against the ghost AI and report its speed.')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='Seconds of search per move')
+    parser.add_argument('--max-depth', type=int, default=DEFAULT_MAX_DEPTH, help='Deepest search in ticks')
+    parser.add_argument('--table-size', type=int, default=DEFAULT_TABLE_SIZE, help='Transposition table entries')
+    parser.add_argument('--games', type=int, default=1)
+    parser.add_argument('--max-ticks', type=int, default=500)
+    parser.add_argument('--tick-rate', type=float, default=DEFAULT_TICK_RATE, help='Server tick rate to size the budget against')
+    args = parser.parse_args()
+
+    planner = Planner(args.budget, args.max_depth, args.table_size)
+    games = [play(planner, args.max_ticks) for _ in range(args.games)]
+    stats = planner.stats()
+    stats["tick_share"] = stats["seconds"] / stats["searches"] * args.tick_rate
+    print(json.dumps({"games": games, "stats": stats}, indent=2))
@@ -0,0 +1,197 @@
+import os
+import struct
+import numpy as np
+from Game import CELL_CHARS, ENTITY_CODES, EMPTY, PACMAN, MOVES
+
+MAGIC = b"PACR"
+VERSION = 1
+KEYFRAME_INTERVAL = 256
+HEADER = struct.Struct("<4sHBBH16s")
+NO_MOVE = -1
+RESULTS = {None: 0, 'death': 1, 'cleared': 2}
+# same rewards as simulation.VecPacmanEnv
+REWARD_DEATH = -10.0
+REWARD_CLEAR = 10.0
+
+# a file is the header followed by blocks: a keyframe holding the full state
+# at tick n * interval, then up to interval tick records, so the byte offset
+# of any tick is plain arithmetic
+
+
+def keyframe_dtype(rows, cols):
+    return np.dtype([
+        ("tick", "<u4"),
+        ("points", "<u4"),
+        ("entities", "u1", (len(ENTITY_CODES), 2)),
+        ("grid", "u1", (rows, cols)),
+    ])
+
+
+TICK_DTYPE = np.dtype([
+    ("tick", "<u4"),
+    ("player_move", "i1"),
+    ("ghost_moves", "i1", (4,)),
+    ("result", "u1"),
+    ("points", "<u4"),
+    ("entities", "u1", (len(ENTITY_CODES), 2)),
+])
+
+
+def move_index(move):
+    return MOVES.index(move) if move in MOVES else NO_MOVE
+
+
+class ReplayWriter:
+    def __init__(self, path, board, match_id="", interval=KEYFRAME_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.keyframe = np.zeros((), dtype=keyframe_dtype(board.row, board.col))
+        self.record = np.zeros((), dtype=TICK_DTYPE)
+        self.tick = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, board.row, board.col, interval, match_id.encode()[:16]))
+        self.write_keyframe(board, 0)
+
+    def write_keyframe(self, board, points):
+        self.keyframe["tick"] = self.tick
+        self.keyframe["points"] = points
+        self.keyframe["entities"] = board.entities
+        self.keyframe["grid"] = board.grid
+        self.file.write(self.keyframe.tobytes())
+        self.file.flush()
+
+    def record_tick(self, tick, board, points, player_move=None, ghost_moves=None, result=None):
+        self.tick = tick
+        self.record["tick"] = tick
+        self.record["player_move"] = move_index(player_move)
+        self.record["ghost_moves"] = [move_index(move) for move in (ghost_moves or [None] * 4)]
+        self.record["result"] = RESULTS[result]
+        self.record["points"] = points
+        self.record["entities"] = board.entities
+        self.file.write(self.record.tobytes())
+        if tick % self.interval == 0:
+            self.write_keyframe(board, points)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class ReplayReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, rows, cols, interval, match_id = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} replay")
+        self.rows, self.cols = rows, cols
+        self.interval = interval
+        self.match_id = match_id.rstrip(b"\0").decode()
+        self.keyframe_dtype = keyframe_dtype(rows, cols)
+        self.block_size = self.keyframe_dtype.itemsize + interval * TICK_DTYPE.itemsize
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        body = len(self.data) - HEADER.size
+        blocks, rest = divmod(body, self.block_size)
+        # a partially written trailing record is ignored
+        self.ticks = blocks * interval + max(0, rest - self.keyframe_dtype.itemsize) // TICK_DTYPE.itemsize
+
+    def __len__(self):
+        return self.ticks
+
+    def keyframe_offset(self, block):
+        return HEADER.size + block * self.block_size
+
+    def record_offset(self, tick):
+        block, index = divmod(tick - 1, self.interval)
+        return self.keyframe_offset(block) + self.keyframe_dtype.itemsize + index * TICK_DTYPE.itemsize
+
+    def get_keyframe(self, block):
+        offset = self.keyframe_offset(block)
+        return self.data[offset:offset + self.keyframe_dtype.itemsize].view(self.keyframe_dtype)[0]
+
+    def get_record(self, tick):
+        offset = self.record_offset(tick)
+        return self.data[offset:offset + TICK_DTYPE.itemsize].view(TICK_DTYPE)[0]
+
+    def records(self, start, stop):
+        # records of one block are contiguous, so a block is read in one view
+        tick = start
+        while tick < stop:
+            block_end = min(stop, ((tick - 1) // self.interval + 1) * self.interval + 1)
+            offset = self.record_offset(tick)
+            count = block_end - tick
+            yield self.data[offset:offset + count * TICK_DTYPE.itemsize].view(TICK_DTYPE)
+            tick = block_end
+
+    def state_at(self, tick):
+        if not 0 <= tick <= self.ticks:
+            raise IndexError(f"tick {tick} outside replay of {self.ticks} ticks")
+        block = tick // self.interval
+        if self.keyframe_offset(block) + self.keyframe_dtype.itemsize > len(self.data):
+            # the keyframe closing the last block was never written
+            block -= 1
+        keyframe = self.get_keyframe(block)
+        grid = keyframe["grid"].copy()
+        entities = keyframe["entities"].astype(np.intp)
+        points = int(keyframe["points"])
+        start = block * self.interval + 1
+        if tick >= start:
+            for chunk in self.records(start, tick + 1):
+                pacman = chunk["entities"][:, 0]
+                grid[pacman[:, 0], pacman[:, 1]] = EMPTY
+            entities = chunk["entities"][-1].astype(np.intp)
+            points = int(chunk["points"][-1])
+        return grid, entities, points
+
+    def codes_at(self, tick):
+        grid, entities, points = self.state_at(tick)
+        return overlay(grid, entities), points
+
+    def board_at(self, tick):
+        codes, points = self.codes_at(tick)
+        return render(codes), points
+
+    def replay_from(self, start=0):
+        grid, entities, points = self.state_at(start)
+        yield start, grid, entities, points, None
+        for chunk in self.records(start + 1, self.ticks + 1):
+            for record in chunk:
+                entities = record["entities"]
+                grid[entities[0, 0], entities[0, 1]] = EMPTY
+                yield int(record["tick"]), grid, entities, int(record["points"]), record
+
+    # spectator playback: (tick, board rows, points) from any tick onwards
+    def frames(self, start=0):
+        for tick, grid, entities, points, record in self.replay_from(start):
+            yield tick, render(overlay(grid, entities)), points
+
+    # (state, action, reward, next_state, done) with states as flat uint8 cell
+    # codes, ready for the DQN replay memory; ticks without a pacman move are skipped
+    def transitions(self):
+        state = None
+        last_points = 0
+        for tick, grid, entities, points, record in self.replay_from(0):
+            next_state = overlay(grid, entities).reshape(-1)
+            if record is not None and record["player_move"] != NO_MOVE:
+                reward = float(points - last_points)
+                if record["result"] == RESULTS['death']:
+                    reward += REWARD_DEATH
+                elif record["result"] == RESULTS['cleared']:
+                    reward += REWARD_CLEAR
+                yield state, int(record["player_move"]), reward, next_state, bool(record["result"])
+            state = next_state
+            last_points = points
+
+
+def overlay(grid, entities):
+    codes = grid.copy()
+    codes[entities[1:, 0], entities[1:, 1]] = ENTITY_CODES[1:]
+    codes[entities[0, 0], entities[0, 1]] = PACMAN
+    return codes
+
+
+def render(codes):
+    cols = codes.shape[1]
+    chars = CELL_CHARS[codes].tobytes().decode()
+    return [chars[i:i + cols] for i in range(0, len(chars), cols)]
@@ -0,0 +1,276 @@
+import itertools
+import logging
+import threading
+import zlib
+from concurrent.futures import Future
+from matches import MatchRegistry, DEFAULT_MATCH, generate_random_string
+from ticks import TickScheduler, DEFAULT_TICK_RATE
+from bus import LocalBus
+
+logger = logging.getLogger(__name__)
+
+FRONT = "front"
+RPC_TIMEOUT = 5.0
+START_TIMEOUT = 60.0
+
+# sharded mode: worker processes own the matches (board, ticks, AI) and the
+# front process keeps the sockets, the token queue and a RemoteMatch proxy
+# per match. Moves go to a worker as bus commands, board emits come back as
+# bus events and the front sends them on to the Socket.IO rooms.
+
+
+def shard_channel(shard):
+    return f"shard:{shard}"
+
+
+# stable across processes, unlike hash()
+def shard_for(match_id, count):
+    return zlib.crc32(match_id.encode()) % count
+
+
+def match_state(match):
+    return {"moves": match.moves, "finished": match.finished, "winner": match.winner}
+
+
+class ShardWorker:
+    methods = ("submit", "connect", "take_seat", "disconnect", "is_connected",
+               "add_viewer", "remove_viewer", "snapshot")
+
+    def __init__(self, shard, registry, bus):
+        self.shard = shard
+        self.registry = registry
+        self.bus = bus
+        registry.on_remove = self.removed
+
+    def handle(self, message):
+        try:
+            result = self.execute(message["method"], message.get("match"), message.get("args", []))
+        except Exception as e:
+            logger.exception("shard %d: %s failed", self.shard, message["method"])
+            self.bus.publish(FRONT, {"type": "reply", "id": message["id"], "error": repr(e)})
+            return
+        self.bus.publish(FRONT, {"type": "reply", "id": message["id"], "result": result})
+
+    def execute(self, method, match_id, args):
+        if method == "create":
+            match = self.registry.create(match_id, *args)
+            return {"id": match.id, "player_token": match.player_token, "ghost_token": match.ghost_token}
+        if method == "list":
+            return {match.id: match_state(match) for match in self.registry}
+        if method == "remove":
+            self.registry.remove(match_id)
+            return None
+        if method not in self.methods:
+            raise ValueError(f"unknown shard command {method}")
+        match = self.registry.get(match_id)
+        if match is None:
+            raise KeyError(f"no match {match_id} on shard {self.shard}")
+        return {"value": getattr(match, method)(*args), "state": match_state(match)}
+
+    def removed(self, match):
+        self.bus.publish(FRONT, {"type": "removed", "match": match.id})
+
+
+def run_worker(shard, endpoint, tick_rate=DEFAULT_TICK_RATE, replay_dir=None, inference=None, planner=None,
+               wait=True):
+    if wait:
+        logging.basicConfig(level=logging.INFO)
+    if inference:
+        from inference import configure_inference
+        configure_inference(**inference)
+    if planner is not None:
+        from planner import configure_planner
+        configure_planner(**planner)
+    bus = endpoint.open()
+
+    def emit(event, data=None, to=None, **kwargs):
+        bus.publish(FRONT, {"type": "emit", "event": event, "data": data, "to": to})
+
+    registry = MatchRegistry(emit, replay_dir)
+    worker = ShardWorker(shard, registry, bus)
+    bus.subscribe(shard_channel(shard), worker.handle)
+    scheduler = TickScheduler(registry, tick_rate,
+                              lambda run: threading.Thread(target=run, name=f"ticks-{shard}", daemon=True).start())
+    scheduler.start()
+    worker.scheduler = scheduler
+    bus.publish(FRONT, {"type": "ready", "shard": shard})
+    if wait:
+        threading.Event().wait()
+    return worker
+
+
+class RemoteMatch:
+    def __init__(self, registry, shard, info):
+        self.registry = registry
+        self.shard = shard
+        self.id = info["id"]
+        self.room = self.id
+        self.player_token = info["player_token"]
+        self.ghost_token = info["ghost_token"]
+        self.moves = 0
+        self.finished = False
+        self.winner = None
+
+    def stream_room(self, mode):
+        return f"{self.room}:{mode}"
+
+    def update(self, state):
+        self.moves = state["moves"]
+        self.finished = state["finished"]
+        self.winner = state["winner"]
+
+    def call(self, method, *args):
+        reply = self.registry.call(self.shard, method, self.id, *args)
+        self.update(reply["state"])
+        return reply["value"]
+
+    def submit(self, side, move):
+        return self.call("submit", side, move)
+
+    def connect(self, side, name=None):
+        return self.call("connect", side, name)
+
+    def take_seat(self, side):
+        return self.call("take_seat", side)
+
+    def disconnect(self, side, id=None):
+        return self.call("disconnect", side, id)
+
+    def is_connected(self, side):
+        return self.call("is_connected", side)
+
+    def add_viewer(self, mode):
+        return self.call("add_viewer", mode)
+
+    def remove_viewer(self, mode):
+        return self.call("remove_viewer", mode)
+
+    def snapshot(self, mode):
+        event, data = self.call("snapshot", mode)
+        return event, data
+
+
+class ShardedRegistry:
+    # same interface main.py uses on MatchRegistry, backed by worker shards;
+    # threads=True keeps the workers in this process, as LocalBus always does
+    def __init__(self, bus, workers, emit, tick_rate=DEFAULT_TICK_RATE, replay_dir=None,
+                 inference=None, timeout=RPC_TIMEOUT, threads=False, planner=None):
+        self.bus = bus
+        self.threads = threads or isinstance(bus, LocalBus)
+        self.count = workers
+        self.emit = emit
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.matches = {}
+        self.by_token = {}
+        self.pending = {}
+        self.ids = itertools.count(1)
+        self.ready = threading.Semaphore(0)
+        self.workers = []
+        bus.subscribe(FRONT, self.receive)
+        options = {"tick_rate": tick_rate, "replay_dir": replay_dir, "inference": inference, "planner": planner}
+        for shard in range(workers):
+            self.workers.append(self.start_worker(shard, options))
+        for shard in range(workers):
+            if not self.ready.acquire(timeout=START_TIMEOUT):
+                raise RuntimeError(f"only {shard} of {workers} match workers started")
+
+    def start_worker(self, shard, options):
+        if self.threads:
+            return run_worker(shard, self.bus, wait=False, **options)
+        import multiprocessing
+        process = multiprocessing.get_context("spawn").Process(
+            target=run_worker, args=(shard, self.bus.endpoint()), kwargs=options,
+            name=f"match-worker-{shard}", daemon=True)
+        process.start()
+        return process
+
+    def receive(self, message):
+        kind = message["type"]
+        if kind == "emit":
+            self.emit(message["event"], message["data"], to=message["to"])
+        elif kind == "reply":
+            with self.lock:
+                future = self.pending.pop(message["id"], None)
+            if future is None:
+                return
+            if "error" in message:
+                future.set_exception(RuntimeError(message["error"]))
+            else:
+                future.set_result(message["result"])
+        elif kind == "removed":
+            self.forget(message["match"])
+        elif kind == "ready":
+            self.ready.release()
+
+    def call(self, shard, method, match_id=None, *args):
+        request_id = next(self.ids)
+        future = Future()
+        with self.lock:
+            self.pending[request_id] = future
+        self.bus.publish(shard_channel(shard), {"id": request_id, "method": method, "match": match_id, "args": list(args)})
+        try:
+            return future.result(self.timeout)
+        finally:
+            with self.lock:
+                self.pending.pop(request_id, None)
+
+    def create(self, match_id=None, ai_sides=()):
+        with self.lock:
+            if match_id is None:
+                match_id = generate_random_string()
+                while match_id in self.matches:
+                    match_id = generate_random_string()
+            elif match_id in self.matches:
+                return self.matches[match_id]
+        shard = shard_for(match_id, self.count)
+        match = RemoteMatch(self, shard, self.call(shard, "create", match_id, sorted(ai_sides)))
+        with self.lock:
+            self.matches.setdefault(match.id, match)
+            self.by_token[match.player_token] = (match, "player")
+            self.by_token[match.ghost_token] = (match, "ghost")
+            return self.matches[match.id]
+
+    def get(self, match_id):
+        return self.matches.get(match_id)
+
+    def get_default(self):
+        match = self.matches.get(DEFAULT_MATCH)
+        if match is None:
+            match = self.create(DEFAULT_MATCH)
+        return match
+
+    def find_by_token(self, token):
+        return self.by_token.get(token, (None, None))
+
+    def forget(self, match_id):
+        with self.lock:
+            match = self.matches.pop(match_id, None)
+            if match is None:
+                return None
+            self.by_token.pop(match.player_token, None)
+            self.by_token.pop(match.ghost_token, None)
+            return match
+
+    def remove(self, match_id):
+        match = self.forget(match_id)
+        if match is not None:
+            self.call(match.shard, "remove", match_id)
+        return match
+
+    def set_emit(self, emit):
+        self.emit = emit
+
+    def refresh(self):
+        for shard in range(self.count):
+            for match_id, state in self.call(shard, "list").items():
+                match = self.matches.get(match_id)
+                if match is not None:
+                    match.update(state)
+
+    def __len__(self):
+        return len(self.matches)
+
+    def __iter__(self):
+        self.refresh()
+        return iter(list(self.matches.values()))
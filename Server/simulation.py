@@ -0,0 +1,135 @@
+import numpy as np
+from Game import boardtypes, CHAR_TO_CODE, ENTITY_CODES, EMPTY, WALL, PELLET, PACMAN
+from encoding import StateEncoder
+
+# action index -> (dx, dy), same order as Game.MOVES
+ACTION_DELTAS = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.intp)
+
+REWARD_PELLET = 1.0
+REWARD_DEATH = -10.0
+REWARD_CLEAR = 10.0
+REWARD_STEP = 0.0
+
+
+def load_maze(index=0):
+    arr = boardtypes[index]
+    chars = np.frombuffer(''.join(arr).encode(), dtype=np.uint8).reshape(len(arr), -1)
+    codes = CHAR_TO_CODE[chars]
+    entities = np.array([np.argwhere(codes == code)[0] for code in ENTITY_CODES], dtype=np.intp)
+    codes[codes >= PACMAN] = EMPTY
+    return codes, entities
+
+
+class VecPacmanEnv:
+    def __init__(self, num_envs, maze=0, max_steps=1000, seed=None, planes=False):
+        self.num_envs = num_envs
+        self.max_steps = max_steps
+        self.rng = np.random.default_rng(seed)
+        self.template, self.start = load_maze(maze)
+        self.rows, self.cols = self.template.shape
+        self.state_size = self.rows * self.cols
+        self.action_size = len(ACTION_DELTAS)
+        self.total_pellets = int(np.count_nonzero(self.template == PELLET))
+
+        self.grid = np.empty((num_envs, self.rows, self.cols), dtype=np.uint8)
+        self.entities = np.empty((num_envs, len(ENTITY_CODES), 2), dtype=np.intp)
+        self.points = np.zeros(num_envs, dtype=np.int32)
+        self.pellets = np.zeros(num_envs, dtype=np.int32)
+        self.steps = np.zeros(num_envs, dtype=np.int32)
+        self.index = np.arange(num_envs)
+        self.encoder = StateEncoder(num_envs, planes, self.rows, self.cols)
+        self.obs = self.encoder.buffer
+        self.obs_tensor = self.encoder.tensor
+        self.reset()
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+        self.grid[mask] = self.template
+        self.entities[mask] = self.start
+        self.points[mask] = 0
+        self.pellets[mask] = self.total_pellets
+        self.steps[mask] = 0
+        return self.observe()
+
+    def codes(self):
+        codes = self.grid.copy()
+        # ghosts first so pacman is drawn on top if they share a cell
+        for entity in range(len(ENTITY_CODES) - 1, -1, -1):
+            codes[self.index, self.entities[:, entity, 0], self.entities[:, entity, 1]] = ENTITY_CODES[entity]
+        return codes
+
+    # the returned array is reused across steps, copy it before storing;
+    # obs_tensor is a zero-copy torch view of it
+    def observe(self):
+        self.encoder.encode_batch(self.codes())
+        return self.obs
+
+    def targets(self, positions, actions):
+        targets = positions + ACTION_DELTAS[actions]
+        targets[..., 1] %= self.cols
+        return targets
+
+    def legal_actions(self, positions):
+        targets = positions[..., None, :] + ACTION_DELTAS
+        targets[..., 1] %= self.cols
+        index = self.index.reshape((-1,) + (1,) * (targets.ndim - 2))
+        return self.grid[index, targets[..., 0], targets[..., 1]] != WALL
+
+    def random_ghost_actions(self):
+        legal = self.legal_actions(self.entities[:, 1:])
+        scores = self.rng.random(legal.shape) * legal
+        return scores.argmax(axis=-1)
+
+    def step(self, actions, ghost_actions=None):
+        actions = np.asarray(actions, dtype=np.intp)
+        if ghost_actions is None:
+            ghost_actions = self.random_ghost_actions()
+        ghost_actions = np.asarray(ghost_actions, dtype=np.intp)
+        rewards = np.full(self.num_envs, REWARD_STEP, dtype=np.float32)
+        dead = np.zeros(self.num_envs, dtype=bool)
+
+        # both sides move at once, as in Game.resolve_moves: ghosts step in id
+        # order so one ghost blocks the next, and pacman dies when a ghost ends
+        # on its target or the two trade cells. A death stops the tick there.
+        pacman = self.entities[:, 0]
+        start = pacman.copy()
+        target = self.targets(pacman, actions)
+        stays = self.grid[self.index, target[:, 0], target[:, 1]] == WALL
+        target[stays] = start[stays]
+        for ghost in range(1, len(ENTITY_CODES)):
+            position = self.entities[:, ghost]
+            before = position.copy()
+            ghost_target = self.targets(position, ghost_actions[:, ghost - 1])
+            open_cell = self.grid[self.index, ghost_target[:, 0], ghost_target[:, 1]] != WALL
+            blocked = (self.entities[:, 1:] == ghost_target[:, None]).all(axis=-1).any(axis=-1)
+            moves = open_cell & ~blocked & ~dead
+            position[moves] = ghost_target[moves]
+            catches = (position == target).all(axis=-1)
+            swaps = (position == start).all(axis=-1) & (before == target).all(axis=-1)
+            dead |= catches | swaps
+
+        alive = ~dead
+        pacman[alive] = target[alive]
+        cells = self.grid[self.index, pacman[:, 0], pacman[:, 1]]
+        eaten = alive & (cells == PELLET)
+        rewards[eaten] += REWARD_PELLET
+        self.points += eaten
+        self.pellets -= eaten
+        self.grid[self.index[alive], pacman[alive, 0], pacman[alive, 1]] = EMPTY
+
+        cleared = (self.pellets == 0) & ~dead
+        rewards[dead] += REWARD_DEATH
+        rewards[cleared] += REWARD_CLEAR
+        self.steps += 1
+        dones = dead | cleared | (self.steps >= self.max_steps)
+
+        info = {}
+        if dones.any():
+            info["final_obs"] = self.observe()[dones].copy()
+            info["final_points"] = self.points[dones].copy()
+            info["won"] = cleared[dones]
+            self.reset(dones)
+        else:
+            self.observe()
+        return self.obs, rewards, dones, info
@@ -10,6 +10,12 @@ function initializeSocket() {
     return io({
         extraHeaders: {
             'Authorization': 'Bearer ' + localStorage.getItem('token')
+        },
+        query: {
+            match: new URLSearchParams(window.location.search).get('match') || ''
+        },
+        auth: {
+            capabilities: ['binary', 'delta']
         }
     });
 }
@@ -34,12 +40,61 @@ function setupSocketHandlers() {
         show_points(board[1])
     })
 
+    socket.on('board-keyframe', (frame) => {
+        boardState = frame.board.map(row => row.split(''))
+        boardSeq = frame.seq
+        drawBoard(boardState);
+        show_points(frame.points)
+    })
+
+    socket.on('board-delta', (frame) => {
+        if (boardSeq === null || frame.seq <= boardSeq) {
+            return
+        }
+        if (frame.seq !== boardSeq + 1) {
+            boardSeq = null
+            socket.emit('resync')
+            return
+        }
+        frame.cells.forEach(([x, y, cell]) => {
+            boardState[x][y] = cell
+        })
+        boardSeq = frame.seq
+        drawBoard(boardState);
+        show_points(frame.points)
+    })
+
+    socket.on('board-binary', (data) => {
+        const frame = decodeBinaryFrame(data)
+        if (!frame.keyframe) {
+            if (boardSeq === null || frame.seq <= boardSeq) {
+                return
+            }
+            if (frame.seq !== boardSeq + 1) {
+                boardSeq = null
+                socket.emit('resync')
+                return
+            }
+        }
+        applyBinaryFrame(frame)
+        boardSeq = frame.seq
+        drawBoard(boardState);
+        show_points(frame.points)
+    })
+
     socket.on('player-connected', (name) => {
         player.innerHTML = name
     })
     socket.on('ghost-connected', (name) => {
         ghost.innerHTML = name
     })
+    socket.on('queue-position', (status) => {
+        if (status.role == 'player') {
+            assign_player()
+        } else {
+            assign_spectator(status.position)
+        }
+    })
     socket.on('token-refresh',()=>{
        
         location.reload()
@@ -107,6 +162,63 @@ var ghost_dock = document.getElementById('ghost-dock')
 
 var gameover = document.getElementById('gameover')
 
+var boardState = null
+var boardSeq = null
+var boardTerrain = null
+
+// binary frames, see Server/broadcast.py: header (version, flags, rows,
+// cols, u32 seq, u32 points), five (x, y) entity bytes, then 4 bit terrain
+// cells (keyframe) or u16 code << 12 | cell index per changed cell (delta)
+const CELL_CHARS = ' #.opabcd'
+const ENTITY_IDS = 'pabcd'
+const BINARY_KEYFRAME = 1
+const BINARY_HEADER = 12
+
+function decodeBinaryFrame(data) {
+    const bytes = data instanceof ArrayBuffer ? new Uint8Array(data) : new Uint8Array(data.buffer, data.byteOffset, data.byteLength)
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength)
+    const frame = {
+        keyframe: (bytes[1] & BINARY_KEYFRAME) !== 0,
+        rows: bytes[2],
+        cols: bytes[3],
+        seq: view.getUint32(4, true),
+        points: view.getUint32(8, true),
+        entities: []
+    }
+    for (let i = 0; i < ENTITY_IDS.length; i++) {
+        frame.entities.push([bytes[BINARY_HEADER + 2 * i], bytes[BINARY_HEADER + 2 * i + 1]])
+    }
+    frame.body = bytes.subarray(BINARY_HEADER + 2 * ENTITY_IDS.length)
+    return frame
+}
+
+function applyBinaryFrame(frame) {
+    if (frame.keyframe) {
+        boardTerrain = []
+        for (let row = 0; row < frame.rows; row++) {
+            const cells = []
+            for (let col = 0; col < frame.cols; col++) {
+                const index = row * frame.cols + col
+                const byte = frame.body[index >> 1]
+                cells.push(index & 1 ? byte & 15 : byte >> 4)
+            }
+            boardTerrain.push(cells)
+        }
+    } else {
+        for (let i = 0; i + 1 < frame.body.length; i += 2) {
+            const change = frame.body[i] | (frame.body[i + 1] << 8)
+            const index = change & 0xfff
+            boardTerrain[Math.floor(index / frame.cols)][index % frame.cols] = change >> 12
+        }
+    }
+    boardState = boardTerrain.map(row => row.map(code => CELL_CHARS[code]))
+    // ghosts first so pacman is drawn on top, like Board.codes()
+    for (let i = ENTITY_IDS.length - 1; i >= 0; i--) {
+        const [x, y] = frame.entities[i]
+        boardState[x][y] = ENTITY_IDS[i]
+    }
+}
+
 var socket = initializeSocket()
 setupSocketHandlers()
 reloadSocketConnection();
@@ -187,7 +299,6 @@ document.addEventListener('DOMContentLoaded', function () {
         var tokenInput = document.getElementById('token-input').value;
         enterToken(tokenInput);
         setToken(tokenInput);
-        check_token(tokenInput)
         
     });
 
@@ -0,0 +1,98 @@
+import json
+import os
+import random
+import sys
+import numpy as np
+import pytest
+from Game import Board, Player, Ghost, resolve_moves, MOVES
+from broadcast import BoardStream
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clients"))
+from board_sync import BoardSync
+
+TICKS = 3000
+
+
+def new_game():
+    board = Board()
+    positions = board.get_positions()
+    player = Player(positions['player'])
+    ghosts = [Ghost(pos, id) for pos, id in zip(positions['ghosts'], "abcd")]
+    return board, player, ghosts
+
+
+# random games as Match.resolve_tick plays them, each frame applied by the
+# client side decoders and compared with the server's own board; a finished
+# game starts a new one the way Match.reset rebases the stream
+@pytest.mark.parametrize("codes", [False, True])
+def test_binary_frames_rebuild_the_board(codes):
+    rng = random.Random(0)
+    np.random.seed(0)
+    board, player, ghosts = new_game()
+    stream = BoardStream(board)
+    binary = BoardSync()
+    assert binary.binary(stream.binary_keyframe())
+    text = BoardSync()
+    text.keyframe(stream.keyframe())
+    late = None
+    for tick in range(TICKS):
+        player_move = rng.choice(MOVES + [None])
+        ghost_moves = [rng.choice(MOVES) for _ in ghosts] if rng.random() < 0.9 else None
+        result = resolve_moves(board, player, ghosts, player_move, ghost_moves)
+        stream.advance(board, player.points, codes=codes)
+        frame = stream.binary_delta()
+        assert binary.binary(frame) is True
+        assert binary.get_board() == board.get_board()
+        assert binary.points == player.points
+        assert binary.entities == stream.get_entities()
+        if codes:
+            assert text.apply(stream.delta()) is True
+            assert text.get_board() == board.get_board()
+        if late is None and tick == TICKS // 3:
+            late = BoardSync()
+            assert late.binary(stream.binary_keyframe())
+        elif late is not None:
+            assert late.binary(frame) is True
+            assert late.get_board() == board.get_board()
+        if result == 'death' or board.pellets_remaining() == 0:
+            board, player, ghosts = new_game()
+            stream.rebase(board, 0)
+            assert binary.binary(stream.binary_keyframe())
+            text.keyframe(stream.keyframe())
+            late = None
+            assert binary.get_board() == board.get_board()
+
+
+def test_binary_gap_needs_a_keyframe():
+    board, player, ghosts = new_game()
+    stream = BoardStream(board)
+    sync = BoardSync()
+    assert sync.binary(stream.binary_delta()) is None
+    assert sync.binary(stream.binary_keyframe()) is True
+    for _ in range(2):
+        resolve_moves(board, player, ghosts, MOVES[0], None)
+        stream.advance(board, player.points, codes=False)
+    assert sync.binary(stream.binary_delta()) is False
+    assert sync.binary(stream.binary_delta()) is None
+    assert sync.binary(stream.binary_keyframe()) is True
+    assert sync.get_board() == board.get_board()
+
+
+# the wire sizes the binary mode exists for: every frame against the JSON
+# one a client in the other modes gets for the same tick
+def test_binary_frames_are_smaller_than_json():
+    rng = random.Random(2)
+    np.random.seed(2)
+    board, player, ghosts = new_game()
+    stream = BoardStream(board)
+    full = len(json.dumps([board.get_board(), player.points]))
+    assert len(stream.binary_keyframe()) * 2 < full
+    assert len(stream.binary_keyframe()) * 2 < len(json.dumps(stream.keyframe()))
+    for _ in range(200):
+        result = resolve_moves(board, player, ghosts, rng.choice(MOVES), [rng.choice(MOVES) for _ in ghosts])
+        if result == 'death':
+            break
+        stream.advance(board, player.points)
+        binary = len(stream.binary_delta())
+        assert binary * 20 < len(json.dumps([board.get_board(), player.points]))
+        assert binary * 3 < len(json.dumps(stream.delta()))
@@ -0,0 +1,101 @@
+import json
+import queue
+import pytest
+from bus import LocalBus, RedisBus, encode_bytes, decode_bytes
+
+
+class FakePubSub:
+    def __init__(self, server):
+        self.server = server
+        self.messages = queue.Queue()
+        self.channels = set()
+
+    def subscribe(self, channel):
+        self.channels.add(channel)
+
+    def get_message(self, timeout=0.0):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.server.subscribers.remove(self)
+
+
+class FakeRedis:
+    # the two calls RedisBus makes, with redis-py's reply shapes: channel and
+    # data come back as bytes
+    def __init__(self):
+        self.subscribers = []
+        self.published = []
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        pubsub = FakePubSub(self)
+        self.subscribers.append(pubsub)
+        return pubsub
+
+    def publish(self, channel, data):
+        self.published.append((channel, data))
+        for pubsub in list(self.subscribers):
+            if channel in pubsub.channels:
+                pubsub.messages.put({"type": "message", "channel": channel.encode(), "data": data.encode()})
+
+
+def receiver():
+    received = queue.Queue()
+    return received, lambda message: received.put(message)
+
+
+def test_bytes_survive_json():
+    frame = bytes(range(256))
+    message = {"type": "emit", "event": "board-binary", "data": frame, "to": "room"}
+    text = json.dumps(message, default=encode_bytes)
+    assert json.loads(text, object_hook=decode_bytes) == message
+    assert json.loads(json.dumps({"cells": [[1, 2, "p"]]}, default=encode_bytes), object_hook=decode_bytes) == {"cells": [[1, 2, "p"]]}
+    with pytest.raises(TypeError):
+        json.dumps({"value": object()}, default=encode_bytes)
+
+
+def test_redis_bus_delivers_between_connections():
+    server = FakeRedis()
+    front, worker = RedisBus(server), RedisBus(server)
+    received, handler = receiver()
+    worker.subscribe("shard:0", handler)
+    front.subscribe("front", lambda message: None)
+    frame = b"\x01\x00\x1f\x1c" + bytes(20)
+    front.publish("shard:0", {"id": 1, "frame": frame, "args": ["player", "left"]})
+    assert received.get(timeout=5) == {"id": 1, "frame": frame, "args": ["player", "left"]}
+    # on the wire it is plain JSON with the bytes as base64
+    channel, data = server.published[-1]
+    assert channel == "shard:0" and "__bytes__" in json.loads(data)["frame"]
+    front.close()
+    worker.close()
+
+
+def test_redis_bus_survives_a_failing_handler():
+    server = FakeRedis()
+    bus = RedisBus(server)
+    received, handler = receiver()
+
+    def fail(message):
+        raise ValueError("handler failed")
+    bus.subscribe("front", fail)
+    bus.subscribe("front", handler)
+    bus.publish("front", {"n": 1})
+    bus.publish("front", {"n": 2})
+    assert [received.get(timeout=5), received.get(timeout=5)] == [{"n": 1}, {"n": 2}]
+    with pytest.raises(ValueError):
+        bus.endpoint()
+    bus.close()
+
+
+def test_local_bus_only_calls_its_channel():
+    bus = LocalBus()
+    calls = []
+    bus.subscribe("a", lambda message: calls.append(("a", message)))
+    bus.subscribe("b", lambda message: calls.append(("b", message)))
+    bus.publish("a", 1)
+    bus.publish("c", 2)
+    assert calls == [("a", 1)]
+    assert bus.endpoint().open() is bus
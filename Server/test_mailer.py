@@ -0,0 +1,165 @@
+import socket
+import threading
+import time
+import pytest
+import emailHandler
+import tokens
+from mailer import MailQueue, Mail
+
+Controller = pytest.importorskip("aiosmtpd.controller").Controller
+AuthResult = pytest.importorskip("aiosmtpd.smtp").AuthResult
+# the stand-in logs in over plain text on localhost
+pytestmark = pytest.mark.filterwarnings("ignore:Requiring AUTH while not requiring TLS")
+
+USERNAME = "pacman"
+PASSWORD = "secret"
+BACKOFF = 0.2
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Handler:
+    # records every delivered message with the session (one per connection)
+    # it came in on; addresses in refuse/defer fail at RCPT/DATA
+    def __init__(self):
+        self.logins = []
+        self.delivered = []
+        self.attempts = {}
+        self.refuse = {}
+        self.defer = {}
+        self.hold = {}
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        success = (auth_data.login, auth_data.password) == (USERNAME.encode(), PASSWORD.encode())
+        if success:
+            self.logins.append(session)
+        return AuthResult(success=success)
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        self.attempts.setdefault(address, []).append(time.monotonic())
+        if address in self.hold:
+            self.hold[address].wait(5)
+        if address in self.refuse:
+            return self.refuse[address]
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        address = envelope.rcpt_tos[0]
+        if self.defer.get(address, 0) > 0:
+            self.defer[address] -= 1
+            return "451 Try again later"
+        self.delivered.append((address, session))
+        return "250 Message accepted"
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    handler = Handler()
+    port = free_port()
+    controller = Controller(handler, hostname="127.0.0.1", port=port, authenticator=handler.authenticate,
+                            auth_require_tls=False, auth_required=True)
+    controller.start()
+    monkeypatch.setattr(emailHandler, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(emailHandler, "SMTP_PORT", port)
+    monkeypatch.setattr(emailHandler, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(emailHandler, "SMTP_USERNAME", USERNAME)
+    monkeypatch.setattr(emailHandler, "SMTP_PASSWORD", PASSWORD)
+    monkeypatch.setattr(emailHandler, "EMAIL_FROM", "queue@example.com")
+    yield handler
+    controller.stop()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class RecordingQueue(MailQueue):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    def collect(self):
+        batch = super().collect()
+        self.batches.append(len(batch))
+        return batch
+
+
+def test_batches_share_one_authenticated_connection(smtp):
+    mailer = RecordingQueue(workers=1, batch_size=4)
+    statuses = {}
+    # queued before the worker starts so its first collect sees them all
+    for number in range(10):
+        email = f"user{number}@example.com"
+        mailer.queue.put(Mail(f"t{number}", email, lambda status, email=email: statuses.setdefault(email, []).append(status)))
+    mailer.start()
+    wait_for(lambda: len(smtp.delivered) == 10)
+    assert mailer.batches[:3] == [4, 4, 2]
+    assert len(smtp.logins) == 1
+    assert {session for address, session in smtp.delivered} == {smtp.logins[0]}
+    wait_for(lambda: mailer.sent == 10)
+    assert all(history == ["sent"] for history in statuses.values())
+
+
+def test_failures_retry_on_the_backoff_schedule(smtp):
+    mailer = MailQueue(workers=1, backoff=BACKOFF, max_attempts=3)
+    statuses = {}
+    smtp.defer["late@example.com"] = 2
+    smtp.refuse["grey@example.com"] = "450 Greylisted"
+    smtp.refuse["gone@example.com"] = "550 No such user"
+    for email in ("late@example.com", "grey@example.com", "gone@example.com"):
+        mailer.send("token", email, lambda status, email=email: statuses.setdefault(email, []).append(status))
+    wait_for(lambda: len(statuses["late@example.com"]) == 4 and len(statuses["grey@example.com"]) == 4)
+
+    assert statuses["late@example.com"] == ["queued", "retrying", "retrying", "sent"]
+    # a 4xx refusal runs out of attempts, a 5xx fails at once
+    assert statuses["grey@example.com"] == ["queued", "retrying", "retrying", "failed"]
+    assert statuses["gone@example.com"] == ["queued", "failed"]
+    assert len(smtp.attempts["gone@example.com"]) == 1
+    for email in ("late@example.com", "grey@example.com"):
+        attempts = smtp.attempts[email]
+        gaps = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+        assert len(gaps) == 2
+        for attempt, gap in enumerate(gaps):
+            assert BACKOFF * 2 ** attempt * 0.9 <= gap < BACKOFF * 2 ** attempt + 1.0
+
+
+@pytest.fixture
+def fresh_tokens(monkeypatch, smtp):
+    mailer = MailQueue(workers=1, backoff=BACKOFF, max_attempts=1)
+    monkeypatch.setattr(tokens, "mailer", mailer)
+    monkeypatch.setattr(tokens, "tokens", {})
+    monkeypatch.setattr(tokens, "token_emails", {})
+    monkeypatch.setattr(tokens, "expiry_timers", {})
+    yield mailer
+    for timer in tokens.expiry_timers.values():
+        timer.cancel()
+
+
+def test_get_token_records_delivery_on_the_token(smtp, fresh_tokens):
+    release = threading.Event()
+    smtp.refuse["gone@example.com"] = "550 No such user"
+    smtp.hold["gone@example.com"] = release
+
+    assert tokens.get_token("player@example.com") == "success"
+    entry = tokens.tokens[tokens.token_emails["player@example.com"]]
+    wait_for(lambda: entry["mail_status"] == "sent")
+    assert smtp.delivered[0][0] == "player@example.com"
+    assert entry["token"] in tokens.tokens
+
+    assert tokens.get_token("gone@example.com") == "success"
+    entry = tokens.tokens[tokens.token_emails["gone@example.com"]]
+    release.set()
+    wait_for(lambda: entry["mail_status"] == "failed")
+    # a token whose mail bounced is withdrawn so the address can ask again
+    assert entry["token"] not in tokens.tokens
+    assert "gone@example.com" not in tokens.token_emails
+    assert entry["token"] not in tokens.expiry_timers
@@ -0,0 +1,41 @@
+import time
+import pytest
+from Game import Board, Player, Ghost, GhostAI, resolve_moves, MOVES
+from planner import Planner
+
+BUDGET = 0.05
+
+
+# searches submitted in the same tick split one budget, so four planner
+# matches take about one budget per tick rather than four
+def test_pending_searches_share_the_budget():
+    planner = Planner(budget=BUDGET)
+    board = Board()
+    planner.maze(board.rand)
+    started = time.perf_counter()
+    futures = [planner.submit(board, points) for points in range(4)]
+    moves = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+    assert all(0 <= move < len(MOVES) for move in moves)
+    assert elapsed < BUDGET * 2
+    assert planner.last["budget"] < BUDGET
+    assert planner.pending == 0 and planner.window is None
+    # alone it gets the whole budget again
+    planner.submit(board).result()
+    assert planner.last["budget"] == pytest.approx(BUDGET)
+
+
+# ghosts coming at both ends of the corridor pacman is in: a shallow search
+# that only weighs ghost distance gets caught, the safe cell count gets out.
+# The budget never runs out so the search depth is fixed.
+def test_shallow_search_escapes_a_pincer():
+    board = Board()
+    for index, position in enumerate([[6, 1], [6, 6], [7, 6], [5, 5], [8, 6]]):
+        board.place(index, *position)
+    player = Player(board.player_position())
+    ghosts = [Ghost(position, id) for id, position in board.ghost_positions().items()]
+    planner = Planner(budget=60, max_depth=2)
+    ghost_ai = GhostAI()
+    for _ in range(40):
+        move = planner.search(board, player.points)
+        assert resolve_moves(board, player, ghosts, move, ghost_ai.get_ai_moves(board)) != 'death'
@@ -0,0 +1,55 @@
+import pytest
+
+main = pytest.importorskip("main")
+
+
+@pytest.fixture
+def match():
+    match = main.registry.create()
+    yield match
+    main.registry.remove(match.id)
+
+
+def join(match, **auth):
+    return main.socketio.test_client(main.app, query_string=f"match={match.id}", auth=auth)
+
+
+def test_spectators_do_not_take_seats(match):
+    spectators = [join(match), join(match, capabilities=["binary"])]
+    assert all(client.is_connected() for client in spectators)
+    assert not match.is_connected("player") and not match.is_connected("ghost")
+    for client in spectators:
+        client.disconnect()
+
+
+def test_a_reload_gives_the_seat_back(match):
+    player = join(match, side="player")
+    assert match.is_connected("player")
+    # the seat is taken, so a second tab only watches and leaving frees nothing
+    watcher = join(match, side="player")
+    watcher.disconnect()
+    assert match.is_connected("player")
+    player.disconnect()
+    assert not match.is_connected("player")
+    again = join(match, side="player")
+    assert match.is_connected("player")
+    again.disconnect()
+    assert not match.is_connected("player")
+
+
+def test_a_stale_socket_keeps_a_newer_seat(match):
+    stale = join(match, side="ghost")
+    match.disconnect("ghost")
+    current = join(match, side="ghost")
+    stale.disconnect()
+    assert match.is_connected("ghost")
+    current.disconnect()
+    assert not match.is_connected("ghost")
+
+
+def test_token_sockets_release_their_side(match):
+    client = main.socketio.test_client(main.app, headers={"Authorization": f"Bearer {match.player_token}"})
+    assert match.is_connected("player")
+    assert any(packet["name"] == "connected" for packet in client.get_received())
+    client.disconnect()
+    assert not match.is_connected("player")
@@ -0,0 +1,114 @@
+import time
+import pytest
+from bus import LocalBus, RedisBus
+from broadcast import FULL, BINARY, decode_binary
+from shards import ShardedRegistry, shard_for
+from test_bus import FakeRedis
+
+SHARDS = 3
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def local_match(registry, match):
+    return registry.workers[match.shard].registry.get(match.id)
+
+
+def stop(registry):
+    for worker in registry.workers:
+        worker.scheduler.stop()
+    registry.bus.close()
+
+
+# workers as threads over one LocalBus, the way --workers runs with --bus local
+@pytest.fixture
+def sharded():
+    emits = []
+    registry = ShardedRegistry(LocalBus(), SHARDS, lambda event, data=None, to=None: emits.append((event, data, to)),
+                               tick_rate=50, threads=True)
+    yield registry, emits
+    stop(registry)
+
+
+def test_matches_are_created_on_their_shard(sharded):
+    registry, emits = sharded
+    matches = [registry.create(f"match-{number}") for number in range(12)]
+    assert {match.shard for match in matches} == set(range(SHARDS))
+    for match in matches:
+        assert match.shard == shard_for(match.id, SHARDS)
+        assert local_match(registry, match) is not None
+        others = [worker for shard, worker in enumerate(registry.workers) if shard != match.shard]
+        assert all(worker.registry.get(match.id) is None for worker in others)
+        assert registry.find_by_token(match.player_token) == (match, "player")
+        assert registry.find_by_token(match.ghost_token) == (match, "ghost")
+    assert registry.create("match-0") is matches[0]
+    assert len(registry) == 12
+    assert registry.get_default().id == "default"
+
+
+def test_moves_and_snapshots_go_through_the_shard(sharded):
+    registry, emits = sharded
+    match = registry.create()
+    assert match.submit("player", "left") == "not connected"
+    assert "player_id" in match.connect("player", "remote")
+    assert match.is_connected("player")
+    assert match.submit("player", "sideways") == "invalid move"
+    assert isinstance(match.submit("player", "left"), int)
+    # the worker's ticks resolve it; the front sees the state on refresh
+    wait_for(lambda: list(registry) and match.moves >= 1)
+    board = local_match(registry, match).board
+
+    event, data = match.snapshot(FULL)
+    assert event == "board" and data[0] == board.get_board()
+    event, frame = match.snapshot(BINARY)
+    assert event == "board-binary" and isinstance(frame, bytes)
+    assert decode_binary(frame)["seq"] >= 1
+
+    # board emits come back over the bus to the front's Socket.IO emit
+    match.add_viewer(FULL)
+    assert isinstance(match.submit("player", "right"), int)
+    wait_for(lambda: any(event == "board" and to == match.stream_room(FULL) for event, data, to in emits))
+    match.disconnect("player")
+    assert not match.is_connected("player")
+
+
+def test_removal_on_either_side(sharded):
+    registry, emits = sharded
+    first, second = registry.create("first"), registry.create("second")
+    assert registry.remove("first") is first
+    assert registry.get("first") is None
+    assert registry.find_by_token(first.player_token) == (None, None)
+    assert local_match(registry, first) is None
+    # a worker dropping a finished match tells the front to forget it
+    registry.workers[second.shard].registry.remove("second")
+    wait_for(lambda: registry.get("second") is None)
+    assert registry.find_by_token(second.ghost_token) == (None, None)
+    with pytest.raises(RuntimeError):
+        second.snapshot(FULL)
+
+
+# the same over RedisBus, where every command, reply and emit is JSON and
+# binary frames cross as base64
+def test_sharded_registry_over_redis():
+    emits = []
+    registry = ShardedRegistry(RedisBus(FakeRedis()), 2, lambda event, data=None, to=None: emits.append((event, data, to)),
+                               tick_rate=50, threads=True)
+    match = registry.create("over-redis", ai_sides=["ghost"])
+    assert local_match(registry, match).ai_sides == {"ghost"}
+    match.connect("player")
+    assert isinstance(match.submit("player", [0.1, 0.2, 0.9, 0.3]), int)
+    wait_for(lambda: list(registry) and match.moves >= 1)
+    event, frame = match.snapshot(BINARY)
+    assert isinstance(frame, bytes)
+    assert decode_binary(frame)["points"] == local_match(registry, match).player.points
+    match.add_viewer(BINARY)
+    wait_for(lambda: any(event == "board-binary" and isinstance(data, bytes) for event, data, to in emits))
+    registry.remove("over-redis")
+    assert local_match(registry, match) is None
+    stop(registry)
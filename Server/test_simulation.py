@@ -0,0 +1,90 @@
+import numpy as np
+from Game import Board, Player, Ghost, resolve_moves, MOVES, ENTITY_IDS, WALL, PELLET, EMPTY
+from simulation import VecPacmanEnv, REWARD_DEATH
+
+ENVS = 256
+ROUNDS = 80
+
+
+# pacman anywhere open, ghosts on distinct open cells mostly within two steps
+# of it so catches, swaps and ghosts blocking each other come up often
+def scatter(env, rng):
+    open_cells = np.argwhere(env.template != WALL)
+    pellets = np.argwhere(env.template == PELLET)
+    for i in range(env.num_envs):
+        env.grid[i] = env.template
+        eaten = pellets[rng.random(len(pellets)) < rng.random()]
+        env.grid[i, eaten[:, 0], eaten[:, 1]] = EMPTY
+        pacman = open_cells[rng.integers(len(open_cells))]
+        near = open_cells[np.abs(open_cells - pacman).sum(axis=1) <= 2]
+        taken = {tuple(pacman)}
+        positions = [pacman]
+        while len(positions) < len(ENTITY_IDS):
+            pool = near if rng.random() < 0.8 else open_cells
+            cell = tuple(pool[rng.integers(len(pool))])
+            if cell not in taken:
+                taken.add(cell)
+                positions.append(np.array(cell))
+        env.entities[i] = positions
+        env.grid[i, pacman[0], pacman[1]] = EMPTY
+        env.points[i] = rng.integers(100)
+        env.pellets[i] = np.count_nonzero(env.grid[i] == PELLET)
+    env.steps[:] = 0
+
+
+def mirror(template, env, i):
+    board = template.clone()
+    board.grid = env.grid[i].copy()
+    board.entities = env.entities[i].copy()
+    player = Player(board.player_position())
+    player.points = int(env.points[i])
+    ghosts = [Ghost(pos, id) for id, pos in board.ghost_positions().items()]
+    return board, player, ghosts
+
+
+# one vectorized step against Game.resolve_moves on every env; the env is
+# kept from resetting so the state after a death can be compared too
+def test_step_matches_resolve_moves():
+    rng = np.random.default_rng(0)
+    env = VecPacmanEnv(ENVS, max_steps=10 ** 9, seed=0)
+    env.reset = lambda mask=None: env.observe()
+    template = Board()
+    deaths = swaps = 0
+    for _ in range(ROUNDS):
+        scatter(env, rng)
+        actions = rng.integers(len(MOVES), size=ENVS)
+        ghost_actions = rng.integers(len(MOVES), size=(ENVS, len(ENTITY_IDS) - 1))
+        games = [mirror(template, env, i) for i in range(ENVS)]
+        _, rewards, dones, _ = env.step(actions, ghost_actions)
+        for i, (board, player, ghosts) in enumerate(games):
+            start = board.player_position()
+            target = player.target(board, MOVES[actions[i]])
+            result = resolve_moves(board, player, ghosts, MOVES[actions[i]], [MOVES[a] for a in ghost_actions[i]])
+            died = rewards[i] <= REWARD_DEATH
+            assert died == (result == 'death')
+            assert np.array_equal(env.entities[i], board.entities)
+            assert np.array_equal(env.grid[i], board.grid)
+            assert env.points[i] == player.points
+            assert env.pellets[i] == board.pellets_remaining()
+            deaths += died
+            swaps += died and target != start and board.ghost_at(*start) is not None
+    # the rules under test actually came up
+    assert deaths > ENVS * ROUNDS // 20
+    assert swaps > 50
+
+
+# trading cells with a ghost kills pacman, following a ghost that moves away
+# into its old cell does not
+def test_swap_kills_and_following_survives():
+    env = VecPacmanEnv(2, seed=0)
+    env.reset = lambda mask=None: env.observe()
+    x, y = env.entities[0, 0]
+    right = MOVES.index("right")
+    assert env.grid[0, x, y + 1] != WALL and env.grid[0, x, y + 2] != WALL
+    env.entities[:, 1] = (x, y + 1)
+    ghost_actions = np.array([[MOVES.index("left"), 0, 0, 0], [right, 0, 0, 0]])
+    _, rewards, dones, _ = env.step([right, right], ghost_actions)
+    assert dones[0] and rewards[0] == REWARD_DEATH
+    assert not dones[1] and rewards[1] > REWARD_DEATH
+    assert env.entities[1, 0].tolist() == [x, y + 1]
+    assert env.entities[1, 1].tolist() == [x, y + 2]
@@ -0,0 +1,142 @@
+import random
+import pytest
+import tokens
+from tokenstore import TokenQueue
+
+OPERATIONS = 20000
+
+
+def entry(number):
+    return {"token": f"t{number}", "email": f"user{number}@example.com", "mail_status": None}
+
+
+def check_queue(queue, reference):
+    assert len(queue) == len(reference)
+    assert list(queue) == reference
+    assert queue.peek() == (reference[0] if reference else None)
+    for position, item in enumerate(reference):
+        assert item["token"] in queue
+        assert queue.position(item["token"]) == position
+        assert queue.get(item["token"]) is item
+        assert queue.find_email(item["email"]) is item
+
+
+# a small starting capacity makes the slots fill up and rebuild many times
+def test_token_queue_matches_list():
+    rng = random.Random(0)
+    queue = TokenQueue(capacity=8)
+    reference = []
+    removed = []
+    created = 0
+    for step in range(OPERATIONS):
+        action = rng.random()
+        if action < 0.45 or not reference:
+            item = entry(created)
+            created += 1
+            queue.append(item)
+            reference.append(item)
+        elif action < 0.7:
+            item = reference.pop(rng.randrange(len(reference)))
+            assert queue.remove(item["token"]) is item
+            removed.append(item)
+        elif action < 0.85:
+            assert queue.popleft() is reference.pop(0)
+        else:
+            item = rng.choice(reference)
+            index = reference.index(item)
+            assert queue.position(item["token"]) == index
+            assert list(queue.entries_after(item["token"])) == reference[index + 1:]
+        if removed and rng.random() < 0.05:
+            gone = rng.choice(removed)
+            assert queue.remove(gone["token"]) is None
+            assert queue.position(gone["token"]) is None
+            assert gone["token"] not in queue
+        if step % 500 == 0:
+            check_queue(queue, reference)
+    check_queue(queue, reference)
+    while reference:
+        assert queue.popleft() is reference.pop(0)
+    with pytest.raises(IndexError):
+        queue.popleft()
+
+
+@pytest.fixture
+def fresh_tokens(monkeypatch):
+    events = []
+    monkeypatch.setattr(tokens, "token_queue", TokenQueue(capacity=8))
+    monkeypatch.setattr(tokens, "tokens", {})
+    monkeypatch.setattr(tokens, "token_emails", {})
+    monkeypatch.setattr(tokens, "expiry_timers", {})
+    monkeypatch.setattr(tokens, "token_timer", None)
+    monkeypatch.setattr(tokens, "notifier", lambda event, data, to=None: events.append((event, data, to)))
+    yield events
+    if tokens.token_timer is not None:
+        tokens.token_timer.cancel()
+
+
+def issue(item):
+    tokens.tokens[item["token"]] = item
+    tokens.token_emails[item["email"]] = item["token"]
+
+
+def expected_shift(reference, index):
+    return [("queue-position", tokens.describe(position), tokens.token_room(item["token"]))
+            for position, item in enumerate(reference[index + 1:], index)]
+
+
+# the queue functions against a list, including the position updates every
+# entry behind a removed one is sent
+def test_tokens_queue_functions_match_list(fresh_tokens):
+    events = fresh_tokens
+    rng = random.Random(1)
+    reference = []
+    created = 0
+    for step in range(OPERATIONS):
+        action = rng.random()
+        del events[:]
+        if action < 0.45 or not reference:
+            item = entry(created)
+            created += 1
+            issue(item)
+            assert tokens.enter_queue(item["token"]) == "success"
+            assert tokens.enter_queue(item["token"]) == "Token already in queue"
+            reference.append(item)
+            assert events == [("queue-position", tokens.describe(len(reference) - 1), tokens.token_room(item["token"]))]
+        elif action < 0.7:
+            index = rng.randrange(len(reference))
+            expected = expected_shift(reference, index)
+            assert tokens.remove_entry(reference.pop(index)["token"]) is None
+            assert events == expected
+        elif action < 0.85:
+            expected = [("token-refresh", None, tokens.token_room(reference[0]["token"]))] + expected_shift(reference, 0)
+            reference.pop(0)
+            tokens.remove_top()
+            assert events == expected
+        else:
+            item = rng.choice(reference)
+            assert tokens.get_entry(item["token"]) == tokens.describe(reference.index(item))
+        if step % 500 == 0:
+            assert tokens.get_all() == reference
+            assert (tokens.token_timer is not None) == bool(reference)
+    assert tokens.get_all() == reference
+    assert tokens.get_entry("missing") is None
+    assert tokens.enter_queue("missing") == "Token not found"
+
+
+# a head timeout that fires after the head already left must not evict the
+# token that took its place
+def test_stale_head_timeout_keeps_the_new_head(fresh_tokens):
+    first, second = entry(0), entry(1)
+    for item in (first, second):
+        issue(item)
+        tokens.enter_queue(item["token"])
+    assert tokens.token_timer.args == (first["token"],)
+    stale = tokens.token_timer
+    tokens.remove_entry(first["token"])
+    assert tokens.token_timer is not stale
+    assert tokens.token_timer.args == (second["token"],)
+    stale.function(*stale.args)
+    assert tokens.get_all() == [second]
+    tokens.token_timer.function(*tokens.token_timer.args)
+    assert tokens.get_all() == []
+    assert tokens.token_timer is None
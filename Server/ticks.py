@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TICK_RATE = 10
+
+
+class TickScheduler:
+    def __init__(self, registry, tick_rate=DEFAULT_TICK_RATE, start_task=None, sleep=time.sleep):
+        self.registry = registry
+        self.interval = 1.0 / tick_rate
+        self.start_task = start_task
+        self.sleep = sleep
+        self.running = False
+        self.ticks = 0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.start_task(self.run)
+
+    def stop(self):
+        self.running = False
+
+    def next_deadline(self, deadline):
+        deadline += self.interval
+        delay = deadline - time.perf_counter()
+        if delay < 0:
+            logger.warning("tick %d overran by %.1fms", self.ticks, -delay * 1000)
+            return time.perf_counter(), 0
+        return deadline, delay
+
+    # the loop outlives a failing tick, otherwise one bad match would stop
+    # ticks for the whole server
+    def safe_tick(self):
+        try:
+            return self.tick()
+        except Exception:
+            logger.exception("tick %d failed", self.ticks)
+            return 0
+
+    def run(self):
+        deadline = time.perf_counter()
+        while self.running:
+            self.safe_tick()
+            deadline, delay = self.next_deadline(deadline)
+            self.sleep(delay)
+
+    # asyncio variant: the tick runs on a worker thread, since it can wait on
+    # match locks and DQN results, and the loop only sleeps between ticks
+    async def run_async(self):
+        loop = asyncio.get_running_loop()
+        self.running = True
+        deadline = time.perf_counter()
+        while self.running:
+            await loop.run_in_executor(None, self.safe_tick)
+            deadline, delay = self.next_deadline(deadline)
+            await asyncio.sleep(delay)
+
+    def tick(self):
+        start = time.perf_counter()
+        resolved = 0
+        matches = list(self.registry)
+        # queue every AI request first so the inference service can batch them
+        for match in matches:
+            try:
+                match.process_ai_move()
+            except Exception:
+                logger.exception("match %s: AI move failed", match.id)
+        for match in matches:
+            try:
+                if match.resolve_tick():
+                    resolved += 1
+            except Exception:
+                logger.exception("match %s: tick failed", match.id)
+        self.registry.cleanup()
+        self.ticks += 1
+        metrics.STAGE_SECONDS.observe_since(start, "tick")
+        elapsed = (time.perf_counter() - start) * 1000
+        if resolved:
+            logger.info("tick %d resolved %d/%d matches in %.2fms",
+                        self.ticks, resolved, len(self.registry), elapsed)
+        return resolved
@@ -0,0 +1,83 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    def __init__(self, scheduler, deadline, function, args):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.function = function
+        self.args = args
+        self.cancelled = False
+        self.done = False
+
+    def cancel(self):
+        return self.scheduler.cancel(self)
+
+
+class TimerScheduler:
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.active = 0
+        self.thread = None
+
+    def schedule(self, delay, function, *args):
+        timer = Timer(self, time.monotonic() + delay, function, args)
+        with self.condition:
+            heapq.heappush(self.heap, (timer.deadline, next(self.counter), timer))
+            self.active += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="timers", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return timer
+
+    def cancel(self, timer):
+        with self.condition:
+            if timer.cancelled or timer.done:
+                return False
+            timer.cancelled = True
+            self.active -= 1
+            # cancelled entries stay in the heap and are skipped when they come due
+            if len(self.heap) > 64 and len(self.heap) > 2 * self.active:
+                self.heap = [item for item in self.heap if not item[2].cancelled]
+                heapq.heapify(self.heap)
+            return True
+
+    def pending(self):
+        return self.active
+
+    def next_due(self):
+        with self.condition:
+            while True:
+                while self.heap and self.heap[0][2].cancelled:
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                delay = self.heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                timer = heapq.heappop(self.heap)[2]
+                timer.done = True
+                self.active -= 1
+                return timer
+
+    def run(self):
+        while True:
+            timer = self.next_due()
+            try:
+                timer.function(*timer.args)
+            except Exception:
+                logger.exception("timer callback %s failed", timer.function.__name__)
+
+
+timers = TimerScheduler()
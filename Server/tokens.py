@@ -1,60 +1,117 @@
-from collections import deque 
 import threading
+import re
 import secrets,string
-from emailHandler import sendEmail
-import requests
+from mailer import mailer
+from timers import timers
+from tokenstore import TokenQueue, RWLock
 
 
-token_queue = deque()
-queue_lock = threading.Lock()
+token_queue = TokenQueue()
+queue_lock = RWLock("queue")
+tokens_lock = threading.Lock()
 
-link = "http://localhost:5000"
+EMAIL_PATTERN = re.compile(r'^[^\s@]+@[^\s@]+\.[^\s@]+$')
 
-tokens = []
+TOKEN_EXPIRY = 600
+TOP_TOKEN_TIMEOUT = 1200
+
+# issued tokens that have not entered the queue yet, indexed both ways
+tokens = {}
+token_emails = {}
+expiry_timers = {}
+notifier = None
+
+def set_notifier(emit):
+    global notifier
+    notifier = emit
+
+def token_room(token):
+    return f"token:{token}"
+
+def describe(position):
+    if position == 0:
+        return {"position":position,"role":"player"}
+    else:
+        return {"position":position,"role":"observer"}
+
+def notify(events):
+    if notifier is None:
+        return
+    for event,data,token in events:
+        notifier(event,data,to=token_room(token))
+
+# must hold queue_lock; every entry behind token moves up one place once token leaves
+def shifted_positions(token):
+    position = token_queue.position(token)
+    return [
+        ("queue-position",describe(position + offset),entry["token"])
+        for offset,entry in enumerate(token_queue.entries_after(token))
+    ]
 
 def get_token(email):
     print(email)
-    with queue_lock:
-        for entry in token_queue:
-            if entry["email"] == email:
-                return "Email already in queue"
-    for token in tokens: 
-        if token["email"] == email:
+    with queue_lock.read():
+        if token_queue.find_email(email):
+            return "Email already in queue"
+    with tokens_lock:
+        if email in token_emails:
             return "Token already sent"
-    token = gen_token()
-    mail_status = sendEmail(token,email)
-    if mail_status == "invalid email":
-        return "invalid email"
-    
-  
-    tokens.append({"email":email,"token":token})
+        if not email or not EMAIL_PATTERN.match(email):
+            return "invalid email"
+        token = gen_token()
+        tokens[token] = {"email":email,"token":token,"mail_status":None}
+        token_emails[email] = token
+        expiry_timers[token] = timers.schedule(TOKEN_EXPIRY,expire_token,email,token)
 
-    expiry = threading.Timer(600,expire_token,args=(email,token))
-    expiry.start()
+    mailer.send(token,email,on_status=lambda status: set_mail_status(token,status))
 
     return "success"
 
+def set_mail_status(token,status):
+    with tokens_lock:
+        entry = tokens.get(token)
+        if entry is None:
+            entry = token_queue.get(token)
+        if entry is None:
+            return
+        entry["mail_status"] = status
+        if status == "failed" and token in tokens:
+            discard_token(token)
+            expiry = expiry_timers.pop(token,None)
+            if expiry:
+                expiry.cancel()
+
+def discard_token(token):
+    entry = tokens.pop(token,None)
+    if entry and token_emails.get(entry["email"]) == token:
+        del token_emails[entry["email"]]
+    return entry
+
 def expire_token(email,token):
-    global tokens
     print(email,token)
-    tokens = [entry for entry in tokens if entry["email"] != email and entry["token"] != token]
+    with tokens_lock:
+        expiry_timers.pop(token,None)
+        discard_token(token)
     print("Expired token for email:",email)
 
 
 def enter_queue(token):
-    with queue_lock:
-        for entry in token_queue:
-            if entry["token"] == token:
-                return "Token already in queue"
-        for entry in tokens:
-            if entry["token"] == token:
-                token_queue.append(entry)
-                tokens.remove(entry)
-
-                if len(token_queue) == 1:
-                    start_top_token_timer()
-                return "success"
-        return "Token not found"
+    with tokens_lock, queue_lock.write():
+        if token in token_queue:
+            return "Token already in queue"
+        entry = discard_token(token)
+        if entry is None:
+            return "Token not found"
+        token_queue.append(entry)
+        expiry = expiry_timers.pop(token,None)
+        if expiry:
+            expiry.cancel()
+
+        if len(token_queue) == 1:
+            start_top_token_timer()
+        events = [("queue-position",describe(len(token_queue) - 1),token)]
+    notify(events)
+    return "success"
     
 
 
@@ -70,30 +127,41 @@ def gen_token(length=16):
 
 
 
-def remove_top():
+# token is the head the timeout was started for; a timer already taken off
+# the heap when the head changed must not evict the new one early
+def remove_top(token=None):
    
-    global token_timer
-    with queue_lock:
-        if token_queue:
-            token_queue.popleft()
-            requests.post(f'{link}/token-expire')
-            print("Removed top token from queue")
-            token_timer = None
-            if token_queue:
-                start_top_token_timer()
+    with queue_lock.write():
+        top = token_queue.peek()
+        if top is None or (token is not None and top["token"] != token):
+            return
+        events = [("token-refresh",None,top["token"])] + shifted_positions(top["token"])
+        token_queue.popleft()
+        print("Removed top token from queue")
+        restart_top_token_timer()
+    notify(events)
 
 def start_top_token_timer():
     global token_timer
-    token_timer = threading.Timer(1200,remove_top)
-    token_timer.start()
+    token_timer = timers.schedule(TOP_TOKEN_TIMEOUT,remove_top,token_queue.peek()["token"])
+
+def restart_top_token_timer():
+    global token_timer
+    if token_timer:
+        token_timer.cancel()
+        token_timer = None
+    if token_queue:
+        start_top_token_timer()
+
+def pending_timers():
+    return timers.pending()
 
 def add_entry(email):
     
 
-    with queue_lock:
-        for entry in token_queue:
-            if entry["email"] == email:
-                return "failed"
+    with queue_lock.read():
+        if token_queue.find_email(email):
+            return "failed"
         else:
             token = gen_token()
     
@@ -105,33 +173,28 @@ def add_entry(email):
 
 
 def get_entry(token):
-    with queue_lock:
-        for entry in token_queue:
-            if entry["token"] == token:
-                position = token_queue.index(entry)
-                if position == 0:
-                    return {"position":position,"role":"player"}
-                else:
-                    return {"position":position,"role":"observer"}
+    with queue_lock.read():
+        position = token_queue.position(token)
+    if position is None:
         return None
+    return describe(position)
     
 
 def remove_entry(token):
    
-    with queue_lock:
-        try:
-            for entry in token_queue:
-                if entry["token"] == token:
-                    token_queue.remove(entry)
-                    print("Removed token from queue:",token)
-                    return
-           
-        except ValueError:
-            print('error')
-            pass
-        return None
+    with queue_lock.write():
+        if token not in token_queue:
+            return None
+        was_top = token_queue.position(token) == 0
+        events = shifted_positions(token)
+        token_queue.remove(token)
+        print("Removed token from queue:",token)
+        if was_top:
+            restart_top_token_timer()
+    notify(events)
+    return None
     
 def get_all():
-    with queue_lock:
+    with queue_lock.read():
         return list(token_queue)
     
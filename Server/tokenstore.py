@@ -0,0 +1,150 @@
+import threading
+import metrics
+from contextlib import contextmanager
+
+
+class RWLock:
+    # many readers or one writer; a waiting writer holds off new readers
+    # a named lock reports its wait time to metrics.LOCK_WAIT_SECONDS
+    def __init__(self, name=None):
+        self.name = name
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        started = metrics.start() if self.name else None
+        with self.condition:
+            while self.writer or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+        metrics.LOCK_WAIT_SECONDS.observe_since(started, f"{self.name}_read")
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        started = metrics.start() if self.name else None
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+        metrics.LOCK_WAIT_SECONDS.observe_since(started, f"{self.name}_write")
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+
+class TokenQueue:
+    # entries keep the slot they were appended at; a Fenwick tree over the
+    # slots counts live entries so a token's position is a prefix sum
+    def __init__(self, capacity=1024):
+        self.by_token = {}
+        self.by_email = {}
+        self.slot_of = {}
+        self.rebuild([], capacity)
+
+    def rebuild(self, entries, capacity):
+        self.capacity = capacity
+        self.tree = [0] * (capacity + 1)
+        self.slots = [None] * capacity
+        self.head = 0
+        self.next_slot = 0
+        self.slot_of.clear()
+        for entry in entries:
+            self.place(entry)
+
+    def add(self, slot, delta):
+        index = slot + 1
+        while index <= self.capacity:
+            self.tree[index] += delta
+            index += index & -index
+
+    def prefix(self, slot):
+        index = slot + 1
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def place(self, entry):
+        slot = self.next_slot
+        self.next_slot += 1
+        self.slots[slot] = entry
+        self.slot_of[entry["token"]] = slot
+        self.add(slot, 1)
+
+    def append(self, entry):
+        if self.next_slot == self.capacity:
+            live = list(self)
+            self.rebuild(live, max(self.capacity, 2 * len(live), 1024))
+        self.by_token[entry["token"]] = entry
+        self.by_email[entry["email"]] = entry
+        self.place(entry)
+
+    def remove(self, token):
+        entry = self.by_token.pop(token, None)
+        if entry is None:
+            return None
+        if self.by_email.get(entry["email"]) is entry:
+            del self.by_email[entry["email"]]
+        slot = self.slot_of.pop(token)
+        self.slots[slot] = None
+        self.add(slot, -1)
+        while self.head < self.next_slot and self.slots[self.head] is None:
+            self.head += 1
+        return entry
+
+    def popleft(self):
+        entry = self.peek()
+        if entry is None:
+            raise IndexError("pop from an empty queue")
+        return self.remove(entry["token"])
+
+    def peek(self):
+        if self.head < self.next_slot:
+            return self.slots[self.head]
+        return None
+
+    def get(self, token):
+        return self.by_token.get(token)
+
+    def find_email(self, email):
+        return self.by_email.get(email)
+
+    def position(self, token):
+        slot = self.slot_of.get(token)
+        if slot is None:
+            return None
+        return self.prefix(slot) - 1
+
+    def entries_after(self, token):
+        for slot in range(self.slot_of[token] + 1, self.next_slot):
+            entry = self.slots[slot]
+            if entry is not None:
+                yield entry
+
+    def __contains__(self, token):
+        return token in self.by_token
+
+    def __len__(self):
+        return len(self.by_token)
+
+    def __iter__(self):
+        for slot in range(self.head, self.next_slot):
+            entry = self.slots[slot]
+            if entry is not None:
+                yield entry
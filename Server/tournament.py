@@ -0,0 +1,334 @@
+import argparse
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from Game import Board, Player, Ghost, GhostAI, resolve_moves, MOVES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_TICKS = 1000
+ELO_INITIAL = 1500.0
+ELO_K = 32.0
+
+# a pacman win scores 1, a death 0 and running out of ticks is a draw
+SCORES = {"clear": 1.0, "death": 0.0, "timeout": 0.5}
+
+# An agent is a factory called once per match with the match seed and its
+# options; it returns move(board, player, ghosts). A pacman move is a name in
+# MOVES or None, a ghost move is a list of four. Agents are given as
+# [name=]target[,key=value...] where target is one of these or module:factory.
+PACMAN_AGENTS = {
+    "random": "tournament:random_pacman",
+    "planner": "tournament:planner_pacman",
+    "dqn": "tournament:dqn_pacman",
+}
+GHOST_AGENTS = {
+    "chase": "tournament:chase_ghosts",
+    "random": "tournament:random_ghosts",
+}
+
+
+def random_pacman(seed):
+    rng = random.Random(seed)
+    return lambda board, player, ghosts: rng.choice(MOVES)
+
+
+def planner_pacman(seed, **options):
+    from planner import Planner
+    planner = Planner(**options)
+    return lambda board, player, ghosts: planner.search(board, player.points)
+
+
+def dqn_pacman(seed, backend="eager"):
+    import torch
+    from model import get_model
+    from encoding import StateEncoder
+    model = get_model(backend=backend)
+    encoder = StateEncoder()
+
+    def move(board, player, ghosts):
+        with torch.inference_mode():
+            return MOVES[int(model(encoder.encode(board).reshape(1, -1)).argmax())]
+    return move
+
+
+def chase_ghosts(seed):
+    ghost_ai = GhostAI()
+    return lambda board, player, ghosts: ghost_ai.get_ai_moves(board)
+
+
+def random_ghosts(seed):
+    rng = random.Random(seed)
+    return lambda board, player, ghosts: [rng.choice(MOVES) for _ in ghosts]
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_agent(spec, builtins):
+    head, *options = spec.split(",")
+    name, _, target = head.rpartition("=")
+    name = name or ",".join([target] + options)
+    target = builtins.get(target, target)
+    if ":" not in target or not all("=" in option for option in options):
+        raise ValueError(f"bad agent {spec}, expected [name=]target[,key=value...] with target one of "
+                         f"{sorted(builtins)} or module:factory")
+    options = dict(option.split("=", 1) for option in options)
+    return name, {"target": target, "options": {key: parse_value(value) for key, value in options.items()}}
+
+
+factories = {}
+
+
+def load_factory(target):
+    factory = factories.get(target)
+    if factory is None:
+        module, attr = target.split(":")
+        factory = factories[target] = getattr(importlib.import_module(module), attr)
+    return factory
+
+
+def create_agent(agent, seed):
+    return load_factory(agent["target"])(seed, **agent["options"])
+
+
+def match_seed(seed, match_id):
+    return zlib.crc32(f"{seed}:{match_id}".encode())
+
+
+# runs in the worker processes: one headless game on the Game.py rules, the
+# same resolve_moves a live match uses
+def play_match(match, pacman_agent, ghost_agent, max_ticks=DEFAULT_MAX_TICKS):
+    started = time.perf_counter()
+    random.seed(match["seed"])
+    np.random.seed(match["seed"])
+    board = Board()
+    positions = board.get_positions()
+    player = Player(positions['player'])
+    ghosts = [Ghost(pos, id) for pos, id in zip(positions['ghosts'], "abcd")]
+    pacman = create_agent(pacman_agent, match["seed"])
+    ghost = create_agent(ghost_agent, match["seed"] + 1)
+    result = "timeout"
+    ticks = 0
+    while ticks < max_ticks:
+        player_move = pacman(board, player, ghosts)
+        ghost_moves = ghost(board, player, ghosts)
+        ticks += 1
+        if resolve_moves(board, player, ghosts, player_move, ghost_moves) == 'death':
+            result = "death"
+            break
+        if board.pellets_remaining() == 0:
+            result = "clear"
+            break
+    return dict(match, type="match", result=result, score=SCORES[result], ticks=ticks, points=player.points,
+                seconds=time.perf_counter() - started)
+
+
+class Elo:
+    # pacman and ghost agents share one rating scale, every game is one
+    # pacman against one ghost agent
+    def __init__(self, names, k=ELO_K, initial=ELO_INITIAL):
+        self.k = k
+        self.ratings = {name: initial for name in names}
+        self.games = {name: 0 for name in names}
+
+    def expected(self, a, b):
+        return 1.0 / (1.0 + 10 ** ((self.ratings[b] - self.ratings[a]) / 400.0))
+
+    def update(self, pacman, ghost, score):
+        delta = self.k * (score - self.expected(pacman, ghost))
+        self.ratings[pacman] += delta
+        self.ratings[ghost] -= delta
+        self.games[pacman] += 1
+        self.games[ghost] += 1
+
+    def standings(self):
+        return sorted(self.ratings.items(), key=lambda item: -item[1])
+
+
+class ResultLog:
+    # append only JSONL: a tournament header, then round and match records in
+    # the order they happened, so replaying it rebuilds the ratings exactly
+    def __init__(self, path, header):
+        self.path = path
+        self.matches = {}
+        self.rounds = {}
+        self.records = []
+        existing = self.load()
+        if existing is not None and existing != header:
+            raise ValueError(f"{path} holds a different tournament, use another --output")
+        self.file = open(path, "a")
+        if existing is None:
+            self.write(header)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        header = None
+        valid = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                # an interrupted write leaves a partial last line, it is cut off
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid += len(line)
+                if record["type"] == "tournament":
+                    header = record
+                elif record["type"] == "round":
+                    self.rounds[record["round"]] = record["matches"]
+                else:
+                    self.matches[record["id"]] = record
+                    self.records.append(record)
+        with open(self.path, "r+b") as f:
+            f.truncate(valid)
+        return header
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def add_round(self, number, matches):
+        self.rounds[number] = matches
+        self.write({"type": "round", "round": number, "matches": matches})
+
+    def add_match(self, record):
+        self.matches[record["id"]] = record
+        self.records.append(record)
+        self.write(record)
+
+    def close(self):
+        self.file.close()
+
+
+def schedule(number, pairs, games, seed):
+    matches = []
+    for pacman, ghost in pairs:
+        for game in range(games):
+            match_id = f"{number}:{pacman}:{ghost}:{game}"
+            matches.append({"id": match_id, "round": number, "pacman": pacman, "ghost": ghost,
+                            "game": game, "seed": match_seed(seed, match_id)})
+    return matches
+
+
+def round_robin_pairs(pacmen, ghosts):
+    return [(pacman, ghost) for pacman in pacmen for ghost in ghosts]
+
+
+# every pacman agent, best rated first, gets the ghost agent it has met least
+# so far, the closest rating breaking ties; ghosts may play twice in a round
+# when the pools differ in size
+def swiss_pairs(pacmen, ghosts, elo, played):
+    pairs = []
+    for pacman in sorted(pacmen, key=lambda name: -elo.ratings[name]):
+        ghost = min(ghosts, key=lambda name: (played.get((pacman, name), 0), abs(elo.ratings[name] - elo.ratings[pacman])))
+        pairs.append((pacman, ghost))
+    return pairs
+
+
+class Tournament:
+    def __init__(self, pacmen, ghosts, path, mode="round-robin", games=1, rounds=None, seed=0,
+                 max_ticks=DEFAULT_MAX_TICKS, workers=None):
+        self.pacmen = pacmen
+        self.ghosts = ghosts
+        self.mode = mode
+        self.games = games
+        self.rounds = rounds or (1 if mode == "round-robin" else max(len(pacmen), len(ghosts)))
+        self.seed = seed
+        self.max_ticks = max_ticks
+        self.workers = workers or os.cpu_count()
+        header = {"type": "tournament", "mode": mode, "pacman": pacmen, "ghost": ghosts, "games": games,
+                  "rounds": self.rounds, "seed": seed, "max_ticks": max_ticks}
+        self.log = ResultLog(path, header)
+        self.elo = Elo(list(pacmen) + list(ghosts))
+        self.played = {}
+        for record in self.log.records:
+            self.record(record)
+
+    def record(self, record):
+        self.elo.update(record["pacman"], record["ghost"], record["score"])
+        key = (record["pacman"], record["ghost"])
+        self.played[key] = self.played.get(key, 0) + 1
+
+    def pairs(self, number):
+        if self.mode == "swiss":
+            return swiss_pairs(self.pacmen, self.ghosts, self.elo, self.played)
+        return round_robin_pairs(self.pacmen, self.ghosts)
+
+    def run(self):
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+            for number in range(self.rounds):
+                # a round already on disk keeps its pairings, swiss ones depend
+                # on the ratings at the time
+                matches = self.log.rounds.get(number)
+                if matches is None:
+                    matches = schedule(number, self.pairs(number), self.games, self.seed)
+                    self.log.add_round(number, matches)
+                pending = [match for match in matches if match["id"] not in self.log.matches]
+                if len(pending) < len(matches):
+                    logger.info("round %d: %d of %d matches already played", number, len(matches) - len(pending), len(matches))
+                futures = [pool.submit(play_match, match, self.pacmen[match["pacman"]], self.ghosts[match["ghost"]],
+                                       self.max_ticks) for match in pending]
+                for future in as_completed(futures):
+                    record = future.result()
+                    self.log.add_match(record)
+                    self.record(record)
+                    logger.info("%s: %s in %d ticks, %d points (%.1fs)", record["id"], record["result"],
+                                record["ticks"], record["points"], record["seconds"])
+        self.log.close()
+        return self.elo
+
+
+def print_standings(tournament):
+    elo = tournament.elo
+    print(f"{'agent':24} {'side':7} {'rating':>8} {'games':>6}")
+    for name, rating in elo.standings():
+        side = "pacman" if name in tournament.pacmen else "ghost"
+        print(f"{name:24} {side:7} {rating:8.1f} {elo.games[name]:6d}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play pacman agents against ghost agents headlessly and rate them.')
+    parser.add_argument('--pacman', action='append', required=True,
+                        help=f'Pacman agent, [name=]target[,key=value...]; target is one of {sorted(PACMAN_AGENTS)} or module:factory')
+    parser.add_argument('--ghost', action='append', required=True,
+                        help=f'Ghost agent, same format; built in: {sorted(GHOST_AGENTS)}')
+    parser.add_argument('--mode', default='round-robin', choices=['round-robin', 'swiss'])
+    parser.add_argument('--games', type=int, default=2, help='Games per pairing per round')
+    parser.add_argument('--rounds', type=int, default=None, help='Rounds to play, swiss defaults to the larger pool size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-ticks', type=int, default=DEFAULT_MAX_TICKS, help='Ticks before a game is a draw')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, all cores by default')
+    parser.add_argument('--output', default='tournament.jsonl', help='Results file; an existing one is resumed')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        pacmen = dict(parse_agent(spec, PACMAN_AGENTS) for spec in args.pacman)
+        ghosts = dict(parse_agent(spec, GHOST_AGENTS) for spec in args.ghost)
+        if set(pacmen) & set(ghosts):
+            raise ValueError(f"agent names must differ between sides, name them with name=: "
+                             f"{sorted(set(pacmen) & set(ghosts))}")
+        tournament = Tournament(pacmen, ghosts, args.output, args.mode, args.games, args.rounds, args.seed,
+                                args.max_ticks, args.workers)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    tournament.run()
+    print_standings(tournament)
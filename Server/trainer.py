@@ -0,0 +1,228 @@
+import argparse
+import glob
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from Game import MODEL_PATH
+from model import DQN, ACTION_SIZE, load_model
+from encoding import StateEncoder, STATE_SIZE
+from experience import ReplayBuffer, DEFAULT_CAPACITY
+from checkpoints import CHECKPOINT_DIR, save_checkpoint, latest_checkpoint
+
+logger = logging.getLogger(__name__)
+
+FEED_SIZE = 10000
+BATCH_SIZE = 64
+GAMMA = 0.95
+LEARNING_RATE = 0.001
+TARGET_SYNC = 1000
+PUBLISH_EVERY = 500
+FLUSH_EVERY = 100
+EPSILON = 0.1
+
+
+class ExperienceFeed:
+    # bounded queue from the serving process to the trainer; put() never
+    # blocks, when the trainer falls behind transitions are dropped
+    def __init__(self, maxsize=FEED_SIZE, context=None):
+        context = context or multiprocessing.get_context("spawn")
+        self.queue = context.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, state, action, reward, next_state, done):
+        try:
+            self.queue.put_nowait((state, action, reward, next_state, done))
+        except queue.Full:
+            self.dropped += 1
+
+
+def drain(feed_queue, buffer, limit=FEED_SIZE):
+    transitions = []
+    while len(transitions) < limit:
+        try:
+            transitions.append(feed_queue.get_nowait())
+        except queue.Empty:
+            break
+    if transitions:
+        states, actions, rewards, next_states, dones = zip(*transitions)
+        buffer.push_batch(np.stack(states), actions, rewards, np.stack(next_states), dones)
+    return len(transitions)
+
+
+class Trainer:
+    def __init__(self, buffer, directory=CHECKPOINT_DIR, batch_size=BATCH_SIZE, gamma=GAMMA,
+                 learning_rate=LEARNING_RATE, target_sync=TARGET_SYNC, publish_every=PUBLISH_EVERY,
+                 flush_every=FLUSH_EVERY, prioritized=True):
+        self.buffer = buffer
+        self.directory = directory
+        self.batch_size = batch_size
+        self.gamma = gamma
+        self.target_sync = target_sync
+        self.publish_every = publish_every
+        self.flush_every = flush_every
+        self.prioritized = prioritized
+        self.version, path = latest_checkpoint(directory)
+        self.model = load_model(path or MODEL_PATH)
+        self.model.train()
+        self.target = DQN(STATE_SIZE, ACTION_SIZE)
+        self.target.load_state_dict(self.model.state_dict())
+        self.target.eval()
+        self.optimizer = optim.Adam(self.model.parameters(), lr=learning_rate)
+        self.criterion = nn.MSELoss(reduction='none')
+        self.encoder = StateEncoder(2 * batch_size)
+        self.steps = 0
+        self.last_loss = None
+
+    def train_step(self):
+        if len(self.buffer) < self.batch_size:
+            return None
+        if self.prioritized:
+            batch = self.buffer.sample_prioritized(self.batch_size)
+        else:
+            batch = self.buffer.sample(self.batch_size)
+        states, actions, rewards, next_states, dones, indices, weights = batch
+        count = len(actions)
+        encoded = self.encoder.encode_batch(np.concatenate([states, next_states]))
+        actions = torch.from_numpy(actions)
+        rewards = torch.from_numpy(rewards)
+        dones = torch.from_numpy(dones.astype(np.float32))
+
+        q = self.model(encoded[:count]).gather(1, actions[:, None]).squeeze(1)
+        # double DQN: the online net picks the next action, the target net values it
+        with torch.no_grad():
+            next_actions = self.model(encoded[count:]).argmax(dim=1, keepdim=True)
+            next_q = self.target(encoded[count:]).gather(1, next_actions).squeeze(1)
+            targets = rewards + self.gamma * next_q * (1 - dones)
+        losses = self.criterion(q, targets)
+        loss = (torch.from_numpy(weights) * losses).mean()
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+        if self.prioritized:
+            self.buffer.update_priorities(indices, (targets - q).detach().numpy())
+
+        self.steps += 1
+        if self.steps % self.target_sync == 0:
+            self.target.load_state_dict(self.model.state_dict())
+        if self.steps % self.publish_every == 0:
+            self.publish()
+        elif self.steps % self.flush_every == 0:
+            self.buffer.flush()
+        self.last_loss = loss.item()
+        return self.last_loss
+
+    def publish(self):
+        self.version += 1
+        path = save_checkpoint(self.model, self.version, self.directory)
+        # the buffer on disk keeps up with the published weights
+        self.buffer.flush()
+        logger.info("published checkpoint %d after %d steps (loss %s): %s",
+                    self.version, self.steps, self.last_loss, path)
+        return path
+
+    def act(self, codes, epsilon=EPSILON):
+        count = len(codes)
+        with torch.no_grad():
+            actions = self.model(self.encoder.encode_batch(codes)).argmax(dim=1).numpy()
+        explore = np.random.random(count) < epsilon
+        actions[explore] = np.random.randint(0, ACTION_SIZE, int(explore.sum()))
+        return actions
+
+    # self play in simulation.VecPacmanEnv; after a done the next state is
+    # already the reset board, which is harmless since done masks its value
+    def simulate(self, env, steps=1):
+        states = env.codes().reshape(env.num_envs, -1)
+        for _ in range(steps):
+            actions = self.act(states)
+            _, rewards, dones, _ = env.step(actions)
+            next_states = env.codes().reshape(env.num_envs, -1)
+            self.buffer.push_batch(states, actions, rewards, next_states, dones)
+            states = next_states
+
+    def run(self, feed_queue=None, env=None, max_steps=None, stop=None):
+        while max_steps is None or self.steps < max_steps:
+            if stop is not None and stop.is_set():
+                break
+            if feed_queue is not None:
+                drain(feed_queue, self.buffer)
+            if env is not None:
+                self.simulate(env)
+            if self.train_step() is None:
+                time.sleep(0.1)
+        if self.steps % self.publish_every:
+            self.publish()
+        self.buffer.flush()
+
+
+# SIGTERM (the server stopping its daemon trainer) and ^C let the current
+# step finish, then run() publishes and flushes the replay buffer
+def stop_on_signals():
+    stop = threading.Event()
+
+    def handler(signum, frame):
+        logger.info("trainer stopping on signal %d", signum)
+        stop.set()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, handler)
+    return stop
+
+
+def run_trainer(feed_queue=None, directory=CHECKPOINT_DIR, memory_path=None,
+                memory_capacity=DEFAULT_CAPACITY, envs=0, max_steps=None, **kwargs):
+    logging.basicConfig(level=logging.INFO)
+    stop = stop_on_signals()
+    buffer = ReplayBuffer(memory_capacity, path=memory_path)
+    trainer = Trainer(buffer, directory, **kwargs)
+    env = None
+    if envs:
+        from simulation import VecPacmanEnv
+        env = VecPacmanEnv(envs)
+    trainer.run(feed_queue, env, max_steps, stop)
+
+
+# runs the trainer in its own process so training never shares the GIL
+# with the move path; returns the process and the feed live matches push to
+def start_trainer(**kwargs):
+    context = multiprocessing.get_context("spawn")
+    feed = ExperienceFeed(context=context)
+    process = context.Process(target=run_trainer, args=(feed.queue,), kwargs=kwargs,
+                              name="trainer", daemon=True)
+    process.start()
+    return process, feed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the pacman DQN and publish checkpoints.')
+    parser.add_argument('--checkpoints', default=CHECKPOINT_DIR, help='Directory checkpoints are published to')
+    parser.add_argument('--memory', default=None, help='Directory for a persistent replay buffer')
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help='Replay buffer capacity')
+    parser.add_argument('--replays', default=None, help='Glob of recorded .pacr matches to learn from')
+    parser.add_argument('--envs', type=int, default=0, help='Simulated environments for self play')
+    parser.add_argument('--steps', type=int, default=None, help='Training steps before exiting')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Minibatch size')
+    parser.add_argument('--publish-every', type=int, default=PUBLISH_EVERY, help='Training steps between checkpoints')
+    parser.add_argument('--flush-every', type=int, default=FLUSH_EVERY, help='Training steps between replay buffer flushes')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stop = stop_on_signals()
+    buffer = ReplayBuffer(args.capacity, path=args.memory)
+    if args.replays:
+        from replay import ReplayReader
+        for path in sorted(glob.glob(args.replays)):
+            buffer.extend(ReplayReader(path).transitions())
+        logger.info("loaded %d transitions from replays", len(buffer))
+    trainer = Trainer(buffer, args.checkpoints, batch_size=args.batch_size, publish_every=args.publish_every,
+                      flush_every=args.flush_every)
+    env = None
+    if args.envs:
+        from simulation import VecPacmanEnv
+        env = VecPacmanEnv(args.envs)
+    trainer.run(env=env, max_steps=args.steps, stop=stop)
@@ -0,0 +1,197 @@
+import itertools
+import os
+from harness import benchmark
+
+BATCH_SIZES = [1, 4, 16, 64, 256, 1024]
+SPECTATORS = [0, 1, 10, 100]
+
+
+@benchmark("player_move")
+def player_move():
+    from Game import Board, Player, MOVES
+    board = Board()
+    player = Player(board.player_position())
+    moves = itertools.cycle(MOVES)
+    yield lambda: player.move(board, next(moves))
+
+
+@benchmark("ghost_move")
+def ghost_move():
+    from Game import Board, Ghost, MOVES
+    board = Board()
+    ghost = Ghost(board.ghost_positions()['a'], 'a')
+    moves = itertools.cycle(MOVES)
+    yield lambda: ghost.move(board, next(moves))
+
+
+@benchmark("resolve_moves")
+def resolve():
+    from Game import Board, Player, Ghost, MOVES, resolve_moves
+    board = Board()
+    player = Player(board.player_position())
+    ghosts = [Ghost(pos, id) for id, pos in board.ghost_positions().items()]
+    moves = itertools.cycle(MOVES)
+    yield lambda: resolve_moves(board, player, ghosts, next(moves), [next(moves)] * 4)
+
+
+@benchmark("get_state")
+def get_state():
+    from Game import Board, PacmanAI
+    board = Board()
+    ai = PacmanAI(memory_capacity=1)
+    yield lambda: ai.get_state(board)
+
+
+@benchmark("dqn_forward", BATCH_SIZES)
+def dqn_forward(batch_size):
+    import numpy as np
+    import torch
+    from Game import Board
+    from encoding import StateEncoder
+    from model import load_model
+    model = load_model()
+    codes = np.repeat(Board().codes().reshape(1, -1), batch_size, axis=0)
+    states = StateEncoder(batch_size).encode_batch(codes)
+
+    def forward():
+        with torch.inference_mode():
+            return model(states).argmax(dim=1)
+    yield forward
+
+
+@benchmark("ghost_ai")
+def ghost_ai():
+    from Game import Board, GhostAI
+    board = Board()
+    ai = GhostAI()
+    ai.get_ai_moves(board)
+    yield lambda: ai.get_ai_moves(board)
+
+
+@benchmark("move_route")
+def move_route():
+    import main
+    match = main.registry.create()
+    match.connect("player", "bench")
+    client = main.app.test_client()
+    headers = {"Authorization": f"Bearer {match.player_token}"}
+    queue = match.queues["player"]
+
+    def post():
+        response = client.post("/move/player", json="left", headers=headers)
+        queue.clear()
+        return response
+    yield post
+    main.registry.remove(match.id)
+
+
+# one broadcast() of a match to n spectators in each mode; the test client
+# encodes every packet like the real transport, its inbox is emptied per call
+@benchmark("broadcast", [(mode, spectators) for mode in ["full", "delta", "binary"] for spectators in SPECTATORS])
+def broadcast(mode, spectators):
+    import main
+    match = main.registry.create()
+    auth = {"capabilities": [] if mode == "full" else [mode]}
+    clients = [
+        main.socketio.test_client(main.app, query_string=f"match={match.id}", auth=auth)
+        for _ in range(spectators)
+    ]
+
+    def send():
+        match.broadcast()
+        for client in clients:
+            client.queue.clear()
+    yield send
+    for client in clients:
+        client.disconnect()
+    main.registry.remove(match.id)
+
+
+# a board and the board one tick later: pacman stepped right onto a pellet
+def tick_boards():
+    from Game import Board, Player, EMPTY
+    before = Board()
+    before.place(0, 1, 1)
+    before.grid[1, 1] = EMPTY
+    after = before.clone()
+    player = Player(after.player_position())
+    player.move(after, "right")
+    return (before, 0), (after, player.points)
+
+
+# building and serializing one tick's frame per mode, alternating between the
+# two tick_boards(); bytes is the payload size.
+# Binary frames are about 40x smaller than full boards (24 vs 997 bytes) but
+# only about 2.5x cheaper to encode and 3x cheaper to decode, short of the
+# 10x the binary mode was asked for. The broadcast benchmarks show why: past a
+# few spectators the per-client Socket.IO send dominates, and the three modes
+# end up within about 10% of each other at 100 spectators.
+@benchmark("frame_encode", ["full", "delta", "binary"])
+def frame_encode(mode):
+    import json
+    from broadcast import BoardStream
+    first, second = tick_boards()
+    stream = BoardStream(first[0])
+    states = itertools.cycle([second, first])
+
+    def full():
+        board, points = next(states)
+        return json.dumps([board.get_board(), points])
+
+    def delta():
+        stream.advance(*next(states))
+        return json.dumps(stream.delta())
+
+    def binary():
+        board, points = next(states)
+        stream.advance(board, points, codes=False)
+        return stream.binary_delta()
+    encode = {"full": full, "delta": delta, "binary": binary}[mode]
+    yield encode, {"bytes": len(encode())}
+
+
+# what a Python client does with one tick's frame, see clients/board_sync.py
+@benchmark("frame_decode", ["full", "delta", "binary"])
+def frame_decode(mode):
+    import json
+    import sys
+    from harness import ROOT
+    from broadcast import BoardStream
+    sys.path.insert(0, os.path.join(ROOT, 'clients'))
+    from board_sync import BoardSync
+    first, second = tick_boards()
+    stream = BoardStream(first[0])
+    sync = BoardSync()
+    if mode == "full":
+        payload = json.dumps([second[0].get_board(), second[1]])
+        yield lambda: [list(row) for row in json.loads(payload)[0]]
+        return
+    if mode == "delta":
+        sync.keyframe(stream.keyframe())
+        stream.advance(*second)
+        payload = json.dumps(stream.delta())
+        apply = lambda: sync.apply(json.loads(payload))
+    else:
+        sync.binary(stream.binary_keyframe())
+        stream.advance(*second)
+        payload = stream.binary_delta()
+        apply = lambda: sync.binary(payload)
+
+    # the same delta again, so rewind the sequence each call
+    def decode():
+        sync.seq = stream.seq - 1
+        return apply()
+    yield decode
+
+
+@benchmark("metrics_stage", ["off", "on"])
+def metrics_stage(state):
+    import metrics
+    was_enabled = metrics.enabled
+    metrics.enabled = state == "on"
+
+    def stage():
+        started = metrics.start()
+        metrics.STAGE_SECONDS.observe_since(started, "bench")
+    yield stage
+    metrics.enabled = was_enabled
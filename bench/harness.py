@@ -0,0 +1,138 @@
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from importlib import metadata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(ROOT, 'Server')
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_THRESHOLD = 0.25
+REPEAT = 5
+MIN_TIME = 0.05
+
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+benchmarks = {}
+
+
+# setup(param) is a generator: it builds state, yields the callable to time
+# (or the callable and a dict of extra values to report, such as sizes) and
+# cleans up after the yield; one entry is registered per param. A tuple param
+# is passed as separate arguments and named like broadcast[binary-100].
+def benchmark(name, params=None):
+    def register(setup):
+        for param in params or [None]:
+            if param is None:
+                key = name
+            elif isinstance(param, tuple):
+                key = f"{name}[{'-'.join(map(str, param))}]"
+            else:
+                key = f"{name}[{param}]"
+            benchmarks[key] = (setup, param)
+        return setup
+    return register
+
+
+# like timeit.autorange: grow the loop count until one sample takes
+# MIN_TIME, then keep the per call times of REPEAT samples
+def measure(fn, repeat=REPEAT, min_time=MIN_TIME):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        "median_us": statistics.median(samples) * 1e6,
+        "min_us": min(samples) * 1e6,
+        "mean_us": statistics.mean(samples) * 1e6,
+        "stdev_us": statistics.stdev(samples) * 1e6 if len(samples) > 1 else 0.0,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def run_benchmark(name, repeat=REPEAT, min_time=MIN_TIME):
+    setup, param = benchmarks[name]
+    if param is None:
+        steps = setup()
+    elif isinstance(param, tuple):
+        steps = setup(*param)
+    else:
+        steps = setup(param)
+    fn = next(steps)
+    info = {}
+    if isinstance(fn, tuple):
+        fn, info = fn
+    try:
+        return dict(measure(fn, repeat, min_time), **info)
+    finally:
+        steps.close()
+
+
+# module -> distribution; versions come from the installed metadata since
+# not every package sets __version__
+LIBRARIES = {"numpy": "numpy", "torch": "torch", "flask": "Flask", "flask_socketio": "Flask-SocketIO"}
+
+
+def environment():
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    for module, distribution in LIBRARIES.items():
+        if module in sys.modules:
+            try:
+                info[module] = metadata.version(distribution)
+            except metadata.PackageNotFoundError:
+                info[module] = getattr(sys.modules[module], "__version__", None)
+    return info
+
+
+# (name, baseline, current) for every version both runs recorded that
+# differs; timings across library versions are not comparable
+def environment_mismatches(current, baseline):
+    return [
+        (name, baseline[name], current[name])
+        for name in ["python"] + list(LIBRARIES)
+        if baseline.get(name) is not None and current.get(name) is not None and baseline[name] != current[name]
+    ]
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+# a benchmark regresses when its median is more than threshold slower
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    rows = []
+    for name, current in results["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            rows.append((name, None, current["median_us"], None, False))
+            continue
+        ratio = current["median_us"] / previous["median_us"]
+        rows.append((name, previous["median_us"], current["median_us"], ratio, ratio > 1 + threshold))
+    return rows
@@ -0,0 +1,70 @@
+import argparse
+import fnmatch
+import logging
+import os
+import sys
+import harness
+import benchmarks  # noqa: F401, registers the benchmarks
+from harness import BASELINE_PATH, DEFAULT_THRESHOLD, REPEAT, MIN_TIME
+
+
+def print_results(results):
+    for name, result in results["results"].items():
+        extra = f"  {result['bytes']} bytes" if "bytes" in result else ""
+        print(f"{name:28} {result['median_us']:12.2f} us  (min {result['min_us']:.2f}, x{result['number']}){extra}")
+
+
+def print_comparison(rows, threshold):
+    print(f"\n{'benchmark':28} {'baseline us':>12} {'current us':>12} {'ratio':>7}")
+    for name, previous, current, ratio, regressed in rows:
+        if previous is None:
+            print(f"{name:28} {'-':>12} {current:12.2f} {'new':>7}")
+            continue
+        flag = f"  REGRESSION (> {1 + threshold:.2f}x)" if regressed else ""
+        print(f"{name:28} {previous:12.2f} {current:12.2f} {ratio:7.2f}{flag}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the server benchmarks.')
+    parser.add_argument('-k', '--filter', default='*', help='Only run benchmarks matching this glob')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Allowed slowdown, 0.25 = 25%%')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='Samples per benchmark')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, help='Seconds per sample')
+    parser.add_argument('--ignore-environment', action='store_true',
+                        help='Gate on the baseline even if it was recorded with other library versions')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # main.py and the model paths expect to run from Server/
+    os.chdir(harness.SERVER_DIR)
+    names = [name for name in harness.benchmarks if fnmatch.fnmatch(name, args.filter)]
+    results = {"results": {}}
+    for name in names:
+        results["results"][name] = harness.run_benchmark(name, args.repeat, args.min_time)
+        print(f"{name:28} {results['results'][name]['median_us']:12.2f} us", file=sys.stderr)
+    results["environment"] = harness.environment()
+
+    if args.output:
+        harness.save_results(results, args.output)
+    if args.save_baseline:
+        harness.save_results(results, args.baseline)
+        print(f"baseline saved to {args.baseline}")
+        sys.exit(0)
+    print_results(results)
+    if not os.path.exists(args.baseline):
+        print(f"\nno baseline at {args.baseline}, run with --save-baseline to create one")
+        sys.exit(0)
+    baseline = harness.load_results(args.baseline)
+    rows = harness.compare(results, baseline, args.threshold)
+    print_comparison(rows, args.threshold)
+    mismatches = harness.environment_mismatches(results["environment"], baseline.get("environment", {}))
+    if mismatches and not args.ignore_environment:
+        print(f"\nWARNING: {args.baseline} was recorded on different versions, not gating on it:")
+        for name, previous, current in mismatches:
+            print(f"  {name}: baseline {previous}, current {current}")
+        print("re-record it here with --save-baseline, or pass --ignore-environment to gate anyway")
+        sys.exit(0)
+    sys.exit(1 if any(row[4] for row in rows) else 0)
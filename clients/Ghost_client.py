@@ -2,6 +2,7 @@ import socketio
 import requests
 import os
 import time 
+from board_sync import BoardSync
 
 link = "http://127.0.0.1:5000"
 
@@ -11,6 +12,9 @@ name = input('Enter your name: ')
 
 sio = socketio.Client()
 connected = False
+sync = BoardSync()
+http = requests.Session()
+http.headers.update({'content-type': 'application/json', 'Authorization': f'Bearer {token}'})
 @sio.event
 def connect():
     global connected
@@ -40,6 +44,38 @@ def handle_server_message(data):
     board,points = data
     process(board,points)
 
+@sio.on('board-keyframe')
+def handle_keyframe(data):
+    if not connected:
+        print("Not connected yet,ignoring message")
+        return
+    sync.keyframe(data)
+    process(sync.get_board(),sync.points)
+
+@sio.on('board-delta')
+def handle_delta(data):
+    if not connected:
+        print("Not connected yet,ignoring message")
+        return
+    status = sync.apply(data)
+    if status is False:
+        sio.emit('resync')
+    if not status:
+        return
+    process(sync.get_board(),sync.points)
+
+@sio.on('board-binary')
+def handle_binary(data):
+    if not connected:
+        print("Not connected yet,ignoring message")
+        return
+    status = sync.binary(data)
+    if status is False:
+        sio.emit('resync')
+    if not status:
+        return
+    process(sync.get_board(),sync.points)
+
 @sio.on('reset')
 def reset():
 
@@ -52,14 +88,17 @@ def process(board,points):
     send_move(move)
 
 def send_move(move):
-   url = f"{link}/move/ghost"
-   payload = move
-   headers = {'content-type': 'application/json', 'Authorization': f'Bearer {token}'}
-   response = requests.post(url, json=payload, headers=headers)
+   if connected:
+      try:
+         print(sio.call('move', move, timeout=5))
+         return
+      except socketio.exceptions.TimeoutError:
+         print("Socket move timed out, falling back to HTTP")
+   response = http.post(f"{link}/move/ghost", json=move)
    print(response.text)
 
 
-sio.connect(link,headers={'Authorization': f'Bearer {token}','Name':name})
+sio.connect(link,headers={'Authorization': f'Bearer {token}','Name':name},auth={'capabilities':['binary','delta']})
 
 sio.wait()
 
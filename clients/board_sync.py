@@ -0,0 +1,78 @@
+import struct
+
+# must match the binary frame layout in Server/broadcast.py
+CELL_CHARS = " #.opabcd"
+ENTITY_IDS = "pabcd"
+BINARY_VERSION = 1
+KEYFRAME = 1
+HEADER = struct.Struct("<BBBBII")
+
+
+class BoardSync:
+    def __init__(self):
+        self.board = None
+        self.seq = None
+        self.points = 0
+        self.entities = {}
+        self.terrain = None
+
+    def keyframe(self, data):
+        self.board = [list(row) for row in data['board']]
+        self.seq = data['seq']
+        self.points = data['points']
+        self.entities = data['entities']
+
+    # True when applied, False on a sequence gap (caller should resync),
+    # None when the delta is ignored while waiting for a keyframe
+    def apply(self, data):
+        if self.seq is None or data['seq'] <= self.seq:
+            return None
+        if data['seq'] != self.seq + 1:
+            self.seq = None
+            return False
+        for x, y, char in data['cells']:
+            self.board[x][y] = char
+        self.seq = data['seq']
+        self.points = data['points']
+        self.entities = data['entities']
+        return True
+
+    # 'board-binary' frames carry terrain only; entities are drawn on top from
+    # their positions. Returns like apply(), a keyframe always applies.
+    def binary(self, data):
+        version, flags, rows, cols, seq, points = HEADER.unpack_from(data)
+        if version != BINARY_VERSION:
+            raise ValueError(f"unsupported binary frame version {version}")
+        offset = HEADER.size + 2 * len(ENTITY_IDS)
+        positions = data[HEADER.size:offset]
+        if flags & KEYFRAME:
+            cells = []
+            for byte in data[offset:]:
+                cells.append(byte >> 4)
+                cells.append(byte & 15)
+            self.terrain = [cells[row * cols:(row + 1) * cols] for row in range(rows)]
+            self.board = [[CELL_CHARS[code] for code in row] for row in self.terrain]
+        else:
+            if self.seq is None or seq <= self.seq:
+                return None
+            if seq != self.seq + 1:
+                self.seq = None
+                return False
+            # uncover the cells the entities stood on, then apply the changes
+            for x, y in self.entities.values():
+                self.board[x][y] = CELL_CHARS[self.terrain[x][y]]
+            for (change,) in struct.iter_unpack("<H", data[offset:]):
+                x, y = divmod(change & 0xFFF, cols)
+                self.terrain[x][y] = change >> 12
+                self.board[x][y] = CELL_CHARS[change >> 12]
+        self.seq = seq
+        self.points = points
+        self.entities = {id: [positions[2 * i], positions[2 * i + 1]] for i, id in enumerate(ENTITY_IDS)}
+        # ghosts first so pacman is drawn on top
+        for id in reversed(ENTITY_IDS):
+            x, y = self.entities[id]
+            self.board[x][y] = id
+        return True
+
+    def get_board(self):
+        return [''.join(row) for row in self.board]